@@ -14,11 +14,12 @@ import numpy as np
 import matplotlib._cntr as _contour
 
 
-from matplotlib.path import Path
-from scipy.spatial.distance import pdist, squareform
+from scipy.spatial import cKDTree
 
 import cv2
 
+import interpolation.polygon as polygon
+
 def detect_contour_old(img, level, with_hierarchy = False):
   """Returns list of vertices of contours at a given level
   
@@ -64,17 +65,14 @@ def detect_contour(img, level, with_hierarchy = False):
   if not with_hierarchy:
     return contours;
 
+  # test the first points of all contours against each contour at once
   n = len(contours);
   h = np.zeros((n,n), dtype = bool);
-  for i,c in enumerate(contours):
-    for j,c2 in enumerate(contours):
-      if i==j:
-        h[i,j] = 0;
-      else:
-        if inside(c, c2[0]):
-          h[i,j] = 1;
-        else:
-          h[i,j] = 0;
+  if n > 0:
+    firsts = np.array([c[0] for c in contours]);
+    for i,c in enumerate(contours):
+      h[i] = polygon.inside_polygon(c, firsts, rule = 'evenodd');
+    h[np.diag_indices(n)] = False;
   return contours, h
       
 
@@ -87,46 +85,77 @@ def inside(contour, point):
 
 
 def inside_polygon(vertices, point):
-  """Checks if a point is inside a polygon
+  """Checks if points are inside polygons
   
   Arguments:
-    vertices (nx2 array): vertices of the polygon
-    point (2 array or dx2 array): coordinates of the point
+    vertices (nx2 array or ...xnx2 array): vertices of the polygon(s)
+    point (2 array or ...xdx2 array): coordinates of the point(s)
     
   Returns:
-    bool: True if point is inside the polygon
-  """
+    bool or ...xd array of bools: True if point is inside the polygon
   
-  p = Path(vertices);
-  if point.ndim == 1:
-    return p.contains_point(point);
-  else:
-    return p.contains_points(point);
+  Note:
+    Vectorized winding number test (even-odd rule as matplotlib's Path), 
+    many points can be tested against many polygons by broadcasting, 
+    see :func:`interpolation.polygon.inside_polygon`.
+  """
+  return polygon.inside_polygon(vertices, point, rule = 'evenodd');
     
     
-def sort_points_to_line(vertices, start = 0):
+def sort_points_to_line(vertices, start = 0, k = 8):
   """Sorts points to a line by sequentiall connecting nearest points
   
   Arguments:
     vertices (nx2 array): vertices of the line
     start (int): start index
+    k (int): number of nearest neighbours to query initially for each point
   
   Returns:
     nx2 array: sorted points
+    
+  Note:
+    The nearest unvisited point is found among the k nearest neighbours of 
+    each point from a single KD-tree query, at dead ends the query is repeated 
+    with doubled k until an unvisited point is found. Memory is linear in the 
+    number of points.
   """
+  vertices = np.asarray(vertices);
+  n = vertices.shape[0];
+  if n == 0:
+    return vertices;
+  
+  tree = cKDTree(vertices);
+  unvisited = np.ones(n, dtype = bool);
+  
+  def neighbours(points, kq):
+    """Nearest neighbours sorted by exact distance with ties resolved by index as for a full distance matrix"""
+    idx = np.asarray(tree.query(points, k = kq)[1]).reshape(len(points), kq);
+    dist = np.sqrt(np.sum((vertices[idx] - points[:,np.newaxis])**2, axis = -1));
+    order = np.lexsort((idx, dist));
+    return np.take_along_axis(idx, order, axis = -1), np.take_along_axis(dist, order, axis = -1);
   
-  d = squareform(pdist(vertices));
+  # neighbours of all points in one query, only dead ends need larger queries
+  k = min(k, n);
+  nbs, nbs_dist = neighbours(vertices, k);
   
   i = start;
-  n = vertices.shape[0];
-  uidx = np.ones(n, dtype = bool);
-  uidx[i] = False;
-  sidx = [i];  
-    
-  while np.sum(uidx) > 0:
-    i = np.argmin(d[i][uidx]);
-    i = np.where(uidx)[0][i];
+  unvisited[i] = False;
+  sidx = [i];
+  
+  for s in range(n-1):
+    idx, dist = nbs[i], nbs_dist[i];
+    kq = k;
+    while True:
+      free = unvisited[idx];
+      if np.any(free):
+        j = np.argmax(free);
+        if dist[j] < dist[-1] or kq == n: # all points at this distance were queried
+          i = idx[j];
+          break;
+      kq = min(2 * kq, n);
+      idx, dist = neighbours(vertices[i:i+1], kq);
+      idx, dist = idx[0], dist[0];
     sidx.append(i);
-    uidx[i] = False;
+    unvisited[i] = False;
   
   return vertices[sidx];
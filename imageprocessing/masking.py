@@ -38,7 +38,117 @@ def mask_to_phi(mask):
   
   phi = mask_to_dist(mask) - mask_to_dist(1 - mask) + np.asarray(mask, dtype = float)/mask.max() - 0.5
   return phi   
+
+
+
+def mask_to_phi_band(mask, band = 3):
+  """Returns distance transform to the contour of masks within a narrow band
+  
+  Arguments:
+    mask (...xhxw array): one or many masks
+    band (int or all): width of the band around the contour in pixel, if all calculate full distance transform
+  
+  Returns:
+    array: distance transform to the contour of the masks, clipped to [0.5-band, band-0.5]
+  
+  Note:
+    Within the band the result agrees with :func:`mask_to_phi`. The distance 
+    transforms are only calculated in the bounding boxes of the masks extended
+    by the band, which for many masks are gathered into a single array of 
+    equally sized boxes.
+  """
+  mask = np.asarray(mask, dtype = bool);
+  shape = mask.shape;
+  mask = np.reshape(mask, (-1,) + shape[-2:]);
+  nb = mask.shape[0];
+  h, w = shape[-2:];
+  
+  if band is all:
+    phi = np.asarray(mask, dtype = float) - 0.5;
+    for m, p in zip(mask, phi):
+      p += nd.distance_transform_edt(np.logical_not(m)) - nd.distance_transform_edt(m);
+    return np.reshape(phi, shape);
+  
+  # bounding boxes extended by the band 
+  rows = np.any(mask, axis = 2); cols = np.any(mask, axis = 1);
+  ymin = np.argmax(rows, axis = 1); ymax = h - 1 - np.argmax(rows[:,::-1], axis = 1);
+  xmin = np.argmax(cols, axis = 1); xmax = w - 1 - np.argmax(cols[:,::-1], axis = 1);
+  empty = np.logical_not(np.any(rows, axis = 1));
+  ymax[empty] = ymin[empty]; xmax[empty] = xmin[empty];
+  
+  ch = min(h, np.max(ymax - ymin) + 2 * band + 3);
+  cw = min(w, np.max(xmax - xmin) + 2 * band + 3);
+  oy = np.clip(ymin - band - 1, 0, h - ch);
+  ox = np.clip(xmin - band - 1, 0, w - cw);
+  
+  ids = np.arange(nb)[:,np.newaxis,np.newaxis];
+  iy = (oy[:,np.newaxis] + np.arange(ch))[:,:,np.newaxis];
+  ix = (ox[:,np.newaxis] + np.arange(cw))[:,np.newaxis,:];
+  crop = mask[ids, iy, ix];
+  
+  phi_crop = np.full(crop.shape, band - 0.5);
+  for i in np.where(np.logical_not(empty))[0]:
+    c = crop[i];
+    phi_crop[i] = np.minimum(nd.distance_transform_edt(np.logical_not(c)), band) - np.minimum(nd.distance_transform_edt(c), band) + c - 0.5;
+  
+  phi = np.full(mask.shape, band - 0.5);
+  phi[ids, iy, ix] = phi_crop;
+  return np.reshape(phi, shape);
+
+
+def mask_from_polygon(polygon, size):
+  """Rasterizes closed polygons in a single pass using the non-zero winding rule
+  
+  Arguments:
+    polygon (...xmx2 array): vertices of the polygons as (x,y) coordinates
+    size (tuple): size (h,w) of the masks
+  
+  Returns:
+    array (...xhxw): masks, True for pixel centers inside the polygons
     
+  Note:
+    In contrast to filling with the even-odd rule, self-overlapping parts of
+    a polygon are filled, so the outline of a shape composed of equally 
+    oriented pieces gives the union of the pieces.
+  """
+  polygon = np.asarray(polygon, dtype = float);
+  shape = polygon.shape[:-2];
+  polygon = np.reshape(polygon, (-1,) + polygon.shape[-2:]);
+  nb = polygon.shape[0];
+  h, w = size;
+  mask = np.zeros((nb, h, w), dtype = bool);
+  
+  # restrict to pixel rows and columns covered by the polygons
+  y0 = int(max(np.ceil(np.min(polygon[...,1])), 0));
+  y1 = int(min(np.floor(np.max(polygon[...,1])) + 1, h));
+  x0 = int(max(np.ceil(np.min(polygon[...,0])), 0));
+  x1 = int(min(np.floor(np.max(polygon[...,0])) + 1, w));
+  if y1 <= y0 or x1 <= x0:
+    return np.reshape(mask, shape + (h, w));
+  nh, nw = y1 - y0, x1 - x0;
+  
+  # crossings of edges with pixel rows
+  start = polygon - [x0, y0];
+  end = np.roll(start, -1, axis = 1);
+  sy = start[...,1,np.newaxis]; ey = end[...,1,np.newaxis];
+  y = np.arange(nh);
+  up   = np.logical_and(sy <= y, y < ey);
+  down = np.logical_and(ey <= y, y < sy);
+  b, e, r = np.where(np.logical_or(up, down));
+  
+  sx = start[b,e,0]; sy = start[b,e,1]; ex = end[b,e,0]; ey = end[b,e,1];
+  xc = sx + (r - sy) * (ex - sx) / (ey - sy);
+  col = np.clip(np.ceil(xc), 0, nw).astype(int);
+  direction = np.where(up[b,e,r], 1, -1);
+  
+  # winding number from accumulated crossings left of each pixel
+  index = (b * nh + r) * (nw + 1) + col;
+  winding = np.bincount(index, weights = direction, minlength = nb * nh * (nw + 1));
+  winding = np.cumsum(np.reshape(winding, (nb, nh, nw + 1))[:,:,:nw], axis = 2);
+  mask[:, y0:y1, x0:x1] = np.abs(winding) > 0.5;
+  
+  return np.reshape(mask, shape + (h, w));
+  
 
 # Compute curvature
 def curvature_from_phi(phi, idx = all):
@@ -2,8 +2,9 @@
 """
 Skeleton to Graph transforms
 
-This module provides fast routines to convert 3d skeletons
-to graphs, optimize and plot them.
+This module provides fast routines to convert 2d/3d skeletons
+to sparse adjacency matrices and graphs, extract branches and 
+paths, optimize and plot them.
 """
 __license__ = 'MIT License <http://www.opensource.org/licenses/mit-license.php>'
 __author__ = 'Christoph Kirst <ckirst@rockefeller.edu>'
@@ -12,6 +13,9 @@ __docformat__ = 'rest'
 
 import numpy as np
 import networkx as nx
+import scipy.sparse as sparse
+from scipy.sparse.csgraph import connected_components, dijkstra, minimum_spanning_tree
+import scipy.ndimage as ndi
 #from mayavi import mlab
 
 
@@ -117,6 +121,152 @@ def skeleton_to_list(skeleton, with_neighborhoods = True):
       return ids;
 
 
+def _neighbour_offsets(dim):
+  """Offsets to half of the neighbours in a 3^dim neighbourhood, each edge is found once"""
+  offsets = np.array(np.meshgrid(*[[-1,0,1]] * dim, indexing = 'ij')).reshape(dim, -1).T;
+  first = np.array([o[np.nonzero(o)[0][0]] if np.any(o) else 0 for o in offsets]);
+  return offsets[first > 0];
+
+
+def skeleton_to_sparse(skeleton, weighted = True):
+  """Converts a binary skeleton image to a sparse adjacency matrix
+  
+  Arguments:
+    skeleton (array): 2d/3d binary skeleton image
+    weighted (bool): if True the entries are the distances between the pixels, otherwise ones
+    
+  Returns:
+    nxd array: coordinates of the skeleton pixels (in the order of np.where)
+    nxn csr matrix: symmetric adjacency matrix of the 8 / 26 connected pixels
+    
+  Note:
+    The neighbours of all pixels are found by comparing shifted copies of 
+    the skeleton, one for each neighbour direction. The border of the 
+    skeleton does not need to be zero.
+  """
+  skeleton = np.asarray(skeleton, dtype = bool);
+  dim = skeleton.ndim;
+  if dim != 2 and dim != 3:
+    raise ValueError('skeleton should be 2d or 3d, found %d' % dim);
+  
+  coords = np.transpose(np.where(skeleton));
+  npts = len(coords);
+  index = -np.ones(skeleton.shape, dtype = int);
+  index[tuple(coords.T)] = np.arange(npts);
+  
+  rows = []; cols = []; weights = [];
+  for o in _neighbour_offsets(dim):
+    src = tuple(slice(max(-d,0), skeleton.shape[k] - max(d,0)) for k,d in enumerate(o));
+    dst = tuple(slice(max(d,0), skeleton.shape[k] - max(-d,0)) for k,d in enumerate(o));
+    a = index[src]; b = index[dst];
+    edge = np.logical_and(a >= 0, b >= 0);
+    rows.append(a[edge]); cols.append(b[edge]);
+    weights.append(np.full(np.count_nonzero(edge), np.linalg.norm(o) if weighted else 1.0));
+  
+  rows = np.hstack(rows); cols = np.hstack(cols); weights = np.hstack(weights);
+  adjacency = sparse.coo_matrix((np.hstack([weights, weights]), (np.hstack([rows, cols]), np.hstack([cols, rows]))), shape = (npts, npts));
+  return coords, adjacency.tocsr();
+
+
+def skeleton_degrees(adjacency):
+  """Number of neighbours of each skeleton pixel"""
+  return np.diff(adjacency.indptr);
+
+
+def skeleton_end_points(adjacency):
+  """Ids of the end points (a single neighbour) of the skeleton"""
+  return np.where(skeleton_degrees(adjacency) == 1)[0];
+
+
+def skeleton_branch_points(adjacency):
+  """Ids of the branch points (more than two neighbours) of the skeleton"""
+  return np.where(skeleton_degrees(adjacency) > 2)[0];
+
+
+def skeleton_branches(adjacency):
+  """Ordered branches of a skeleton between branch and end points
+  
+  Arguments:
+    adjacency (nxn sparse matrix): adjacency matrix, e.g. from :func:`skeleton_to_sparse`
+    
+  Returns:
+    list of arrays: ordered ids of the pixels in each branch (without the branch points)
+    array: ids of the branch points
+    array: ids of the end points
+    
+  Note:
+    Removing the branch points splits the skeleton into simple lines and loops.
+    All lines are ordered at once by the graph distance from one of their end
+    points. Loops are opened at their first pixel.
+  """
+  adjacency = sparse.csr_matrix(adjacency);
+  degree = skeleton_degrees(adjacency);
+  branch_points = np.where(degree > 2)[0];
+  end_points = np.where(degree == 1)[0];
+  
+  keep = sparse.diags(np.asarray(degree <= 2, dtype = float));
+  lines = (keep * adjacency * keep).tocsr();
+  lines.eliminate_zeros();
+  
+  nodes = np.where(degree <= 2)[0];
+  if len(nodes) == 0:
+    return [], branch_points, end_points;
+  labels = connected_components(lines, directed = False)[1][nodes];
+  
+  # start at an end point of each line, lines without end points are loops
+  line_degree = skeleton_degrees(lines)[nodes];
+  label_ids, first = np.unique(labels, return_index = True);
+  ends = line_degree <= 1;
+  end_labels, end_first = np.unique(labels[ends], return_index = True);
+  starts = nodes[first];
+  starts[np.searchsorted(label_ids, end_labels)] = nodes[ends][end_first];
+  
+  loops = np.setdiff1d(label_ids, end_labels);
+  if len(loops) > 0:
+    lines = lines.tolil();
+    for l in np.searchsorted(label_ids, loops):
+      s = starts[l]; t = lines.rows[s][0];
+      lines[s,t] = 0; lines[t,s] = 0;
+    lines = lines.tocsr();
+    lines.eliminate_zeros();
+  
+  distance = dijkstra(lines, directed = False, indices = starts, unweighted = True, min_only = True)[nodes];
+  order = np.lexsort((distance, labels));
+  splits = np.where(np.diff(labels[order]) != 0)[0] + 1;
+  return np.split(nodes[order], splits), branch_points, end_points;
+
+
+def skeleton_longest_path(adjacency):
+  """Longest shortest path in the largest component of the skeleton
+  
+  Arguments:
+    adjacency (nxn sparse matrix): adjacency matrix, e.g. from :func:`skeleton_to_sparse`
+    
+  Returns:
+    array: ordered ids of the pixels along the path
+    
+  Note:
+    Uses two sweeps of Dijkstra's algorithm which is exact for trees, i.e. 
+    skeletons without loops.
+  """
+  npts = adjacency.shape[0];
+  if npts == 0:
+    return np.zeros(0, dtype = int);
+  
+  labels = connected_components(adjacency, directed = False)[1];
+  start = np.where(labels == np.argmax(np.bincount(labels)))[0][0];
+  
+  distance = dijkstra(adjacency, directed = False, indices = start);
+  first = np.argmax(np.where(np.isfinite(distance), distance, -1));
+  distance, predecessors = dijkstra(adjacency, directed = False, indices = first, return_predecessors = True);
+  last = np.argmax(np.where(np.isfinite(distance), distance, -1));
+  
+  path = [last];
+  while path[-1] != first:
+    path.append(predecessors[path[-1]]);
+  return np.array(path[::-1], dtype = int);
+
+
 from collections import OrderedDict
 
 def skeleton_to_adjacency(skeleton):
@@ -128,24 +278,80 @@ def skeleton_to_adjacency(skeleton):
   Returns:
     dict: dict of adjacency information with entries node_id : [neighbours]
   """
+  coords, adjacency = skeleton_to_sparse(skeleton, weighted = False);
   
-  ids,nh = skeleton_to_list(skeleton, with_neighborhoods = True);
- 
   adj = OrderedDict(); 
-  if len(ids) == 0:
-    return adj;
-    #return nx.from_dict_of_lists(adj);
-  elif len(ids) == 1:
-    adj[tuple(ids[0])] = [];
-    return adj;
-    #return nx.from_dict_of_lists(adj);
-  else:
-    for i,pos in enumerate(ids):
-      posnh = np.where(nh[i]);
-      adj[tuple(pos)] = [tuple(p + pos -1) for p in np.transpose(posnh)]
-    return adj;
+  nodes = [tuple(c) for c in coords.tolist()];
+  indptr, indices = adjacency.indptr, adjacency.indices;
+  for i,p in enumerate(nodes):
+    adj[p] = [nodes[j] for j in indices[indptr[i]:indptr[i+1]]];
+  return adj;
+    
     
+def skeleton_to_line(skeleton, prune = False):
+  """Orders the pixels of a 2d skeleton that forms a simple line
+  
+  Arguments:
+    skeleton (array): 2d binary skeleton image
+    prune (bool): if True branched skeletons are reduced to their longest path
     
+  Returns:
+    nx2 array or None: coordinates of the skeleton pixels ordered from one end point 
+                       to the other, None if the skeleton is not a single line
+                       
+  Note:
+    Simple lines are walked directly which is faster than the sparse graph 
+    routines for the small skeletons of single frames.
+    For pruning, loops are detected as holes in the skeleton, i.e. background 
+    regions not connected to the border, so that the pixel triangles at 8 
+    connected junctions are not counted as loops. The longest path is taken
+    in the minimum spanning tree of the skeleton pixels.
+  """
+  if skeleton.ndim != 2:
+    raise ValueError('skeleton should be 2d, found %d' % skeleton.ndim);
+  
+  skel = np.pad(np.asarray(skeleton, dtype = bool), 1, mode = 'constant');
+  ids = np.transpose(np.where(skel));
+  npts = len(ids);
+  if npts <= 1:
+    return ids - 1;
+  
+  index = -np.ones(skel.shape, dtype = int);
+  index[ids[:,0], ids[:,1]] = np.arange(npts);
+  
+  # neighbour ids of all pixels at once, -1 for background
+  offsets = np.array([[-1,-1], [-1,0], [-1,1], [0,-1], [0,1], [1,-1], [1,0], [1,1]]);
+  nbs = ids[:,np.newaxis,:] + offsets[np.newaxis,:,:];
+  nbs = index[nbs[...,0], nbs[...,1]];
+  
+  degree = np.sum(nbs >= 0, axis = 1);
+  ends = np.where(degree == 1)[0];
+  if len(ends) != 2 or np.any(degree > 2):
+    if not prune:
+      return None;
+    coords, adjacency = skeleton_to_sparse(skeleton);
+    # several parts or loops enclosing background
+    if connected_components(adjacency, directed = False)[0] != 1 or ndi.label(~skel)[1] != 1:
+      return None;
+    return coords[skeleton_longest_path(minimum_spanning_tree(adjacency))];
+  
+  # walk from one end point to the other
+  nbs = np.sort(nbs, axis = 1)[:,-2:].tolist();
+  order = [ends[0]];
+  p0, p = -1, ends[0];
+  for i in range(1, npts):
+    n0, n1 = nbs[p];
+    p0, p = p, (n1 if n1 != p0 else n0);
+    if p < 0:
+      return None;
+    order.append(p);
+  
+  if p != ends[1]:
+    return None;
+  
+  return ids[order] - 1;
+
+
 def skeleton_to_nx_graph(skeleton):
   """Converts a binary skeleton image to a networkx graph
   
@@ -153,29 +359,16 @@ def skeleton_to_nx_graph(skeleton):
     skeleton (array): 2d/3d binary skeleton image
     
   Returns:
-    dict: dict of adjacency information with entries node_id : [neighbours]
+    Graph: networkx graph with the pixel coordinates as nodes
   """
+  coords, adjacency = skeleton_to_sparse(skeleton, weighted = False);
+  nodes = [tuple(c) for c in coords.tolist()];
   
-  ids,nh = skeleton_to_list(skeleton, with_neighborhoods = True);
-  print('ids done...'); 
- 
-  if len(ids) == 0:
-     return nx.Graph();
-  elif len(ids) == 1:
-    adj = {};
-    adj[tuple(ids[0])] = [];
-    return nx.from_dict_of_lists(adj);
-  else:
-    g = nx.Graph();
-    for i,pos in enumerate(ids):
-      if i % 500 == 0:
-          print('%d/%d nodes constructed...' % (i, len(ids)));
-      p = tuple(pos);
-      g.add_node(p);
-      posnh = np.where(nh[i]);
-      for pp in np.transpose(posnh):
-          g.add_edge(p, tuple(pp+pos-1));
-    return g;
+  edges = sparse.triu(adjacency, k = 1).tocoo();
+  g = nx.Graph();
+  g.add_nodes_from(nodes);
+  g.add_edges_from([(nodes[i], nodes[j]) for i,j in zip(edges.row.tolist(), edges.col.tolist())]);
+  return g;
 
 
 try:
@@ -185,22 +378,19 @@ except:
 
 
 def skeleton_to_gt_graph(skeleton, with_coordinates = True, verbose = True):
-  """Converts a binary skeleton image to a networkx graph
+  """Converts a binary skeleton image to a graph_tool graph
   
   Arguments:
     skeleton (array): 2d/3d binary skeleton image
     
   Returns:
-    dict: dict of adjacency information with entries node_id : [neighbours]
+    Graph: graph_tool graph with optional coordinate vertex properties
   """
   dim = skeleton.ndim;
   shape =skeleton.shape;
   
-  coords, nh = skeleton_to_list(skeleton, with_neighborhoods = True);
+  coords, adjacency = skeleton_to_sparse(skeleton, weighted = False);
   nnodes = coords.shape[0];
-  
-  coordids = np.ravel_multi_index(coords.T, shape);  
-  coordids2ids = { k:i for i,k in enumerate(coordids) };
     
   # create graph
   if verbose:
@@ -218,24 +408,8 @@ def skeleton_to_gt_graph(skeleton, with_coordinates = True, verbose = True):
           vp = g.new_vertex_property('int', coords[:,2]);
           g.vertex_properties['z'] = vp;
   
-  for i, pos in enumerate(coords):
-    if verbose and i % 1000 == 0:
-      print('%d/%d nodes constructed...' % (i, len(coords)));
-    #print 'nh'
-    #print nh[i]
-    posnh = np.transpose(np.where(nh[i]));
-    #print 'pos'
-    #print pos
-    #print posnh
-    if len(posnh) > 0:
-      posnh = np.array(posnh + pos - 1);
-      #print posnh
-      #print posnh.shape
-      ids = np.ravel_multi_index(posnh.T, shape);
-      #print ids
-      for j in [coordids2ids[k] for k in ids]:
-        if i < j:
-          g.add_edge(i,j);
+  edges = sparse.triu(adjacency, k = 1).tocoo();
+  g.add_edge_list(np.vstack([edges.row, edges.col]).T);
   
   return g
 
@@ -371,6 +545,22 @@ def test2():
 
     
 
+def test_line():
+  import numpy as np
+  import imageprocessing.skeleton_graph as sg
+  
+  # line with a spur at an 8 connected junction
+  skel = np.zeros((20,20), dtype = bool);
+  skel[10, 2:18] = True;
+  skel[11:16, 9] = True;
+  skel[11,9] = False; skel[11,8] = True;
+  print(sg.skeleton_to_line(skel), sg.skeleton_to_line(skel, prune = True)[[0,-1]]);
+  
+  # a loop is rejected
+  skel[5:10, 4] = True; skel[5:10, 14] = True; skel[5, 4:15] = True;
+  print(sg.skeleton_to_line(skel, prune = True));
+
+
 def test():
   from importlib import reload
   import numpy as np
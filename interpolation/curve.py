@@ -688,6 +688,68 @@ class Curve(Spline):
     return tuple(rtr);
   
   
+  ############################################################################
+  ### Batch evaluation
+  
+  # get_values_batch, derivative_batch and integral_batch are inherited from Spline
+  # and map Bxnparameterxndim parameter to Bxnpointsxndim values
+  
+  def normals_batch(self, parameter, points = None):
+    """Returns normals along the sample points for many 2d curves with the same knots
+    
+    Arguments:
+      parameter (Bxnparameterx2 array): the bspline parameter of the curves
+      points (int, array or None): sample points used to determine the normals
+    
+    Returns:
+      array: Bxnpointsx2 normalized normals
+    """
+    if self.ndim != 2:
+      raise RuntimeError('normals for non 2d curves not implemented yet');
+    points = self.get_points(points, error = 'cannot determine sample points needed for the calculation of the normals');
+    der = self.get_values_batch(parameter, points = points, derivative = 1);
+    nrmls = np.stack([-der[...,1], der[...,0]], axis = -1);
+    return nrmls / np.linalg.norm(nrmls, axis = -1)[...,np.newaxis];
+  
+  
+  def theta_batch(self, parameter, points = None, reference = 0.5):
+    """Returns the derivative of the tangent angle along many 2d curves with the same knots
+    
+    Arguments:
+      parameter (Bxnparameterx2 array): the bspline parameter of the curves
+      points (int, array or None): sample points used to determine theta
+      reference (float): reference point for absolute position and orientation
+    
+    Returns:
+      array: Bxnpoints theta values at the sample points
+      array: Bx2 positions at the reference point
+      array: B lengths of the curves
+      array: B orientations at the reference point
+      
+    Note:
+      In contrast to :meth:`theta` the derivative of the tangent angle is 
+      calculated directly from the first and second derivatives of the curves 
+      instead of from a spline interpolation of the tangent angles.
+    """
+    if self.ndim != 2:
+      raise RuntimeError('theta angle can only be computed for 2d curves');
+    points = self.get_points(points, error = 'cannot determine sample points needed for the calculation of theta');
+    
+    d1 = self.get_values_batch(parameter, points = points, derivative = 1);
+    d2 = self.get_values_batch(parameter, points = points, derivative = 2);
+    theta = (d1[...,0] * d2[...,1] - d1[...,1] * d2[...,0]) / np.sum(d1 * d1, axis = -1);
+    
+    ref = np.array([reference], dtype = float);
+    xy = self.get_values_batch(parameter, points = ref)[:,0];
+    tgs = self.get_values_batch(parameter, points = ref, derivative = 1)[:,0];
+    orientation = np.arctan2(tgs[:,1], tgs[:,0]);
+    
+    values = self.get_values_batch(parameter, points = points);
+    length = np.sum(np.linalg.norm(np.diff(values, axis = 1), axis = 2), axis = 1);
+    
+    return theta, xy, length, orientation
+  
+  
   def intersections_with_line(self, point0, point1, with_points = True, with_xy = False, points = None, robust = True):
     """Find positions along the spline that intersect with the line segment between two points
     
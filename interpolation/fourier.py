@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Fourier Module
+
+Fourier descriptors of closed curves for smoothing, derivatives, curvature
+and normals of contours
+
+Note:
+  All routines work on many contours of a common length at once, contours
+  of shape (...,n,2) are transformed along the point axis. Contours are
+  assumed to be closed without repeating the first point at the end.
+  The parameter of the curves is u in [0,1) with points at u = i/n.
+"""
+
+__license__ = 'MIT License <http://www.opensource.org/licenses/mit-license.php>'
+__author__ = 'Christoph Kirst <ckirst@rockefeller.edu>'
+__docformat__ = 'rest'
+
+
+import numpy as np
+
+from interpolation.resampling import resample_arc_length
+
+
+def _complex(contour):
+  """Contour as complex numbers x + i y"""
+  contour = np.asarray(contour, dtype = float);
+  return contour[...,0] + 1j * contour[...,1];
+
+
+def _real(z):
+  """Complex numbers as contour points"""
+  return np.stack([z.real, z.imag], axis = -1);
+
+
+def frequencies(npoints):
+  """Integer frequencies of the Fourier coefficients of a contour with npoints points"""
+  return np.fft.fftfreq(npoints, d = 1.0 / npoints);
+
+
+def fourier_descriptors(contour, resample = False):
+  """Fourier descriptors of closed contours
+
+  Arguments:
+    contour (...xnx2 array): points on the closed contours
+    resample (bool): if True resample the contours uniformly in arc length first
+
+  Returns:
+    (...xn complex array): Fourier coefficients of x + i y
+  """
+  if resample:
+    contour = resample_arc_length(contour, periodic = True, method = 'cubic');
+  return np.fft.fft(_complex(contour), axis = -1);
+
+
+def low_pass(descriptors, cutoff = None, sigma = None):
+  """Low pass filter of Fourier descriptors
+
+  Arguments:
+    descriptors (...xn complex array): Fourier coefficients
+    cutoff (int or None): if not None remove all frequencies larger than this
+    sigma (float or None): if not None Gaussian filter with this width in units of points along the contour
+
+  Returns:
+    (...xn complex array): filtered Fourier coefficients
+  """
+  n = descriptors.shape[-1];
+  k = frequencies(n);
+  if cutoff is not None:
+    descriptors = descriptors * (np.abs(k) <= cutoff);
+  if sigma is not None and sigma > 0:
+    descriptors = descriptors * np.exp(-2 * np.pi**2 * sigma**2 * (k / n)**2);
+  return descriptors;
+
+
+def derivative_descriptors(descriptors, order = 1):
+  """Fourier coefficients of the derivatives of the contour with respect to the parameter u in [0,1)"""
+  n = descriptors.shape[-1];
+  k = frequencies(n);
+  if order % 2 == 1 and n % 2 == 0:
+    k[n//2] = 0; # remove unpaired Nyquist frequency for odd derivatives
+  return descriptors * (2j * np.pi * k)**order;
+
+
+def smooth(contour, cutoff = None, sigma = None, resample = False):
+  """Smooth closed contours by low pass filtering
+
+  Arguments:
+    contour (...xnx2 array): points on the closed contours
+    cutoff (int or None): if not None remove all frequencies larger than this
+    sigma (float or None): if not None Gaussian filter with this width in units of points
+    resample (bool): if True resample the contours uniformly in arc length first
+
+  Returns:
+    (...xnx2 array): smoothed contours
+  """
+  d = low_pass(fourier_descriptors(contour, resample = resample), cutoff = cutoff, sigma = sigma);
+  return _real(np.fft.ifft(d, axis = -1));
+
+
+def derivatives(contour, orders = (1,2), cutoff = None, sigma = None, resample = False):
+  """Derivatives of closed contours with respect to the curve parameter
+
+  Arguments:
+    contour (...xnx2 array): points on the closed contours
+    orders (tuple of ints): orders of the derivatives to return
+    cutoff (int or None): if not None remove all frequencies larger than this
+    sigma (float or None): if not None Gaussian filter with this width in units of points
+    resample (bool): if True resample the contours uniformly in arc length first
+
+  Returns:
+    list of (...xnx2 arrays): derivatives of the contours
+  """
+  d = low_pass(fourier_descriptors(contour, resample = resample), cutoff = cutoff, sigma = sigma);
+  return [_real(np.fft.ifft(derivative_descriptors(d, order = o), axis = -1)) for o in orders];
+
+
+def curvature(contour, cutoff = None, sigma = None, resample = False):
+  """Signed curvature along closed contours
+
+  Arguments:
+    contour (...xnx2 array): points on the closed contours
+    cutoff (int or None): if not None remove all frequencies larger than this
+    sigma (float or None): if not None Gaussian filter with this width in units of points
+    resample (bool): if True resample the contours uniformly in arc length first
+
+  Returns:
+    (...xn array): curvature at the contour points
+
+  Note:
+    Same sign convention as :func:`worm.geometry.curvature_from_contour`.
+  """
+  d = low_pass(fourier_descriptors(contour, resample = resample), cutoff = cutoff, sigma = sigma);
+  dz  = np.fft.ifft(derivative_descriptors(d, order = 1), axis = -1);
+  d2z = np.fft.ifft(derivative_descriptors(d, order = 2), axis = -1);
+  speed = np.abs(dz);
+  return np.imag(np.conj(dz) * d2z) / np.where(speed > 0, speed, 1)**3;
+
+
+def normals(contour, cutoff = None, sigma = None, resample = False, with_tangents = False):
+  """Unit normals along closed contours
+
+  Arguments:
+    contour (...xnx2 array): points on the closed contours
+    cutoff (int or None): if not None remove all frequencies larger than this
+    sigma (float or None): if not None Gaussian filter with this width in units of points
+    resample (bool): if True resample the contours uniformly in arc length first
+    with_tangents (bool): if True also return the unit tangents
+
+  Returns:
+    (...xnx2 array): unit normals, tangents rotated by pi/2
+    (...xnx2 array): unit tangents (if with_tangents is True)
+  """
+  d = low_pass(fourier_descriptors(contour, resample = resample), cutoff = cutoff, sigma = sigma);
+  dz  = np.fft.ifft(derivative_descriptors(d, order = 1), axis = -1);
+  speed = np.abs(dz);
+  t = dz / np.where(speed > 0, speed, 1);
+  if with_tangents:
+    return _real(1j * t), _real(t);
+  else:
+    return _real(1j * t);
+
+
+
+def test():
+  import numpy as np
+  import matplotlib.pyplot as plt
+  import interpolation.fourier as fou
+
+  # ellipses with noise
+  n = 100;
+  t = np.linspace(0, 2 * np.pi, n + 1)[:-1];
+  a = np.linspace(1, 3, 5)[:,np.newaxis];
+  ellipses = np.stack([a * np.cos(t), np.sin(t) * np.ones_like(a)], axis = -1);
+  noisy = ellipses + 0.01 * np.random.randn(*ellipses.shape);
+
+  k = fou.curvature(ellipses);
+  k_exact = a / (a**2 * np.sin(t)**2 + np.cos(t)**2)**1.5;
+  print('max curvature deviation: %f' % np.max(np.abs(k - k_exact)));
+
+  ks = fou.curvature(noisy, sigma = 2.0);
+  nrm = fou.normals(noisy, sigma = 2.0);
+
+  plt.figure(1); plt.clf();
+  plt.subplot(1,2,1);
+  for e,nr in zip(fou.smooth(noisy, sigma = 2.0), nrm):
+    plt.plot(e[:,0], e[:,1]);
+    plt.quiver(e[:,0], e[:,1], nr[:,0], nr[:,1]);
+  plt.axis('equal');
+  plt.subplot(1,2,2);
+  plt.plot(ks.T);
+  plt.plot(k_exact.T, 'k');
+
+
+if __name__ == "__main__":
+  test();
@@ -11,40 +11,40 @@ __docformat__ = 'rest'
 import numpy as np
 import warnings
 
-from scipy.linalg import lu;
 
-def curve_intersections_discrete(xy1, xy2 = None, robust  = True):
-  """Returns intersection points and indices between two curves
+def segment_boxes(xy):
+  """Bounding boxes of the segments of a discrete curve
   
   Arguments:
-    xy1,xy2 (nx2 array): sample points along curve, curves van be split via nans
-    robust (bool): if true additional checks for duplication on boundary are performed
+    xy (nx2 array): sample points along curve, curves can be split via nans
   
   Returns:
-    mx2 array: intersection points
-    m arrays: indices of the reference points for the intersecting segments in xy1 and xy2
-    m arrays: distance of intersection point within the reference segments
-    
-  Notes: Based on intersections by Douglas M. Schwarz
+    (n-1)x2 array: lower corner of the segment boxes (nan for split segments)
+    (n-1)x2 array: upper corner of the segment boxes (nan for split segments)
   """
+  return np.minimum(xy[:-1], xy[1:]), np.maximum(xy[:-1], xy[1:]);
+
 
+def candidate_pairs_dense(xy1, xy2):
+  """Returns indices of segments with overlapping bounding boxes via dense comparison
+  
+  Arguments:
+    xy1,xy2 (nx2 array): sample points along curve, curves can be split via nans
+  
+  Returns:
+    m arrays: indices of the candidate segments in xy1 and xy2
+    
+  Note:
+    This is the reference implementation with quadratic time and memory requirements.
+  """
   x1 = xy1[:,0];
   y1 = xy1[:,1];
-  
-  if xy2 is None:
-    xy2 = xy1;
-    self_intersect = True;
-  else:
-    self_intersect = False;  
   x2 = xy2[:,0];
   y2 = xy2[:,1];
 
   n1 = len(x1) - 1;
   n2 = len(x2) - 1;
   
-  dxy1 = np.diff(xy1, axis = 0);
-  dxy2 = np.diff(xy2, axis = 0);
-
   #determine the combinations of i and j where the rectangle enclosing the
   #i'th line segment of curve 1 overlaps with the rectangle enclosing the
   #j'th line segment of curve 2
@@ -64,78 +64,372 @@ def curve_intersections_discrete(xy1, xy2 = None, robust  = True):
                  (np.repeat(minx2[np.newaxis,:], n1, axis = 0) <= np.repeat(maxx1[:,np.newaxis], n2, axis = 1)) &
                  (np.repeat(miny1[:,np.newaxis], n2, axis = 1) <= np.repeat(maxy2[np.newaxis,:], n1, axis = 0)) &  
                  (np.repeat(miny2[np.newaxis,:], n1, axis = 0) <= np.repeat(maxy1[:,np.newaxis], n2, axis = 1)));
+  return i, j
+
+
+def _expand_ranges(start, count):
+  """Indices start[k] + 0...count[k]-1 concatenated for all k and the corresponding k's"""
+  k = np.repeat(np.arange(len(count)), count);
+  offset = np.arange(len(k)) - np.repeat(np.cumsum(count) - count, count);
+  return k, start[k] + offset;
+
 
+def _grid_cells(lo, hi, origin, cell_size, ncells):
+  """Grid cell keys covered by each box"""
+  c0 = np.asarray(np.floor((lo - origin) / cell_size), dtype = np.int64);
+  c1 = np.asarray(np.floor((hi - origin) / cell_size), dtype = np.int64);
+  nx = c1[:,0] - c0[:,0] + 1;
+  ny = c1[:,1] - c0[:,1] + 1;
+  box, offset = _expand_ranges(np.zeros(len(nx), dtype = np.int64), nx * ny);
+  cx = c0[box,0] + offset % nx[box];
+  cy = c0[box,1] + offset // nx[box];
+  return box, cx * ncells + cy;
+
+
+def _box_pairs_dense(lo1, hi1, lo2, hi2, chunk_size = 2**22):
+  """Indices of overlapping boxes via dense comparison in chunks of the first boxes"""
+  nchunk = max(1, chunk_size // max(len(lo2), 1));
+  i = [np.zeros(0, dtype = int)]; j = [np.zeros(0, dtype = int)];
+  for c in range(0, len(lo1), nchunk):
+    overlap = np.all(lo1[c:c+nchunk,np.newaxis] <= hi2[np.newaxis], axis = 2) & np.all(lo2[np.newaxis] <= hi1[c:c+nchunk,np.newaxis], axis = 2);
+    ic, jc = np.nonzero(overlap);
+    i.append(ic + c); j.append(jc);
+  return np.hstack(i), np.hstack(j);
+
+
+def _box_pairs_grid(lo1, hi1, lo2, hi2, origin, cell_size, ncells, groups1 = None, groups2 = None):
+  """Indices of overlapping boxes via a uniform grid, each pair is found once"""
+  box1, key1 = _grid_cells(lo1, hi1, origin, cell_size, ncells);
+  box2, key2 = _grid_cells(lo2, hi2, origin, cell_size, ncells);
+  if groups1 is not None:
+    ngroups = max(groups1.max(), groups2.max()) + 1;
+    key1 = key1 * ngroups + groups1[box1];
+    key2 = key2 * ngroups + groups2[box2];
+  order = np.argsort(key2, kind = 'mergesort');
+  box2 = box2[order]; key2 = key2[order];
+  
+  # form pairs within cells
+  first = np.searchsorted(key2, key1, side = 'left');
+  last  = np.searchsorted(key2, key1, side = 'right');
+  e1, e2 = _expand_ranges(first, last - first);
+  i = box1[e1]; j = box2[e2]; key = key1[e1];
+  
+  # exact box overlap and unique reference cell
+  lo1i = lo1[i]; lo2j = lo2[j];
+  overlap = np.all(lo1i <= hi2[j], axis = 1) & np.all(lo2j <= hi1[i], axis = 1);
+  ref = np.asarray(np.floor((np.maximum(lo1i, lo2j) - origin) / cell_size), dtype = np.int64);
+  ref = ref[:,0] * ncells + ref[:,1];
+  if groups1 is not None:
+    ref = ref * ngroups + groups1[i];
+  keep = overlap & (ref == key);
+  return i[keep], j[keep];
+
+
+def candidate_pairs_grid(xy1, xy2 = None, cell_size = None, groups1 = None, groups2 = None, max_cells = 16):
+  """Returns indices of segments with overlapping bounding boxes via a uniform grid
+  
+  Arguments:
+    xy1,xy2 (nx2 array): sample points along curve, curves can be split via nans,
+                         if xy2 is None only pairs of non-adjacent segments j > i + 1 in xy1 are returned
+    cell_size (float or None): size of the grid cells, if None use median segment extent
+    groups1, groups2 (n-1 arrays or None): non-negative group labels of the segments, 
+                                           if given only segments within the same group are paired
+    max_cells (int): segments whose bounding boxes cover more grid cells are compared densely
+  
+  Returns:
+    m arrays: indices of the candidate segments in xy1 and xy2
+  
+  Note:
+    Segments are binned into all grid cells their bounding boxes cover, and pairs
+    are only formed within cells. Each pair is reported once in the cell that 
+    contains the lower corner of the intersection of the two bounding boxes. 
+    Time and memory scale with the number of segments and close pairs instead
+    of the product of the number of segments.
+    
+    The few long segments of trajectories that mostly dwell, e.g. jumps, would 
+    cover a number of cells quadratic in their length. They are kept out of the 
+    grid and compared to all other segments directly, which is linear in the 
+    number of segments for each long segment.
+  """
+  self_intersect = xy2 is None;
   if self_intersect:
-  	keep = np.logical_not(np.logical_or(np.isnan(np.sum(dxy1[i,:] + dxy2[j,:], axis = 1)), j <= i + 1));
-  else:
-  	keep = np.logical_not(np.isnan(np.sum(dxy1[i,:] + dxy2[j,:], axis = 1)));
+    xy2 = xy1;
+    if groups1 is not None:
+      groups2 = groups1;
+  
+  lo1, hi1 = segment_boxes(xy1);
+  lo2, hi2 = segment_boxes(xy2);
+  
+  valid1 = np.where(np.all(np.isfinite(lo1), axis = 1) & np.all(np.isfinite(hi1), axis = 1))[0];
+  valid2 = np.where(np.all(np.isfinite(lo2), axis = 1) & np.all(np.isfinite(hi2), axis = 1))[0];
+  if len(valid1) == 0 or len(valid2) == 0:
+    return np.zeros(0, dtype = int), np.zeros(0, dtype = int);
+  
+  lo1 = lo1[valid1]; hi1 = hi1[valid1];
+  lo2 = lo2[valid2]; hi2 = hi2[valid2];
+  if groups1 is not None:
+    groups1 = np.asarray(groups1, dtype = np.int64)[valid1];
+    groups2 = np.asarray(groups2, dtype = np.int64)[valid2];
+  
+  origin = np.minimum(lo1.min(axis = 0), lo2.min(axis = 0));
+  extent = np.maximum(hi1.max(axis = 0), hi2.max(axis = 0)) - origin;
+  if cell_size is None:
+    cell_size = np.median(np.hstack([np.max(hi1 - lo1, axis = 1), np.max(hi2 - lo2, axis = 1)]));
+    if cell_size <= 0:
+      cell_size = max(np.max(extent), 1.0);
+  ncells = int(np.floor(extent[1] / cell_size)) + 1;
+  
+  # split off segments covering many cells
+  def ncover(lo, hi):
+    n = np.floor((hi - origin) / cell_size) - np.floor((lo - origin) / cell_size) + 1;
+    return n[:,0] * n[:,1];
+  small1 = np.where(ncover(lo1, hi1) <= max_cells)[0];
+  small2 = np.where(ncover(lo2, hi2) <= max_cells)[0];
+  large1 = np.setdiff1d(np.arange(len(lo1)), small1);
+  large2 = np.setdiff1d(np.arange(len(lo2)), small2);
+  
+  i, j = _box_pairs_grid(lo1[small1], hi1[small1], lo2[small2], hi2[small2], origin, cell_size, ncells, 
+                         groups1 = None if groups1 is None else groups1[small1], 
+                         groups2 = None if groups2 is None else groups2[small2]);
+  i = [small1[i]]; j = [small2[j]];
+  
+  # long segments against all and short segments against long ones
+  if len(large1) > 0:
+    il, jl = _box_pairs_dense(lo1[large1], hi1[large1], lo2, hi2);
+    i.append(large1[il]); j.append(jl);
+  if len(large2) > 0:
+    il, jl = _box_pairs_dense(lo1[small1], hi1[small1], lo2[large2], hi2[large2]);
+    i.append(small1[il]); j.append(large2[jl]);
+  i = np.hstack(i); j = np.hstack(j);
+  
+  keep = np.ones(len(i), dtype = bool);
+  if groups1 is not None:
+    keep &= groups1[i] == groups2[j];
+  i = valid1[i]; j = valid2[j];
+  if self_intersect:
+    keep &= j > i + 1;
+  
+  i = i[keep]; j = j[keep];
+  order = np.lexsort((j, i));
+  return i[order], j[order];
 
-  i = i[keep];
-  j = j[keep];
+
+def segment_intersections(p0, p1, q0, q1):
+  """Intersection parameter of line segments
   
-  if len(i) == 0:
-    return np.zeros((0,2)), i,i,j,j;
+  Arguments:
+    p0, p1 (...x2 arrays): start and end points of the first segments
+    q0, q1 (...x2 arrays): start and end points of the second segments
+  
+  Returns:
+    ... array: position of the intersection along the first segments
+    ... array: position of the intersection along the second segments
+    ... array: cross product of the segment directions, zero for parallel segments
+    
+  Note:
+    All arguments are broadcast against each other. The intersection point is
+    p0 + t * (p1 - p0) = q0 + u * (q1 - q0) with segments intersecting 
+    if 0 <= t,u <= 1. For parallel segments t and u are set to nan.
+  """
+  r = np.asarray(p1, dtype = float) - p0;
+  s = np.asarray(q1, dtype = float) - q0;
+  qp = np.asarray(q0, dtype = float) - p0;
+  
+  denom = r[...,0] * s[...,1] - r[...,1] * s[...,0];
+  with np.errstate(divide = 'ignore', invalid = 'ignore'):
+    t = (qp[...,0] * s[...,1] - qp[...,1] * s[...,0]) / denom;
+    u = (qp[...,0] * r[...,1] - qp[...,1] * r[...,0]) / denom;
+  
+  return t, u, denom
+  
+
+def segments_polyline_intersections(start, end, xy):
+  """Intersections of many line segments with a polyline
+  
+  Arguments:
+    start, end (nx2 arrays): start and end points of the line segments
+    xy (mx2 array): vertices of the polyline, can be split via nans
+  
+  Returns:
+    nx(m-1) array of bools: True if segment intersects the corresponding polyline segment
+    nx(m-1) array: position of the intersection along the line segments
+    nx(m-1) array: position of the intersection along the polyline segments
+  """
+  start = np.asarray(start, dtype = float)[:,np.newaxis,:];
+  end   = np.asarray(end, dtype = float)[:,np.newaxis,:];
+  xy = np.asarray(xy, dtype = float);
   
-  n = len(i);
-  T = np.zeros((4,n));
-  AA = np.zeros((4,4,n));
-  AA[[0,1],2,:] = -1;
-  AA[[2,3],3,:] = -1;
-  AA[[0, 2],0,:] = dxy1[i,:].T;
-  AA[[1, 3],1,:] = dxy2[j,:].T;
-  B = - np.vstack([x1[i], x2[j], y1[i], y2[j]]);
+  t, u, denom = segment_intersections(start, end, xy[np.newaxis,:-1], xy[np.newaxis,1:]);
+  
+  with np.errstate(invalid = 'ignore'):
+    hit = (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1);
+  
+  return hit, t, u
+
 
+def intersect_segment_pairs(xy1, xy2, i, j, robust = True, groups = None):
+  """Intersections of candidate segment pairs via closed form solution
+  
+  Arguments:
+    xy1,xy2 (nx2 array): sample points along curves
+    i,j (m arrays): indices of the candidate segments in xy1 and xy2
+    robust (bool): if true overlapping segments and duplicate intersections on boundaries are handled
+    groups (m array or None): group labels of the pairs used for removing duplicates
+  
+  Returns:
+    kx2 array: intersection points
+    k arrays: indices of the reference points for the intersecting segments in xy1 and xy2
+    k arrays: distance of intersection point within the reference segments
+  """
+  p0 = xy1[i]; r = xy1[i+1] - p0;
+  q0 = xy2[j]; s = xy2[j+1] - q0;
+  t1, t2, denom = segment_intersections(p0, p0 + r, q0, q0 + s);
+  
   if robust:
-    overlap = np.zeros(n, dtype = bool);
-    for k in range(n):
-      try:
-        T[:,k] = np.linalg.solve(AA[:,:,k],B[:,k]);
-      except np.linalg.linalg.LinAlgError: #AA is signular
-        T[0,k] = np.NaN;
-        # determine if these segments overlap or are just parallel.
-        overlap[k] = np.linalg.cond(np.vstack([dxy1[i[k],:], xy2[j[k],:] - xy1[i[k],:]])) < np.finfo(float).eps;
-
-    # Find where t1 and t2 are between 0 and 1 and return the corresponding x0 and y0 values.
-    in_range = (T[0,:] >= 0) & (T[1,:] >= 0) & (T[0,:] <= 1) & (T[1,:] <= 1);
+    eps = np.finfo(float).eps;
+    rr = np.sum(r * r, axis = 1);
+    ss = np.sum(s * s, axis = 1);
+    qp = q0 - p0;
+    parallel = np.abs(denom) <= 4 * eps * np.sqrt(rr * ss);
     
-    # For overlapping segment pairs the algorithm will return an
-    # intersection point that is at the center of the overlapping region.
+    # overlapping if parallel and q0 on the line through the first segment
+    cross = r[:,0] * qp[:,1] - r[:,1] * qp[:,0];
+    overlap = parallel & (np.abs(cross) <= 4 * eps * np.sqrt(rr * np.sum(qp * qp, axis = 1)));
+    t1[parallel] = np.nan;
+    t2[parallel] = np.nan;
+    
+    # Find where t1 and t2 are between 0 and 1
+    with np.errstate(invalid = 'ignore'):
+      in_range = (t1 >= 0) & (t2 >= 0) & (t1 <= 1) & (t2 <= 1);
+    
+    xy0 = p0 + t1[:,np.newaxis] * r;
+    
+    # For overlapping segment pairs return the center of the overlapping region
     if np.any(overlap):
-      ia = i[overlap];
-      ja = j[overlap];
-      # set x0 and y0 to middle of overlapping region.
-      T[2,overlap] = (np.max([np.min([x1[ia],x1[ia+1]],axis=0), np.min([x2[ja],x2[ja+1]],axis=0)],axis = 0) +
-                      np.min([np.max([x1[ia],x1[ia+1]],axis=0), np.max([x2[ja],x2[ja+1]],axis=0)],axis=0) ) / 2;
-      T[3,overlap] = (np.max([np.min([y1[ia],y1[ia+1]],axis=0), np.min([y2[ja],y2[ja+1]],axis=0)],axis = 0) +
-                      np.min([np.max([y1[ia],y1[ia+1]],axis=0), np.max([y2[ja],y2[ja+1]],axis=0)],axis=0) ) / 2;              
+      lo = np.maximum(np.minimum(p0[overlap], p0[overlap] + r[overlap]), np.minimum(q0[overlap], q0[overlap] + s[overlap]));
+      hi = np.minimum(np.maximum(p0[overlap], p0[overlap] + r[overlap]), np.maximum(q0[overlap], q0[overlap] + s[overlap]));
+      xy0[overlap] = (lo + hi) / 2;
+      with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        t1[overlap] = np.nan_to_num(np.sum((xy0[overlap] - p0[overlap]) * r[overlap], axis = 1) / rr[overlap]);
+        t2[overlap] = np.nan_to_num(np.sum((xy0[overlap] - q0[overlap]) * s[overlap], axis = 1) / ss[overlap]);
       selected = in_range | overlap;
     else:
       selected = in_range;
-  
-    xy0 = T[2:4,selected].T;
     
-    # Remove duplicate intersection points.  
-    xy0c = np.ascontiguousarray(xy0).view(np.dtype((np.void, xy0.dtype.itemsize * xy0.shape[1])))
-    _, index = np.unique(xy0c, return_index=True);
-    xy0 = xy0[index];
-  
-    sel_index= np.where(selected)[0];
-    sel = sel_index[index];
+    sel = np.where(selected)[0];
+    xy0 = xy0[sel];
     
-    return xy0, i[sel], j[sel], T[0,sel], T[1,sel];
+    # Remove duplicate intersection points.
+    if groups is None:
+      xyg = np.ascontiguousarray(xy0);
+    else:
+      xyg = np.ascontiguousarray(np.hstack([np.asarray(groups[sel], dtype = float)[:,np.newaxis], xy0]));
+    xyg = xyg.view(np.dtype((np.void, xyg.dtype.itemsize * xyg.shape[1])));
+    _, index = np.unique(xyg, return_index=True);
+    xy0 = xy0[index];
+    sel = sel[index];
   
   else: # non-robust option
-    for k in range(n):
-      [L,U] = lu(AA[:,:,k]);
-      T[:,k] = np.linalg.solve(U, np.linalg.solve(L, B[:,k]));
-    
-    # Find where t1 and t2 are between 0 and 1 and return the corresponding
-    # x0 and y0 values.
-    in_range = (T[0,:] >= 0) & (T[1,:] >= 0) & (T[0,:] < 1) & (T[1,:] < 1);
-    
-    xy0 = T[2:4,in_range].T;
+    # Find where t1 and t2 are between 0 and 1
+    with np.errstate(invalid = 'ignore'):
+      sel = np.where((t1 >= 0) & (t2 >= 0) & (t1 < 1) & (t2 < 1))[0];
+    xy0 = p0[sel] + t1[sel,np.newaxis] * r[sel];
+  
+  return xy0, i[sel], j[sel], t1[sel], t2[sel];
+
+
+def curve_intersections_discrete(xy1, xy2 = None, robust  = True, broad_phase = 'grid'):
+  """Returns intersection points and indices between two curves
+  
+  Arguments:
+    xy1,xy2 (nx2 array): sample points along curve, curves van be split via nans
+    robust (bool): if true additional checks for duplication on boundary are performed
+    broad_phase ({'grid', 'dense'}): method to find candidate segment pairs, 
+                                     'dense' is the quadratic reference implementation
+  
+  Returns:
+    mx2 array: intersection points
+    m arrays: indices of the reference points for the intersecting segments in xy1 and xy2
+    m arrays: distance of intersection point within the reference segments
     
-    return xy0, i[sel], j[sel], T[0,sel], T[1,sel];
+  Notes: Based on intersections by Douglas M. Schwarz
+  """
+  if xy2 is None:
+    xy2 = xy1;
+    self_intersect = True;
+  else:
+    self_intersect = False;  
+  
+  dxy1 = np.diff(xy1, axis = 0);
+  dxy2 = np.diff(xy2, axis = 0);
+
+  if broad_phase == 'dense':
+    i,j = candidate_pairs_dense(xy1, xy2);
+  elif self_intersect:
+    i,j = candidate_pairs_grid(xy1);
+  else:
+    i,j = candidate_pairs_grid(xy1, xy2);
+
+  if self_intersect:
+    keep = np.logical_not(np.logical_or(np.isnan(np.sum(dxy1[i,:] + dxy2[j,:], axis = 1)), j <= i + 1));
+  else:
+    keep = np.logical_not(np.isnan(np.sum(dxy1[i,:] + dxy2[j,:], axis = 1)));
+
+  i = i[keep];
+  j = j[keep];
+  
+  if len(i) == 0:
+    return np.zeros((0,2)), i,j,np.zeros(0),np.zeros(0);
+  
+  return intersect_segment_pairs(xy1, xy2, i, j, robust = robust);
+
+
+def _concatenate_curves(curves):
+  """Concatenate curves separated by nans, returns curve, vertex offsets and segment labels"""
+  curves = [np.asarray(c, dtype = float) for c in curves];
+  sizes = np.array([c.shape[0] + 1 for c in curves]);
+  offsets = np.hstack([0, np.cumsum(sizes)[:-1]]);
+  sep = np.full((1,2), np.nan);
+  xy = np.vstack([np.vstack([c, sep]) for c in curves])[:-1];
+  groups = np.repeat(np.arange(len(curves)), sizes)[:-2];
+  return xy, offsets, groups
+
+
+def curve_intersections_discrete_batch(xy1, xy2 = None, robust = True):
+  """Returns intersection points and indices between many pairs of curves
+  
+  Arguments:
+    xy1,xy2 (list of nx2 arrays or bxnx2 array): pairs of curves, if xy2 is None self intersections of xy1 are calculated
+    robust (bool): if true additional checks for duplication on boundary are performed
+  
+  Returns:
+    mx2 array: intersection points
+    m array: index of the curve pair for each intersection
+    m arrays: indices of the reference points for the intersecting segments in the curves
+    m arrays: distance of intersection point within the reference segments
+  
+  Note:
+    All curves are concatenated and intersected at once, the grid broad phase 
+    only pairs segments of the same curve pair.
+  """
+  if len(xy1) == 0:
+    return np.zeros((0,2)), np.zeros(0, dtype = int), np.zeros(0, dtype = int), np.zeros(0, dtype = int), np.zeros(0), np.zeros(0);
+  
+  cxy1, offsets1, groups1 = _concatenate_curves(xy1);
+  if xy2 is None:
+    cxy2, offsets2, groups2 = cxy1, offsets1, groups1;
+    i,j = candidate_pairs_grid(cxy1, groups1 = groups1);
+  else:
+    if len(xy1) != len(xy2):
+      raise ValueError('number of curves %d and %d do not match!' % (len(xy1), len(xy2)));
+    cxy2, offsets2, groups2 = _concatenate_curves(xy2);
+    i,j = candidate_pairs_grid(cxy1, cxy2, groups1 = groups1, groups2 = groups2);
+  
+  k = groups1[i];
+  xy0, i, j, t1, t2 = intersect_segment_pairs(cxy1, cxy2, i, j, robust = robust, groups = k);
+  k = groups1[i];
+  
+  return xy0, k, i - offsets1[k], j - offsets2[k], t1, t2;
 
 
 def test():
@@ -188,6 +482,22 @@ def test():
   plt.axis('equal')
   
   
+  # grid versus dense broad phase on a long self intersecting trajectory
+  import time
+  xy = np.cumsum(np.random.randn(5000,2), axis = 0);
+  t0 = time.time();
+  xy0g,_,_,_,_ = ii.curve_intersections_discrete(xy, broad_phase = 'grid');
+  t1 = time.time();
+  xy0d,_,_,_,_ = ii.curve_intersections_discrete(xy, broad_phase = 'dense');
+  t2 = time.time();
+  print('grid: %d intersections in %fs, dense: %d intersections in %fs' % (len(xy0g), t1-t0, len(xy0d), t2-t1));
+  
+  # dwelling trajectory with a few long jumps
+  step = np.where(np.random.rand(20000,1) < 0.001, 500, 0.05) * np.random.randn(20000,2);
+  xy = np.cumsum(step, axis = 0);
+  t0 = time.time();
+  i,j = ii.candidate_pairs_grid(xy);
+  print('dwelling trajectory: %d candidate pairs in %fs' % (len(i), time.time() - t0));
 
 
 if __name__ == "__main__":
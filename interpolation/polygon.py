@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Polygon Module
+
+Vectorized point in polygon tests and distances to polygon boundaries
+
+Note:
+  All routines broadcast over leading dimensions, i.e. polygons of shape
+  (...,m,2) can be tested against points of shape (...,n,2) to test many
+  points against many polygons in a single call.
+"""
+
+__license__ = 'MIT License <http://www.opensource.org/licenses/mit-license.php>'
+__author__ = 'Christoph Kirst <ckirst@rockefeller.edu>'
+__docformat__ = 'rest'
+
+
+import numpy as np
+
+
+def winding_number(polygon, points):
+  """Winding number of a closed polygon around points
+
+  Arguments:
+    polygon (...xmx2 array): vertices of the polygon (closing edge added implicitly)
+    points (...xnx2 array): points to test
+
+  Returns:
+    ...xn array: winding numbers of the polygon around the points
+  """
+  polygon = np.asarray(polygon, dtype = float);
+  points = np.asarray(points, dtype = float);
+
+  # edges along first axis for fast accumulation
+  start = np.moveaxis(polygon, -2, 0)[...,np.newaxis,:];
+  end   = np.roll(start, -1, axis = 0);
+
+  px = points[...,0]; py = points[...,1];
+  sx = start[...,0]; sy = start[...,1];
+  ex = end[...,0]; ey = end[...,1];
+
+  # orientation of point with respect to each edge
+  cross = (ex - sx) * (py - sy) - (px - sx) * (ey - sy);
+
+  up   = (sy <= py) & (ey >  py) & (cross > 0);
+  down = (sy >  py) & (ey <= py) & (cross < 0);
+
+  return np.sum(up, axis = 0, dtype = int) - np.sum(down, axis = 0, dtype = int);
+
+
+def distance_to_segments(points, start, end):
+  """Distances between points and line segments
+
+  Arguments:
+    points (...xnx2 array): points
+    start, end (...xmx2 array): start and end points of the segments
+
+  Returns:
+    ...xnxm array: distances between points and segments
+  """
+  points = np.asarray(points, dtype = float);
+  start = np.asarray(start, dtype = float)[...,np.newaxis,:,:];
+  delta = np.asarray(end, dtype = float)[...,np.newaxis,:,:] - start;
+
+  length2 = np.sum(delta * delta, axis = -1);
+  length2[length2 == 0] = np.inf;
+
+  diff = points[...,:,np.newaxis,:] - start;
+  t = np.clip(np.sum(diff * delta, axis = -1) / length2, 0, 1);
+
+  return np.linalg.norm(diff - t[...,np.newaxis] * delta, axis = -1);
+
+
+def distance_to_boundary(polygon, points):
+  """Distance of points to the boundary of a closed polygon
+
+  Arguments:
+    polygon (...xmx2 array): vertices of the polygon (closing edge added implicitly)
+    points (...xnx2 array): points
+
+  Returns:
+    ...xn array: distances to the boundary
+  """
+  polygon = np.asarray(polygon, dtype = float);
+  return np.min(distance_to_segments(points, polygon, np.roll(polygon, -1, axis = -2)), axis = -1);
+
+
+def inside_polygon(polygon, points, margin = 0, rule = 'nonzero'):
+  """Checks if points are inside polygons
+
+  Arguments:
+    polygon (...xmx2 array): vertices of the polygon (closing edge added implicitly)
+    points (...xnx2 array or 2 array): points to test
+    margin (float): if positive points need to be at least this far inside the polygon
+    rule ({'nonzero', 'evenodd'}): fill rule for self-intersecting polygons
+
+  Returns:
+    ...xn array of bools or bool: True if point is inside the polygon
+  """
+  points = np.asarray(points, dtype = float);
+  single = points.ndim == 1;
+  if single:
+    points = points[np.newaxis,:];
+
+  w = winding_number(polygon, points);
+  if rule == 'evenodd':
+    inside = np.mod(w, 2) == 1;
+  else:
+    inside = w != 0;
+
+  if margin > 0:
+    inside = np.logical_and(inside, distance_to_boundary(polygon, points) > margin);
+
+  if single:
+    return inside[...,0];
+  else:
+    return inside;
+
+
+def signed_distance(polygon, points, rule = 'nonzero'):
+  """Signed distance of points to the polygon boundary, positive inside
+
+  Arguments:
+    polygon (...xmx2 array): vertices of the polygon (closing edge added implicitly)
+    points (...xnx2 array): points
+    rule ({'nonzero', 'evenodd'}): fill rule for self-intersecting polygons
+
+  Returns:
+    ...xn array: signed distances
+  """
+  d = distance_to_boundary(polygon, points);
+  inside = inside_polygon(polygon, points, rule = rule);
+  return np.where(inside, d, -d);
+
+
+
+def test():
+  import numpy as np
+  import matplotlib.pyplot as plt
+  from matplotlib.path import Path
+  import interpolation.polygon as pg
+
+  t = np.linspace(0, 2 * np.pi, 50)[:-1];
+  poly = np.vstack([np.cos(t) * (1 + 0.3 * np.sin(5*t)), np.sin(t) * (1 + 0.3 * np.sin(5*t))]).T;
+  pts = np.random.rand(1000,2) * 3 - 1.5;
+
+  ins = pg.inside_polygon(poly, pts);
+  ins_ref = Path(poly).contains_points(pts);
+  print('deviations to matplotlib: %d' % np.sum(ins != ins_ref));
+
+  plt.figure(1); plt.clf();
+  plt.plot(poly[:,0], poly[:,1]);
+  plt.scatter(pts[:,0], pts[:,1], c = pg.signed_distance(poly, pts));
+  plt.axis('equal')
+
+  # many polygons at once
+  polys = np.array([poly * s for s in np.linspace(0.5, 1.5, 10)]);
+  ins = pg.inside_polygon(polys, pts[np.newaxis], margin = 0.05);
+  print(ins.shape)
+
+
+if __name__ == "__main__":
+  test();
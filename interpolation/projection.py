@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Projection Module
+
+Vectorized routines to project points onto discrete curves (polylines)
+"""
+
+__license__ = 'MIT License <http://www.opensource.org/licenses/mit-license.php>'
+__author__ = 'Christoph Kirst <ckirst@rockefeller.edu>'
+__docformat__ = 'rest'
+
+
+import numpy as np
+
+
+def project_points_to_segments(points, polyline):
+  """Projects points onto each segment of a polyline
+
+  Arguments:
+    points (nx2 array): points to project
+    polyline (mx2 array): vertices of the polyline
+
+  Returns:
+    nx(m-1) array: normalized position of the projections within each segment (clipped to [0,1])
+    nx(m-1)x2 array: projected points on each segment
+  """
+  points = np.asarray(points, dtype = float);
+  polyline = np.asarray(polyline, dtype = float);
+
+  start = polyline[:-1];
+  delta = np.diff(polyline, axis = 0);
+  length2 = np.sum(delta * delta, axis = 1);
+  length2[length2 == 0] = np.inf; # degenerate segments project onto their start point
+
+  diff = points[:,np.newaxis,:] - start[np.newaxis,:,:];
+  t = np.sum(diff * delta[np.newaxis,:,:], axis = 2) / length2[np.newaxis,:];
+  t = np.clip(t, 0, 1);
+
+  xy = start[np.newaxis,:,:] + t[:,:,np.newaxis] * delta[np.newaxis,:,:];
+
+  return t, xy
+
+
+def project_points_to_polyline(points, polyline, nneighbours = all, index = None,
+                               with_segment = False, with_position = False, with_distance = False):
+  """Projects points to their closest points on a polyline
+
+  Arguments:
+    points (nx2 array): points to project
+    polyline (mx2 array): vertices of the polyline
+    nneighbours (int or all): if not all only project the i-th point onto the
+                              sub line polyline[i-nneighbours:i+nneighbours]
+    index (n array or None): reference vertex index in the polyline for each point used
+                             together with nneighbours, if None use range(n)
+    with_segment (bool): if True return also segment index and normalized position within the segment
+    with_position (bool): if True return also the arc length position of the projections along the polyline
+    with_distance (bool): if True return also the distance of the points to the projections
+
+  Returns:
+    nx2 array: projected points
+    n array, n array: segment index and normalized position within segment
+    n array: arc length position of projection along the polyline
+    n array: distances between points and projections
+
+  Note:
+    This is a vectorized replacement for the shapely LineString.project /
+    LineString.interpolate combination applied to each point separately.
+  """
+  points = np.asarray(points, dtype = float);
+  polyline = np.asarray(polyline, dtype = float);
+  npts = points.shape[0];
+  nsegments = polyline.shape[0] - 1;
+
+  t, xy = project_points_to_segments(points, polyline);
+  dist = np.sum((xy - points[:,np.newaxis,:])**2, axis = 2);
+
+  if nneighbours is not all:
+    if index is None:
+      index = np.arange(npts);
+    index = np.asarray(index, dtype = int);
+    # segments in polyline[il:ir] with il = i - nneighbours, ir = i + nneighbours
+    smin = np.clip(index - nneighbours, 0, nsegments-1);
+    smax = np.clip(index + nneighbours - 2, smin, nsegments-1);
+    segments = np.arange(nsegments)[np.newaxis,:];
+    band = np.logical_and(segments >= smin[:,np.newaxis], segments <= smax[:,np.newaxis]);
+    dist[np.logical_not(band)] = np.inf;
+
+  segment = np.argmin(dist, axis = 1);
+  ids = np.arange(npts);
+  xy = xy[ids, segment];
+
+  if not (with_segment or with_position or with_distance):
+    return xy;
+
+  res = [xy];
+  if with_segment:
+    res.append(segment);
+    res.append(t[ids, segment]);
+  if with_position:
+    length = np.linalg.norm(np.diff(polyline, axis = 0), axis = 1);
+    position = np.hstack([0, np.cumsum(length)]);
+    res.append(position[segment] + t[ids, segment] * length[segment]);
+  if with_distance:
+    res.append(np.sqrt(dist[ids, segment]));
+
+  return tuple(res);
+
+
+def width_from_sides(center, left, right, nneighbours = all, index = None):
+  """Width of a shape as distance between the projections of the center line onto the sides
+
+  Arguments:
+    center (nx2 array): center line
+    left, right (mx2 array): left and right side lines
+    nneighbours (int or all): number of neighbouring vertices in the sides to consider
+    index (n array or None): reference vertex index in the side lines for each center point
+
+  Returns:
+    n array: width along the center line
+  """
+  left_xy  = project_points_to_polyline(center, left,  nneighbours = nneighbours, index = index);
+  right_xy = project_points_to_polyline(center, right, nneighbours = nneighbours, index = index);
+  return np.linalg.norm(left_xy - right_xy, axis = 1);
+
+
+
+def test():
+  import numpy as np
+  import matplotlib.pyplot as plt
+  import shapely.geometry as geom
+  import interpolation.projection as prj
+
+  t = np.linspace(0, 10, 50);
+  line = np.vstack([t, np.sin(t)]).T;
+  points = np.random.rand(100,2) * [10, 3] - [0, 1.5];
+
+  xy, s, u, p, d = prj.project_points_to_polyline(points, line, with_segment = True, with_position = True, with_distance = True);
+
+  # compare to shapely
+  ls = geom.LineString(line);
+  pp = np.array([ls.project(geom.Point(pt)) for pt in points]);
+  print('max deviation to shapely: %f' % np.max(np.abs(pp - p)));
+
+  plt.figure(1); plt.clf();
+  plt.plot(line[:,0], line[:,1]);
+  for pt, pr in zip(points, xy):
+    plt.plot([pt[0], pr[0]], [pt[1], pr[1]], 'k');
+  plt.axis('equal')
+
+  # restricted neighbourhood
+  xyn = prj.project_points_to_polyline(line + [0, 0.2], line, nneighbours = 3);
+  plt.plot(xyn[:,0], xyn[:,1], '.r');
+
+
+if __name__ == "__main__":
+  test();
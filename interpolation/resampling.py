@@ -11,21 +11,225 @@ __docformat__ = 'rest'
 import numpy as np
 from scipy.interpolate import splprep,splrep, splev
 
+_tiny = np.finfo(float).tiny;
 
-def resample_nd(curve, npoints = None, smooth = 0, periodic = False, derivative = 0, order = 5, iterations = 1):
+
+def arc_length(curve, periodic = False, normalize = False):
+  """Cumulative arc length along curves
+  
+  Arguments:
+    curve (...xmxd array): coordinates of the curve points
+    periodic (bool): if True the curves are closed and the closing segment is included
+    normalize (bool): if True normalize arc length to [0,1]
+  
+  Returns:
+    (...xm array or ...xm+1 array): cumulative arc length, m+1 points for periodic curves
+  """
+  curve = np.asarray(curve, dtype = float);
+  if periodic:
+    curve = np.concatenate([curve, curve[...,:1,:]], axis = -2);
+  ds = np.linalg.norm(np.diff(curve, axis = -2), axis = -1);
+  s = np.concatenate([np.zeros(ds.shape[:-1] + (1,)), np.cumsum(ds, axis = -1)], axis = -1);
+  if normalize:
+    total = s[...,-1:];
+    s = s / np.where(total > 0, total, 1);
+  return s;
+
+
+def _segment_index(u, us):
+  """Flat index of the segments of the increasing rows u containing us and the relative position within"""
+  nrows, n = u.shape;
+  if nrows == 1:
+    idx = np.searchsorted(u[0], us[0], side = 'right')[np.newaxis] - 1;
+  else:
+    # offset rows to search all rows at once
+    offset = (np.arange(nrows) * (np.max(u[:,-1]) - np.min(u[:,0]) + 1))[:,np.newaxis];
+    idx = np.searchsorted((u + offset).ravel(), (us + offset).ravel(), side = 'right').reshape(nrows,-1) - 1;
+    idx -= np.arange(nrows)[:,np.newaxis] * n;
+  np.clip(idx, 0, n-2, out = idx);
+  idx += np.arange(nrows)[:,np.newaxis] * n;
+  
+  uf = u.ravel();
+  u0 = uf[idx]; 
+  h = uf[idx+1] - u0;
+  hpos = h > 0;
+  t = np.where(hpos, (us - u0) / np.where(hpos, h, 1), 0);
+  
+  return idx, t, h;
+
+
+def _tangents(u, values, periodic = False):
+  """Finite difference tangents of values with respect to parameter u for cubic Hermite interpolation"""
+  h = np.diff(u, axis = -1)[...,np.newaxis];
+  slope = np.diff(values, axis = -2) / np.where(h > 0, h, 1);
+  
+  if periodic: # u and values include the closing point
+    h = np.concatenate([h[:,-1:], h], axis = 1);
+    slope = np.concatenate([slope[:,-1:], slope], axis = 1);
+  
+  hl = h[:,:-1]; hr = h[:,1:];
+  hs = hl + hr;
+  mi = (hr * slope[:,:-1] + hl * slope[:,1:]) / np.where(hs > 0, hs, 1);
+  
+  if periodic:
+    return np.concatenate([mi, mi[:,:1]], axis = 1);
+  else:
+    return np.concatenate([slope[:,:1], mi, slope[:,-1:]], axis = 1);
+
+
+def _interpolate_curve(u, values, us, method = 'cubic', periodic = False):
+  """Interpolation of a single curve as in :func:`interpolate` without the batch machinery"""
+  v = values.T;
+  h = u[1:] - u[:-1];
+  hs = h + (h == 0);
+  idx = np.minimum(np.maximum(np.searchsorted(u, us, side = 'right') - 1, 0), len(h) - 1);
+  t = (us - u[idx]) / hs[idx];
+  d = v[:,1:] - v[:,:-1];
+  
+  if method == 'linear':
+    return (v[:,idx] + t * d[:,idx]).T;
+  
+  # tangents as in :func:`_tangents`
+  slope = d / hs;
+  tangents = np.empty_like(v);
+  w = h[:-1] / np.maximum(h[:-1] + h[1:], _tiny);
+  tangents[:,1:-1] = slope[:,:-1] + w * (slope[:,1:] - slope[:,:-1]);
+  if periodic:
+    w = h[-1] / max(h[-1] + h[0], _tiny);
+    tangents[:,0] = tangents[:,-1] = slope[:,-1] + w * (slope[:,0] - slope[:,-1]);
+  else:
+    tangents[:,0] = slope[:,0]; tangents[:,-1] = slope[:,-1];
+  
+  # cubic Hermite polynomials in Horner form
+  m0 = (h * tangents[:,:-1])[:,idx];
+  m1 = (h * tangents[:,1:])[:,idx];
+  d = d[:,idx];
+  return (v[:,idx] + t * (m0 + t * (3 * d - 2 * m0 - m1 + t * (m0 + m1 - 2 * d)))).T;
+
+
+def interpolate(u, values, us, method = 'cubic', periodic = False):
+  """Interpolates values given at increasing parameters
+  
+  Arguments:
+    u (...xm array): increasing parameter values, for periodic data including the closing point
+    values (...xmxd array): values at the parameters, for periodic data including the closing point
+    us (k or ...xk array): parameters to interpolate at
+    method (str): 'linear' or 'cubic' (Hermite interpolation)
+    periodic (bool): if True use periodic tangents at the end points for cubic interpolation
+  
+  Returns:
+    (...xkxd array): interpolated values
+  """
+  u = np.asarray(u, dtype = float);
+  values = np.asarray(values, dtype = float);
+  us = np.asarray(us, dtype = float);
+  if u.ndim == 1 and us.ndim == 1: # fast path for single curves
+    return _interpolate_curve(u, values, us, method = method, periodic = periodic);
+  
+  shape = u.shape[:-1];
+  m = u.shape[-1]; d = values.shape[-1];
+  
+  u = u.reshape(-1, m);
+  values = values.reshape(-1, m, d);
+  nrows = u.shape[0];
+  us = np.broadcast_to(us, shape + us.shape[-1:]).reshape(nrows, -1);
+  
+  idx, t, h = _segment_index(u, us);
+  t = t[...,np.newaxis]; 
+  
+  vf = values.reshape(-1, d);
+  v0 = vf[idx];
+  v1 = vf[idx+1];
+  
+  if method == 'linear':
+    res = v0 + t * (v1 - v0);
+  else:
+    mf = _tangents(u, values, periodic = periodic).reshape(-1, d);
+    h = h[...,np.newaxis];
+    t2 = t * t; t3 = t2 * t;
+    res = (2*t3 - 3*t2 + 1) * v0 + (t3 - 2*t2 + t) * h * mf[idx] + (-2*t3 + 3*t2) * v1 + (t3 - t2) * h * mf[idx+1];
+  
+  return res.reshape(shape + res.shape[-2:]);
+
+
+def resample_arc_length(curve, npoints = None, periodic = False, method = 'cubic'):
+  """Resample curves with points equidistant in arc length
+  
+  Arguments:
+    curve (...xmxd array): coordinates of the curve points
+    npoints (int or None): number of resampled points
+    periodic (bool): if True the curves are closed
+    method (str): 'linear' or 'cubic' (Hermite) interpolation between the curve points
+  
+  Returns:
+    (...xnpointsxd array): resampled points
+  
+  Note:
+    For closed curves the resampled points do not repeat the first point at the end.
+    The curves are parameterized by the cumulative arc length of the polygon through the 
+    points, the same parameterization :func:`resample_nd` uses for the spline.
+  """
+  curve = np.asarray(curve, dtype = float);
+  if npoints is None or npoints is all:
+    npoints = curve.shape[-2];
+  
+  if curve.ndim == 2: # fast path for single curves
+    if periodic:
+      curve = np.concatenate([curve, curve[:1]]);
+    d = curve[1:] - curve[:-1];
+    u = np.zeros(len(curve));
+    np.cumsum(np.sqrt(np.einsum('ij,ij->i', d, d)), out = u[1:]);
+    us = np.arange(npoints) * (u[-1] / max(npoints - (not periodic), 1));
+    if method == 'linear':
+      return np.array([np.interp(us, u, c) for c in curve.T]).T;
+    return _interpolate_curve(u, curve, us, method = method, periodic = periodic);
+  
+  u = arc_length(curve, periodic = periodic, normalize = True);
+  if periodic:
+    values = np.concatenate([curve, curve[...,:1,:]], axis = -2);
+    us = np.linspace(0, 1, npoints + 1)[:-1];
+  else:
+    values = curve;
+    us = np.linspace(0, 1, npoints);
+  
+  return interpolate(u, values, us, method = method, periodic = periodic);
+
+
+def resample_nd(curve, npoints = None, smooth = 0, periodic = False, derivative = 0, order = 5, iterations = 1, method = 'spline'):
   """Resample n points using n equidistant points along a curve
   
   Arguments:
-    points (mxd array): coordinate of the reference points for the curve
+    points (mxd or ...xmxd array): coordinate of the reference points for the curve
     npoints (int): number of resamples equidistant points
     smooth (number): smoothness factor
     periodic (bool): if True assumes the curve is a closed curve
+    method (str): 'cubic' or 'linear' for arc length interpolation, 'spline' for spline interpolation
   
   Returns:
     (nxd array): resampled equidistant points
+  
+  Note:
+    Spline interpolation via splprep is used if method is 'spline', smoothing
+    is requested or derivatives are returned, otherwise the arc length 
+    resampling :func:`resample_arc_length` is used, which also handles many 
+    curves at once.
   """
   if npoints is None or npoints is all:
-    npoints = curve.shape[0];  
+    npoints = curve.shape[-2];
+  
+  if method != 'spline' and smooth == 0 and derivative == 0:
+    for i in range(iterations):
+      if periodic: # keep closing point as for splines
+        curve = resample_arc_length(curve, npoints - 1, periodic = True, method = method);
+        curve = np.concatenate([curve, curve[...,:1,:]], axis = -2);
+      else:
+        curve = resample_arc_length(curve, npoints, method = method);
+    return curve;
+  
+  if curve.ndim > 2:
+    return np.array([resample_nd(c, npoints, smooth = smooth, periodic = periodic, derivative = derivative, 
+                                 order = order, iterations = iterations, method = method) for c in curve]);
+  
   for i in range(iterations):  
     cinterp, u = splprep(curve.T, u = None, s = smooth, per = periodic, k = order);
     us = np.linspace(u.min(), u.max(), npoints)
@@ -33,30 +237,41 @@ def resample_nd(curve, npoints = None, smooth = 0, periodic = False, derivative
   return curve;
 
 
-def resample_1d(data, npoints = None, smooth = 0, periodic = False, derivative = 0, order = 5, iterations = 0):
+def resample_1d(data, npoints = None, smooth = 0, periodic = False, derivative = 0, order = 5, iterations = 0, method = 'spline'):
   """Resample 1d data using n equidistant points
   
   Arguments:
-    data (array): data points
+    data (array or ...xm array): data points
     npoints (int): number of points in equidistant resampling
     smooth (number): smoothness factor
     periodic (bool): if True assumes the curve is a closed curve
+    method (str): 'cubic' or 'linear' for fast interpolation, 'spline' for spline interpolation
   
   Returns:
     (array): resampled data points
   """
-  if npoints is None or npoints is None:
-    npoints = data.shape[0];
+  if npoints is None or npoints is all:
+    npoints = data.shape[-1];
 
-  u0 = np.linspace(0, 1, data.shape[0]);
+  u0 = np.linspace(0, 1, data.shape[-1]);
   us = np.linspace(0, 1, npoints);
+  
+  if method != 'spline' and smooth == 0 and derivative == 0 and not periodic:
+    data = np.asarray(data, dtype = float);
+    for i in range(iterations):
+      if data.ndim == 1:
+        data = _interpolate_curve(u0, data[:,np.newaxis], us, method = method)[:,0];
+      else:
+        data = interpolate(np.broadcast_to(u0, data.shape), data[...,np.newaxis], us, method = method)[...,0];
+    return data;
+  
   for i in range(iterations):
     dinterp = splrep(u0, data, s = smooth, per = periodic, k = 5);
     data = splev(us, dinterp, der = derivative);
   return data;
 
 
-def resample(curve, npoints = None, smooth = 0, periodic = False, derivative = 0, order = 5, iterations = 1):
+def resample(curve, npoints = None, smooth = 0, periodic = False, derivative = 0, order = 5, iterations = 1, method = 'spline'):
   """Resample n points using n equidistant points along a curve
   
   Arguments:
@@ -64,14 +279,15 @@ def resample(curve, npoints = None, smooth = 0, periodic = False, derivative = 0
     npoints (int): number of resamples equidistant points
     smooth (number): smoothness factor
     periodic (bool): if True assumes the curve is a closed curve
+    method (str): 'cubic' or 'linear' for fast arc length interpolation, 'spline' for spline interpolation
   
   Returns:
     (nxd array): resampled equidistant points
   """
   if curve.ndim > 1:
-    return resample_nd(curve, npoints, smooth = smooth, periodic = periodic, derivative = derivative, order = order, iterations = iterations);
+    return resample_nd(curve, npoints, smooth = smooth, periodic = periodic, derivative = derivative, order = order, iterations = iterations, method = method);
   else:
-    return resample_1d(curve, npoints, smooth = smooth, periodic = periodic, derivative = derivative, order = order, iterations = iterations);
+    return resample_1d(curve, npoints, smooth = smooth, periodic = periodic, derivative = derivative, order = order, iterations = iterations, method = method);
 
 
 
@@ -95,6 +311,20 @@ def test():
   plt.plot(curve1d);
   plt.plot(rcurve1d);
   
+  # arc length resampling of many curves
+  curves = np.array([curve + [0, i] for i in range(10)]);
+  rcurves = res.resample_arc_length(curves, npoints = 150, method = 'cubic');
+  print('max deviation to spline: %f' % np.max(np.abs(rcurves[0] - rcurve)));
+  plt.figure(3); plt.clf();
+  for c in rcurves:
+    plt.plot(c[:,0], c[:,1]);
+  
+  # closed curves
+  t = np.linspace(0, 2 * np.pi, 30)[:-1];
+  circle = np.vstack([2 * np.cos(t), np.sin(t)]).T;
+  rcircle = res.resample_arc_length(circle, npoints = 100, periodic = True);
+  plt.plot(rcircle[:,0], rcircle[:,1], '.');
+  
   
 if __name__ == "__main__":
   test();
\ No newline at end of file
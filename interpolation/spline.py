@@ -18,6 +18,120 @@ import copy
 from scipy.interpolate import splrep, splev, splint, splder, splantider, sproot;
 
 
+############################################################################
+### Spline basis
+
+def basis_matrix(knots_all, degree, points, derivative = 0, extrapolation = 1):
+  """Design matrix of the bspline basis functions at the sample points via Cox-de Boor recursion
+  
+  Arguments:
+    knots_all (array): full knot vector including boundary knots
+    degree (int): degree of the spline
+    points (array): sample points
+    derivative (int): if n>0 the design matrix of the n-th derivative is returned
+    extrapolation (int): 0=extrapolated value, 1=return 0, 2=raise a ValueError, 3=boundary value
+  
+  Returns:
+    array: npoints x nparameter matrix, spline values are given by the dot product with the parameter
+  
+  Note:
+    The result agrees with evaluating splev for each unit parameter vector.
+  """
+  t = np.asarray(knots_all, dtype = float);
+  x = np.array(points, dtype = float, ndmin = 1);
+  k = int(degree);
+  nt = t.shape[0];
+  
+  lo, up = t[k], t[nt-k-1];
+  outside = np.logical_or(x < lo, x > up);
+  if extrapolation == 2 and np.any(outside):
+    raise ValueError('sample points outside of the spline domain!');
+  if extrapolation == 3 and derivative == 0: # splev extrapolates derivatives in this case
+    x = np.clip(x, lo, up);
+  
+  if derivative < 0 or derivative > k:
+    raise ValueError('0 <= derivative = %d <= degree = %d must hold!' % (derivative, k));
+  
+  # degree zero basis on the knot interval of each point, end intervals are extended
+  interval = np.clip(np.searchsorted(t, x, side = 'right') - 1, k, nt - k - 2);
+  basis = np.zeros((x.shape[0], nt - 1));
+  basis[np.arange(x.shape[0]), interval] = 1;
+  
+  xc = x[:,np.newaxis];
+  for d in range(1, k - derivative + 1):
+    t0 = t[:nt-d-1]; t1 = t[d:nt-1]; t2 = t[1:nt-d]; t3 = t[d+1:];
+    den1 = t1 - t0; den1[den1 == 0] = np.inf;
+    den2 = t3 - t2; den2[den2 == 0] = np.inf;
+    basis = (xc - t0) / den1 * basis[:,:-1] + (t3 - xc) / den2 * basis[:,1:];
+  
+  for d in range(k - derivative + 1, k + 1):
+    t0 = t[:nt-d-1]; t1 = t[d:nt-1]; t2 = t[1:nt-d]; t3 = t[d+1:];
+    den1 = t1 - t0; den1[den1 == 0] = np.inf;
+    den2 = t3 - t2; den2[den2 == 0] = np.inf;
+    basis = d * (basis[:,:-1] / den1 - basis[:,1:] / den2);
+  
+  if extrapolation == 1:
+    basis[outside] = 0;
+  
+  return basis;
+
+
+# process wide cache of projection matrices shared read-only by all splines
+_projection_cache = {};
+_projection_cache_size = 1024;
+
+def _projection_key(knots_all, degree, points, derivative, extrapolation):
+  return (np.asarray(knots_all, dtype = float).tobytes(), int(degree), 
+          np.asarray(points, dtype = float).tobytes(), int(derivative), int(extrapolation));
+
+
+def projection_matrix(knots_all, degree, points, derivative = 0, extrapolation = 1):
+  """Cached read-only design matrix of the bspline basis, see :func:`basis_matrix`"""
+  key = _projection_key(knots_all, degree, points, derivative, extrapolation);
+  projection = _projection_cache.get(key);
+  if projection is None:
+    if len(_projection_cache) >= _projection_cache_size:
+      _projection_cache.clear();
+    projection = basis_matrix(knots_all, degree, points, derivative = derivative, extrapolation = extrapolation);
+    projection.setflags(write = False);
+    _projection_cache[key] = projection;
+  return projection;
+
+
+def projection_matrix_inverse(knots_all, degree, points, derivative = 0, extrapolation = 1):
+  """Cached read-only inverse of the design matrix or False if not invertible"""
+  key = ('inverse',) + _projection_key(knots_all, degree, points, derivative, extrapolation);
+  projection_inverse = _projection_cache.get(key);
+  if projection_inverse is None:
+    projection = projection_matrix(knots_all, degree, points, derivative = derivative, extrapolation = extrapolation);
+    try:
+      if projection.shape[0] != projection.shape[1]:
+        projection_inverse = False;
+      else:
+        projection_inverse = np.linalg.inv(projection);
+        projection_inverse.setflags(write = False);
+    except:
+      projection_inverse = False;
+    if len(_projection_cache) >= _projection_cache_size:
+      _projection_cache.clear();
+    _projection_cache[key] = projection_inverse;
+  return projection_inverse;
+
+
+def _project_batch(projection, parameter):
+  """Applies the projection matrix to a batch of Bxnparameter or Bxnparameterxndim parameter"""
+  parameter = np.asarray(parameter, dtype = float);
+  if parameter.ndim == 2:
+    return parameter.dot(projection.T);
+  else:
+    return np.matmul(projection, parameter);
+
+
+def clear_projection_cache():
+  """Clears the process wide cache of projection matrices"""
+  _projection_cache.clear();
+
+
 class Spline(object):
   """Class for handling 1d spline interpolation and conversion between bspline coefficients and splines"""
   
@@ -124,6 +238,17 @@ class Spline(object):
     """Deep copy the Spline"""
     return copy.deepcopy(self);
   
+  def __deepcopy__(self, memo):
+    """Deep copy sharing the read-only projection matrices"""
+    new = self.__class__.__new__(self.__class__);
+    memo[id(self)] = new;
+    for key, value in self.__dict__.items():
+      if key in ['_projection', '_projection_inverse']:
+        new.__dict__[key] = value;
+      else:
+        new.__dict__[key] = copy.deepcopy(value, memo);
+    return new;
+  
   ############################################################################
   ### Properties 
   
@@ -570,15 +695,7 @@ class Spline(object):
       extrapolation (int): projection matrix with 0=extrapolated value, 1=return 0, 3=boundary value
     """
     points = self.get_points(points, error = 'sample points need to be specified for the calculation of the projection matrix!')
-    
-    projection = np.zeros((self._nparameter, points.shape[0]));
-    for i in range(self._nparameter):
-      p = np.zeros(self._nparameter);
-      p[i] = 1;
-      pp = np.pad(p, (0,self.degree+1), 'constant'); # splev wants parameter
-      tck = (self.knots_all, pp, self.degree);
-      projection[i] = splev(points, tck, der = derivative, ext = extrapoltaion);
-    return projection.T; 
+    return projection_matrix(self.knots_all, self.degree, points, derivative = derivative, extrapolation = extrapoltaion);
 
 
   def projection_matrix_inverse(self, points = None, derivative = 0, extrapoltaion = 1):
@@ -589,19 +706,8 @@ class Spline(object):
       derivative (int): if n>0 the projection matrix of the n-th derivative is returned
       extrapolation (int): projection matrix with 0=extrapolated value, 1=return 0, 3=boundary value
     """
-    if (points is None or points is self._points) and derivative == 0 and extrapoltaion == 1:
-      projection = self.projection;
-    else:
-      projection = self.projection_matrix(points = points, derivative = derivative, extrapoltaion = extrapoltaion);
-    
-    try:
-      if projection.shape[0] != projection.shape[1]:
-        return False;
-      projection_inverse = np.linalg.inv(projection);
-    except:
-      return False;
-    
-    return projection_inverse;
+    points = self.get_points(points, error = 'sample points need to be specified for the calculation of the projection matrix!')
+    return projection_matrix_inverse(self.knots_all, self.degree, points, derivative = derivative, extrapolation = extrapoltaion);
   
     
   def tck(self):
@@ -629,6 +735,59 @@ class Spline(object):
   #  return Curve(tck = self.tck_ndim(), points = self.points);
   
   
+  ############################################################################
+  ### Batch evaluation
+  
+  def get_values_batch(self, parameter, points = None, derivative = 0, extrapolation = 1):
+    """Calculates the values of many splines with the same knots along the sample points
+    
+    Arguments:
+      parameter (Bxnparameter array): the bspline parameter of the splines
+      points (array or None): the sample points for the values, if None use internal samples points
+      derivative (int): the order of the derivative
+      extrapolation (int):  0=extrapolated value, 1=return 0, 2=raise a ValueError, 3=boundary value
+
+    Returns:
+      array: Bxnpoints values of the splines at the sample points
+    
+    Note:
+      The values are obtained via a single matrix product with the cached projection matrix.
+    """
+    points = self.get_points(points, error = 'sample points need to be specified for the calculation of the values of the splines!');
+    projection = projection_matrix(self.knots_all, self.degree, points, derivative = derivative, extrapolation = extrapolation);
+    return _project_batch(projection, parameter);
+  
+  
+  def derivative_batch(self, parameter, points = None, n = 1, extrapolation = 1):
+    """Calculates the n-th derivatives of many splines with the same knots along the sample points"""
+    return self.get_values_batch(parameter, points = points, derivative = n, extrapolation = extrapolation);
+  
+  
+  def integral_batch(self, parameter, points = None, n = 1, extrapolation = 1):
+    """Calculates the n-th integrals of many splines with the same knots along the sample points
+    
+    Arguments:
+      parameter (Bxnparameter array): the bspline parameter of the splines
+      points (array or None): the sample points for the values, if None use internal samples points
+      n (int): order of the integral
+      extrapolation (int):  0=extrapolated value, 1=return 0, 2=raise a ValueError, 3=boundary value
+    
+    Returns:
+      array: Bxnpoints values of the integrals starting at the first knot
+    """
+    points = self.get_points(points, error = 'sample points need to be specified for the calculation of the integrals of the splines!');
+    t, k = self.knots_all, self.degree;
+    c = np.asarray(parameter, dtype = float);
+    for j in range(n):
+      dt = t[k+1:] - t[:-k-1];
+      c = np.cumsum(c * np.reshape(dt, (1,-1) + (1,) * (c.ndim - 2)), axis = 1) / (k + 1);
+      c = np.concatenate([np.zeros((c.shape[0], 1) + c.shape[2:]), c], axis = 1);
+      t = np.r_[t[0], t, t[-1]];
+      k += 1;
+    projection = projection_matrix(t, k, points, extrapolation = extrapolation);
+    return _project_batch(projection, c);
+  
+  
   ############################################################################
   ### Spline functionality     
   
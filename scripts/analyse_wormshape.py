@@ -16,6 +16,7 @@ import matplotlib.pyplot as plt
 import analysis.experiment as exp
 import analysis.plot as aplt
 import worm.model as wmodel
+import utils.frames as frm
 
 
 npts = 22;
@@ -35,12 +36,30 @@ data_sizes = [(ntimes, ntheta), ntimes, (ntimes,2), ntimes, (ntimes, npts, 2), (
 
 data_files = [os.path.join(data_path, 'analysis_2016_10_26_' + n + '.npy') for n in data_names];
 
-
-for fn,s in zip(data_files, data_sizes):
-  #fn = os.path.join(data_path, 'analysis_2016_10_25_' + n + '.npy');
-  #np.lib.format.open_memmap(fn, mode = 'w+', shape  = s);
-  d = np.zeros(s);
-  np.save(fn, d);
+# algorithm tag stored for each processed frame
+provenance = 'from_image_v1';
+provenance_file = os.path.join(data_path, 'analysis_2016_10_26_provenance.npy');
+
+# reprocess only selected frames of existing results, e.g. dict(failed = True), 
+# dict(ranges = [(0, 10000)]) or dict(index = 'frames.npy'), None to process all frames 
+reprocess = None;
+#reprocess = dict(failed = True);
+
+if reprocess is None:
+  for fn,s in zip(data_files, data_sizes):
+    #fn = os.path.join(data_path, 'analysis_2016_10_25_' + n + '.npy');
+    #np.lib.format.open_memmap(fn, mode = 'w+', shape  = s);
+    d = np.zeros(s);
+    np.save(fn, d);
+  np.save(provenance_file, np.zeros(ntimes, dtype = 'S16'));
+  frame_ids = range(ntimes);
+else:
+  # failed frames are marked by a width of -1
+  status = -np.asarray(np.load(data_files[-1], mmap_mode = 'r')[:,0] == -1, dtype = int);
+  frame_ids = frm.select_frames(ntimes, status = status, **reprocess);
+  if not os.path.isfile(provenance_file):
+    np.save(provenance_file, np.zeros(ntimes, dtype = 'S16'));
+  print('reprocessing %d / %d frames' % (len(frame_ids), ntimes));
 
 import warnings
 warnings.filterwarnings("ignore")
@@ -48,8 +67,9 @@ warnings.filterwarnings("ignore")
 def process(i):
   img = exp.load_img(t=i);
   data = [np.load(fn, mmap_mode = 'r+') for fn in data_files];
+  np.load(provenance_file, mmap_mode = 'r+')[i] = provenance;
   if i % 1000 == 0:
-    print 'processing %d/%d...' % (i, ntimes);
+    print('processing %d/%d...' % (i, ntimes));
   try:
     w.from_image(img, verbose = False);
     results = list(w.theta());
@@ -67,7 +87,7 @@ def process(i):
 from multiprocessing import Pool, cpu_count;
 pool = Pool(processes = cpu_count());
 #pool.map(process, range(2));
-pool.map(process, range(ntimes));
+pool.map(process, frame_ids);
 
 
 
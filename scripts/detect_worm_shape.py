@@ -26,6 +26,8 @@ import ClearMap.GUI.DataViewer as dv
 
 import scripts.process_movie_plot as pmp;
 import scripts.process_movie_util as pmu;
+import scripts.parallel_memmaps as pmm
+import utils.frames as frm
 
 reload(pmp); reload(pmu);
 
@@ -99,10 +101,11 @@ else:
   
 
 if overwrite or not os.path.isfile(data_shape_info_file):
-  data_shape_info = np.lib.format.open_memmap(data_shape_info_file, 'w+', shape = (n_frames_total,),  dtype = [('center', '2float32'), ('success', 'int32')], fortran_order = False);
+  data_shape_info = np.lib.format.open_memmap(data_shape_info_file, 'w+', shape = (n_frames_total,),  dtype = [('center', '2float32'), ('success', 'int32'), ('route', 'int8'), ('provenance', 'S16'), ('tracked', 'bool')], fortran_order = False);
   #data_info = np.zeros(n_frames_total, dtype = [('origin', '2int32'), ('size', 'int32'), ('center', '2float32'), ('failed' , 'uint8'), ('objects', 'int32')]);
 else:
-  data_shape_info = np.lib.format.open_memmap(data_shape_info_file, mode = 'r+');
+  # older shape info files are extended by the routing, provenance and tracking columns
+  data_shape_info = pmm.add_fields(data_shape_info_file, [('route', 'int8'), ('provenance', 'S16'), ('tracked', 'bool')]);
   #data_info  = np.load(data_info_file);  
 
 
@@ -143,15 +146,45 @@ parallel = True;
 parallel = False;
 verbose = False if parallel else verbose;
 
+tracking = False; # use the shape in the previous frame as hints, no speedup, only helps to resolve ambiguous frames
+routing = True;  # fast detection for easy frames, full detection for hard (curled) frames only
+skeleton = True; # medial axis detection for easy frames, falls back to the contour based detection
+
+provenance = 'skeleton_v1' if routing and skeleton else 'routed_v1' if routing else 'tracked_v1' if tracking else 'full_v1'; # algorithm tag stored for each processed frame
+
+# reprocess only selected frames, e.g. dict(failed = True), dict(codes = [1612, 1605]),
+# dict(ranges = [(0, 10000)]), dict(index = 'frames.npy') or None to process frame_ids
+reprocess = None;
+#reprocess = dict(failed = True);
+
+if reprocess is not None:
+  selected = frm.select_frames(n_frames_total, status = data_shape_info['success'], **reprocess);
+  print('reprocessing %d / %d frames' % (len(selected), n_frames_total));
+  frame_ids = frm.frame_batches(selected, batch_size = frame_batch, max_gap = frame_batch);
+  is_selected = np.zeros(n_frames_total, dtype = bool);
+  is_selected[selected] = True;
+
 n_points2 = n_points//2;
 
 
-import scripts.parallel_memmaps as pmm
+def stored_shape(f):
+  """Returns the stored shape of a frame in the format of :func:`wgn.shape_from_image`"""
+  info = np.lib.format.open_memmap(data_shape_info_file, mode = 'r')[f];
+  shp = np.lib.format.open_memmap(data_shape_file, mode = 'r')[f];
+  cnt = np.lib.format.open_memmap(data_contour_file, mode = 'r')[f];
+  return (info['success'], cnt[:2].T, cnt[2:].T, shp[:2].T, shp[2]);
+
 
 #for m in range(n_movies):
 def analyze_shape(fid):
+  #frames to process, a batch of consecutive frames starting at fid or an array of selected frames
+  if isinstance(fid, np.ndarray):
+    frames = fid;
+  else:
+    frames = np.arange(fid, min(fid+frame_batch, n_frames_total));
+  fid, fid2 = frames[0], frames[-1] + 1;
+  
   #load memmaps
-  fid2 = min(fid+frame_batch, n_frames_total);
   images = np.lib.format.open_memmap(data_image_file, mode = 'r');
   
   shape = pmm.open_memmap(data_shape_file, arange = (fid, fid2), mode = 'r+');
@@ -160,31 +193,45 @@ def analyze_shape(fid):
   
   #smooth
   #print('processing %d / %d' % (fid, n_frames_total));
-
-  for i,f in enumerate(range(fid, fid2)):
+  
+  previous = None; f_previous = None;
+  for j,f in enumerate(frames):
+    i = f - fid;
     #print('success status: %d' % shape_info[i]['success']);   
-    if i % 100 == 0:
+    if j % 100 == 0:
       print('processing %d / %d' % (f, n_frames_total));
+    
+    # track only across consecutive frames, when reprocessing start from stored neighbours
+    if f_previous is None or f != f_previous + 1:
+      previous = None;
+      if tracking and reprocess is not None and f > 0 and not is_selected[f-1]:
+        previous = stored_shape(f-1);
+    f_previous = f;
+    
     blur = cv2.GaussianBlur(np.asarray(images[f], dtype = float), ksize = (5,5), sigmaX = 0);  
-    #if i > 0:
-    #  head_tail_hint = shape[i-1,:2,[0,-1]];
-    #  print head_tail_hint.shape
-    #else:
-    head_tail_hint = None;
-    #print i, head_tail_hint
     
     thres = 132.0 + f * 1.0/n_frames_total * (140-132);
     thres = 132;    
-    print thres
+    #print(thres)
     
         
     if verbose:
       plt.clf();
     #try:
-    res = wgn.shape_from_image(blur, absolute_threshold = thres, sigma = None,
-                               smooth_head_tail = 10.0, smooth_left_right = 5.0, smooth_center = 5.0, npoints = n_points, ncontour = n_contour, center_offset = 1,
-                               head_tail_hint = head_tail_hint,
-                               verbose = verbose);
+    if routing:
+      res = wgn.shape_from_image_routed(blur, previous = previous if tracking else None, skeleton = skeleton, with_tracked = True,
+                                        absolute_threshold = thres, sigma = None,
+                                        smooth_head_tail = 10.0, smooth_left_right = 5.0, smooth_center = 5.0, npoints = n_points, ncontour = n_contour, center_offset = 1,
+                                        verbose = verbose);
+      route = res[0]; res = res[1:];
+    else:
+      res = wgn.shape_from_image_tracked(blur, previous = previous if tracking else None, with_tracked = True,
+                                         absolute_threshold = thres, sigma = None,
+                                         smooth_head_tail = 10.0, smooth_left_right = 5.0, smooth_center = 5.0, npoints = n_points, ncontour = n_contour, center_offset = 1,
+                                         verbose = verbose);
+      route = 2;
+    tracked = res[-1]; res = res[:-1];
+    previous = res;
     #print(res[0]);
     #except:
     #  print('something went wrong');
@@ -193,7 +240,11 @@ def analyze_shape(fid):
     if verbose:
       plt.draw(); plt.pause(0.5); 
 
-    shape_info[i] = (res[-2][n_points2], res[0]);
+    shape_info[i]['center'] = res[-2][n_points2];
+    shape_info[i]['success'] = res[0];
+    shape_info[i]['route'] = route;
+    shape_info[i]['provenance'] = provenance;
+    shape_info[i]['tracked'] = tracked;
     shape[i] = np.vstack([res[-2].T, res[-1]]);
     contour[i] = np.vstack([res[1].T, res[2].T]);
     #print('success status after: %d vs %d' % (shape_info[i]['success'], res[0]));  
@@ -202,6 +253,7 @@ def analyze_shape(fid):
   #save info after each batch
   shape.flush();
   shape_info.flush();
+  contour.flush();
   
   if not parallel:
     return blur, res;
@@ -290,6 +342,16 @@ su = np.unique(s)
 for i in su:
   print('success %8d: %d' % (i, np.sum(s == i)))
 
+r = data_shape_info['route'];
+for i in np.unique(r):
+  print('route %d %s: %d' % (i, wgn.route_dict.get(i, ''), np.sum(r == i)))
+
+p = data_shape_info['provenance'];
+for i in np.unique(p):
+  print('provenance %16s: %d' % (i, np.sum(p == i)))
+
+print('tracked: %d' % np.sum(data_shape_info['tracked']))
+
 
 #%%
 
@@ -325,6 +387,18 @@ print('failed: %d' % len(failed));
 
 #looks good ! => no obvious failures anymore !
 
+#%% globally consistent head tail orientation
+
+import worm.shapes as wsh
+
+data_shape = np.lib.format.open_memmap(data_shape_file, mode = 'r+');
+data_contour = np.lib.format.open_memmap(data_contour_file, mode = 'r+');
+data_shape_info = np.lib.format.open_memmap(data_shape_info_file, mode = 'r+');
+
+flipped = wsh.align_head_tail(data_shape, contours = data_contour, shape_info = data_shape_info);
+print('flipped head and tail in %d frames' % len(flipped));
+
+
 #%% area / length
 import worm ,geometry as wgeo;
 
@@ -5,7 +5,7 @@ Created on Thu Jan 25 19:03:21 2018
 @author: ckirst
 """
 
-
+import os
 import numpy as np;
 
 
@@ -28,7 +28,7 @@ def get_offset(filename):
   
 def open_memmap(filename, arange = None, mode = 'r+', shape = None, dtype = None, fortran = False):
   if arange is None:
-    np.lib.format.open_memmap(filename, mode = mode, shape = shape, dtype = dtype, fortran_order = fortran);
+    return np.lib.format.open_memmap(filename, mode = mode, shape = shape, dtype = dtype, fortran_order = fortran);
   else:
    shape, dtype, offset, fortran_order = get_offset(filename);
    assert fortran_order is False;
@@ -37,6 +37,37 @@ def open_memmap(filename, arange = None, mode = 'r+', shape = None, dtype = None
    shape_offset = np.prod(shape[1:]);
    shape = tuple(shape);
    return np.memmap(filename,  mode = mode,  shape = shape, dtype = dtype, order = 'C', offset = offset + arange[0] * dtype.itemsize * shape_offset);
+
+
+def add_fields(filename, fields, chunk_size = 100000):
+  """Adds fields to a structured array stored in a npy file
+  
+  Arguments:
+    filename (str): npy file with a structured array
+    fields (list): list of (name, dtype) tuples of the fields to add, existing fields are ignored
+    chunk_size (int): number of rows to copy at once
+  
+  Returns:
+    memmap: the extended array opened in r+ mode
+  """
+  data = np.lib.format.open_memmap(filename, mode = 'r');
+  fields = [f for f in fields if f[0] not in data.dtype.names];
+  if len(fields) == 0:
+    del data;
+    return np.lib.format.open_memmap(filename, mode = 'r+');
+  
+  dtype = np.dtype(data.dtype.descr + list(fields));
+  tmpname = filename + '.tmp.npy';
+  new = np.lib.format.open_memmap(tmpname, mode = 'w+', shape = data.shape, dtype = dtype);
+  for i in range(0, data.shape[0], chunk_size):
+    chunk = data[i:i+chunk_size];
+    for n in data.dtype.names:
+      new[n][i:i+chunk_size] = chunk[n];
+  new.flush();
+  del new, data;
+  
+  os.rename(tmpname, filename);
+  return np.lib.format.open_memmap(filename, mode = 'r+');
    
    
 if __name__ == '__main__':
@@ -58,6 +58,89 @@ def find_peaks(v, delta, x = None):
 
   return np.asarray(maxid, dtype = int), np.asarray(maxvalue, dtype = v.dtype);
 
+
+def find_peaks_mask(v, delta, min_batch = 48):
+  """Vectorized peak detection by Scott and Andrews for many signals at once
+  
+  Arguments:
+    v (...xn array): signals, peaks are detected along the last axis
+    delta (float): minimal drop after a maximum for it to count as a peak
+    min_batch (int): use :func:`find_peaks` on each signal for fewer signals than this
+  
+  Returns:
+    ...xn array of bools: True at the positions of the peaks
+  
+  Note:
+    The result is identical to :func:`find_peaks` applied to each signal.
+    The state of the search is updated for all signals in each step so the
+    number of python steps is the number of samples, not samples x signals.
+  """
+  v = np.asarray(v, dtype = float);
+  if delta <= 0:
+    raise ValueError('delta must be positive, found %r' % delta);
+  
+  shape = v.shape;
+  n = shape[-1];
+  v = v.reshape(-1, n);
+  nsignals = v.shape[0];
+  peaks = np.zeros(v.shape, dtype = bool);
+  
+  if nsignals < min_batch:
+    for s in range(nsignals):
+      peaks[s, find_peaks(v[s], delta)[0]] = True;
+    return peaks.reshape(shape);
+  
+  mx = np.full(nsignals, -np.inf);
+  mn = np.full(nsignals,  np.inf);
+  mxpos = np.zeros(nsignals, dtype = int);
+  lookformax = np.ones(nsignals, dtype = bool);
+  
+  for i in range(n):
+    this = v[:,i];
+    
+    up = this > mx;
+    mx[up] = this[up];
+    mxpos[up] = i;
+    down = this < mn;
+    mn[down] = this[down];
+    
+    drop = np.where(np.logical_and(lookformax, this < mx - delta))[0];
+    rise = np.where(np.logical_and(np.logical_not(lookformax), this > mn + delta))[0];
+    
+    peaks[drop, mxpos[drop]] = True;
+    mn[drop] = this[drop];
+    lookformax[drop] = False;
+    
+    mx[rise] = this[rise];
+    mxpos[rise] = i;
+    lookformax[rise] = True;
+  
+  return peaks.reshape(shape);
+
+
+def find_peaks_circular(v, delta, nextra = 20):
+  """Vectorized peak detection in periodic signals
+  
+  Arguments:
+    v (...xn array): periodic signals, peaks are detected along the last axis
+    delta (float): minimal drop after a maximum for it to count as a peak
+    nextra (int): number of samples the signal is extended periodically on both sides
+  
+  Returns:
+    ...xn array of bools: True at the positions of the peaks
+  
+  Note:
+    Same result as padding the signal with nextra samples from both ends,
+    running :func:`find_peaks` and keeping the peaks within the original signal.
+  """
+  v = np.asarray(v, dtype = float);
+  n = v.shape[-1];
+  nextra = min(nextra, n);
+  if nextra > 0:
+    v = np.concatenate([v[...,n-nextra:], v, v[...,:nextra]], axis = -1);
+  return find_peaks_mask(v, delta)[...,nextra:nextra+n];
+
+
 if __name__=="__main__":
     import matplotlib.pyplot as plt
     import signalprocessing.peak_detection as pd;
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Smoothing Module
+
+Quadratic smoothing of time series via banded linear solvers
+
+Note:
+  The smoothed series x minimizes
+
+    sum_t w_t |x_t - v_t|^2 + s sum_t |(D^k x)_t|^2
+
+  for each column of the values v where D^k is the k-th order finite difference.
+  The normal equations are banded with k sub- and superdiagonals and are solved 
+  for all columns at once in O(T) with :func:`scipy.linalg.solve_banded`.
+  First order smoothing penalizes velocities, second order smoothing penalizes
+  accelerations and leaves uniform motion unchanged.
+"""
+
+__license__ = 'MIT License <http://www.opensource.org/licenses/mit-license.php>'
+__author__ = 'Christoph Kirst <ckirst@rockefeller.edu>'
+__docformat__ = 'rest'
+
+
+import numpy as np
+from scipy.linalg import solve_banded
+from scipy.special import comb
+
+
+def difference_coefficients(order = 1):
+  """Coefficients of the finite difference of given order as used by :func:`numpy.diff`"""
+  return np.array([(-1)**(order - i) * comb(order, i, exact = True) for i in range(order + 1)], dtype = float);
+
+
+def smoothing_matrix(npoints, smoothness = 1.0, weights = None, order = 1):
+  """Banded matrix of the normal equations of the quadratic smoothing
+
+  Arguments:
+    npoints (int): number of time points
+    smoothness (float): weight of the squared differences
+    weights (array or None): weights of the data terms, if None all weights are 1
+    order (int): order of the finite differences
+
+  Returns:
+    (2*order+1)xnpoints array: the matrix in the banded format of :func:`scipy.linalg.solve_banded`
+  """
+  if weights is None:
+    weights = np.ones(npoints);
+  weights = np.asarray(weights, dtype = float);
+
+  ab = np.zeros((2 * order + 1, npoints));
+  ab[order] = weights;
+  c = difference_coefficients(order);
+  m = npoints - order;
+  if m > 0:
+    for i in range(order + 1):
+      for j in range(order + 1):
+        ab[order + i - j, j:j+m] += smoothness * c[i] * c[j];
+  return ab;
+
+
+def difference_penalty(values, order = 1):
+  """Product of the values with the matrix D^T D of the squared finite differences along the first axis
+
+  Arguments:
+    values (Tx... array): values at the time points
+    order (int): order of the finite differences
+
+  Returns:
+    Tx... array: the gradient of 1/2 sum_t |(D^k x)_t|^2 at the values
+  """
+  values = np.asarray(values, dtype = float);
+  d = np.diff(values, n = order, axis = 0);
+  c = difference_coefficients(order);
+  m = d.shape[0];
+  penalty = np.zeros_like(values);
+  for i in range(order + 1):
+    penalty[i:i+m] += c[i] * d;
+  return penalty;
+
+
+def smooth_banded(values, smoothness = 1.0, weights = None, order = 1):
+  """Quadratic smoothing of time series along the first axis
+
+  Arguments:
+    values (Tx... array): values at the time points
+    smoothness (float): weight of the squared finite differences
+    weights (T array or None): weights of the data terms, e.g. confidences, if None all weights are 1
+    order (int): order of the finite differences
+
+  Returns:
+    Tx... array: smoothed values
+  """
+  values = np.asarray(values, dtype = float);
+  npoints = values.shape[0];
+  if npoints <= order or smoothness <= 0:
+    return values.copy();
+
+  if weights is None:
+    rhs = values;
+  else:
+    rhs = np.reshape(weights, (-1,) + (1,) * (values.ndim - 1)) * values;
+
+  ab = smoothing_matrix(npoints, smoothness = smoothness, weights = weights, order = order);
+  x = solve_banded((order, order), ab, np.reshape(rhs, (npoints, -1)));
+  return np.reshape(x, values.shape);
+
+
+
+def test():
+  import numpy as np
+  import matplotlib.pyplot as plt
+  import signalprocessing.smoothing as sm
+
+  t = np.linspace(0, 10, 200);
+  v = np.stack([np.sin(t), np.cos(t)], axis = 1) + 0.2 * np.random.randn(200, 2);
+  x1 = sm.smooth_banded(v, smoothness = 20);
+  x2 = sm.smooth_banded(v, smoothness = 200, order = 2);
+
+  # compare to dense solution
+  d = np.diff(np.eye(200), n = 2, axis = 0);
+  a = np.eye(200) + 200 * d.T.dot(d);
+  print('deviation to dense solve: %r' % np.max(np.abs(np.linalg.solve(a, v) - x2)));
+  print('deviation of penalty: %r' % np.max(np.abs(d.T.dot(d).dot(v) - sm.difference_penalty(v, order = 2))));
+
+  plt.figure(1); plt.clf();
+  plt.plot(t, v, '.');
+  plt.plot(t, x1);
+  plt.plot(t, x2);
+
+
+if __name__ == "__main__":
+  test();
@@ -71,13 +71,9 @@ print ds.shape
 
 #%% calculate
 import worm.geometry as wgeo
+import worm.shapes as wsh
 
-data_theta = np.zeros((len(ds), data_shape.shape[-1]-2));
-for i in range(len(ds)):
-  if i%100==0:
-    print('%d/%d' % (i,len(ds)));
-  theta,a,b,c = wgeo.theta_from_center_discrete(ds[i].T);
-  data_theta[i,:] = theta;
+data_theta, data_orientation, data_xy, data_length = wsh.theta_from_shapes(data_shape, frames = fids);
 
 #%%
 
@@ -0,0 +1,132 @@
+"""
+Module Frames
+
+Utility routines to select frames for (re)processing
+
+Example:
+
+  >>>import utils.frames as frm
+  >>>frames = frm.select_frames(n_frames, status = shape_info['success'], failed = True)
+  >>>batches = frm.frame_batches(frames, batch_size = 1000)
+"""
+
+__author__  = 'Christoph Kirst <ckirst@rockefeller.edu>'
+__license__ = 'MIT License <http://www.opensource.org/licenses/mit-license.php>'
+__docformat__ = 'rest'
+
+
+import os
+import numpy as np
+
+from utils.range import is_list_like
+
+
+def load_frame_index(filename):
+  """Loads frame indices from a file
+
+  Arguments:
+    filename (str): npy file with frame ids or bools or text file with one frame id per line
+
+  Returns:
+    array: frame ids
+  """
+  if os.path.splitext(filename)[1] == '.npy':
+    index = np.load(filename);
+  else:
+    index = np.loadtxt(filename, dtype = int, ndmin = 1);
+
+  index = np.asarray(index);
+  if index.dtype == bool:
+    index = np.where(index)[0];
+  return np.asarray(index, dtype = int);
+
+
+def select_frames(n_frames, status = None, codes = all, failed = False, ranges = all, index = None, predicate = None):
+  """Selects frames for (re)processing
+
+  Arguments:
+    n_frames (int): total number of frames
+    status (array or None): status code of each frame, e.g. the 'success' column of a shapes info file
+    codes (list or all): only select frames with these status codes
+    failed (bool): only select frames with negative status
+    ranges (tuple, list of tuples or all): only select frames in these ranges (start, end)
+    index (array, str or None): only select frames in this index array or file (see :func:`load_frame_index`)
+    predicate (function or None): only select frames for which predicate(frame_ids) is True
+
+  Returns:
+    array: sorted ids of the selected frames
+
+  Note:
+    All specified criteria need to be fullfilled for a frame to be selected.
+  """
+  select = np.ones(n_frames, dtype = bool);
+
+  if status is not None:
+    status = np.asarray(status);
+    if codes is not all:
+      select &= np.isin(status, codes);
+    if failed:
+      select &= status < 0;
+
+  if ranges is not all:
+    if len(ranges) > 0 and not is_list_like(ranges[0]):
+      ranges = [ranges];
+    in_range = np.zeros(n_frames, dtype = bool);
+    for r in ranges:
+      in_range[r[0]:r[1]] = True;
+    select &= in_range;
+
+  if index is not None:
+    if isinstance(index, str):
+      index = load_frame_index(index);
+    in_index = np.zeros(n_frames, dtype = bool);
+    in_index[np.asarray(index, dtype = int)] = True;
+    select &= in_index;
+
+  frames = np.where(select)[0];
+
+  if predicate is not None and len(frames) > 0:
+    frames = frames[np.asarray(predicate(frames), dtype = bool)];
+
+  return frames;
+
+
+def frame_batches(frames, batch_size = 1000, max_gap = all):
+  """Splits selected frames into batches of nearby frames
+
+  Arguments:
+    frames (array): sorted frame ids
+    batch_size (int): maximal number of frames per batch
+    max_gap (int or all): split batches if frames are further apart than this
+
+  Returns:
+    list of arrays: frame ids in each batch
+
+  Note:
+    Each batch spans the range frames[0]:frames[-1]+1 which can be opened as
+    a memmap slice for in place updates in parallel processes.
+  """
+  frames = np.asarray(frames, dtype = int);
+  if len(frames) == 0:
+    return [];
+
+  splits = np.arange(batch_size, len(frames), batch_size);
+  if max_gap is not all:
+    splits = np.union1d(splits, np.where(np.diff(frames) > max_gap)[0] + 1);
+
+  return np.split(frames, splits);
+
+
+def test():
+  import numpy as np
+  import utils.frames as frm
+
+  status = np.array([1, -1, 201, -10001, 201, 1612, -1, 201]);
+  print(frm.select_frames(len(status), status = status, failed = True))
+  print(frm.select_frames(len(status), status = status, codes = [201, 1612], ranges = (2,6)))
+  print(frm.select_frames(len(status), index = [0, 3, 7], predicate = lambda f: f > 0))
+  print(frm.frame_batches(np.array([1,2,3,50,51,100]), batch_size = 2, max_gap = 10))
+
+
+if __name__ == "__main__":
+  test();
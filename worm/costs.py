@@ -5,9 +5,19 @@ Created on Sun Oct 23 17:30:48 2016
 @author: ckirst
 """
 import numpy as np
+import scipy.ndimage as nd
+import cv2
+from skimage.filters import threshold_otsu
 
 from interpolation.resampling import resample
 from interpolation.curve import Curve;
+from interpolation.projection import project_points_to_polyline
+
+from imageprocessing.masking import mask_to_phi_band, mask_from_polygon
+
+from scipy.linalg import solve_banded
+from scipy.optimize import minimize
+from signalprocessing.smoothing import smooth_banded, smoothing_matrix, difference_penalty
 
 import worm.geometry as wgeo
 
@@ -18,7 +28,7 @@ import worm.geometry as wgeo
 import scipy.spatial.distance as spd
 
 def cost_from_skeleton(model, skeleton, soft_max = 2.0):
-  c = model.center;
+  c = model_center(model);
   dist = spd.cdist(c, skeleton);
   edist = np.exp(-soft_max * dist);
   return np.sum(edist / np.sum(edist, axis =1)[:,None] * dist, axis = 1)
@@ -55,7 +65,7 @@ def cost_from_distance(res, weight_shape = 0.1, weight_head_tail = 0.9):
 
 def cost_from_countour(model, contour, head_tail_xy = None, verbose = False, weight_head_tail = 0.9, weight_shape = 0.1):
   if head_tail_xy is None:
-    head_tail_xy = wgeo.head_tail_from_contour_discrete(contour, ncontour = all, delta = 0.3, smooth = 1.0, with_index = False, verbose = False, save = None);
+    head_tail_xy = wgeo.head_tail_from_contour_discrete(contour, delta = 0.3, with_index = False);
   
   left,right,normals = model.shape(with_normals=True);   
   res = wgeo.distance_shape_to_contour_discrete(left,right,normals,contour,
@@ -95,7 +105,7 @@ def cost_func(model, parameter, skeleton, weight_distances = 1.0):
   cost = np.sum(cost);
   
   # ensure optimal distances
-  d = np.diff(model.center, axis = 0);
+  d = np.diff(model_center(model), axis = 0);
   d = np.sqrt(np.sum(d*d, axis = 1));
   l0 = model.length / len(d);
   d -= l0;
@@ -104,6 +114,36 @@ def cost_func(model, parameter, skeleton, weight_distances = 1.0):
 
 
 
+def cost_func_batch(center, length, skeleton, weight_distances = 1.0, soft_max = 2.0):
+  """Cost function :func:`cost_func` for many center lines at once
+  
+  Arguments:
+    center (Bxnx2 array): center lines
+    length (B array or float): lengths of the worms
+    skeleton (mx2 or Bxmx2 array): skeleton points
+    weight_distances (float): weight of the spacing cost
+    soft_max (float): soft max factor for the skeleton cost
+  
+  Returns:
+    B array: costs
+  """
+  center = np.asarray(center, dtype = float);
+  skeleton = np.asarray(skeleton, dtype = float);
+  if skeleton.ndim == 2:
+    skeleton = skeleton[np.newaxis];
+  
+  dist = np.linalg.norm(center[:,:,np.newaxis,:] - skeleton[:,np.newaxis,:,:], axis = 3);
+  edist = np.exp(-soft_max * dist);
+  cost = np.sum(np.sum(edist * dist, axis = 2) / np.sum(edist, axis = 2), axis = 1);
+  
+  # ensure optimal distances
+  d = np.linalg.norm(np.diff(center, axis = 1), axis = 2);
+  l0 = np.reshape(length, (-1,1)) / d.shape[1];
+  d -= l0;
+  cost += weight_distances * np.sum(d*d, axis = 1) / d.shape[1];
+  return cost;
+
+
 
 #def cost_func_grad(model, parameter, contour, head_tail_xy = None, epsilon = 0.1, verbose = False,  weight_distances = 0.1, weight_head_tail = 0.9, weight_shape = 0.1):
 #  """Numerical approximation of the gradient of the cost function"""
@@ -122,12 +162,32 @@ def cost_func(model, parameter, skeleton, weight_distances = 1.0):
 #  return grad;
 #                                                                
    
-def cost_func_grad(model, parameter, skeleton, epsilon, weight_distances = 1.0, verbose = True):
-  """Numerical approximation of the gradient of the cost function"""
+def cost_func_grad(model, parameter, skeleton, epsilon = 0.1, weight_distances = 1.0, verbose = True, analytic = True):
+  """Gradient of the cost function
+  
+  Arguments:
+    model (WormModel): the worm model
+    parameter (array): parameter at which to evaluate the gradient
+    skeleton (nx2 array): skeleton points
+    epsilon (float or array): step sizes for the finite difference approximation
+    weight_distances (float): weight of the spacing cost
+    verbose (bool): print the cost
+    analytic (bool): if True use the analytic gradient, otherwise finite differences
+  
+  Returns:
+    array: gradient of the cost with respect to the parameter
+  """
+  if analytic:
+    model.set_parameter(parameter);
+    c0, grad_center, grad_length = cost_func_center_grad(model, skeleton, weight_distances = weight_distances);
+    if verbose:
+      print('costs at 0: %f' % c0);
+    return parameter_gradient(model, grad_center, grad_length = grad_length, full = len(parameter) > model.nparameter);
+  
   nparameter = parameter.shape[0];
   c0 = cost_func(model, parameter, skeleton, weight_distances = weight_distances);
   if verbose:
-    print 'costs at 0: %f' % c0;
+    print('costs at 0: %f' % c0);
   epsilon = np.array(epsilon);
   grad = np.zeros(nparameter);
   if epsilon.ndim == 0:
@@ -137,5 +197,938 @@ def cost_func_grad(model, parameter, skeleton, epsilon, weight_distances = 1.0,
     cs = cost_func(model, p, skeleton, weight_distances = weight_distances);
     grad[i] = (cs - c0) / epsilon[i];
   return grad;
-                          
-   
+
+
+
+### Analytic gradients
+
+# gradients are first calculated with respect to the center line, width and
+# side lines and then chained to the parameterization of the model
+
+def model_center(model):
+  """Center line of a model parameterized by its center or by theta"""
+  if callable(model.center):
+    return model.center();
+  else:
+    return model.center;
+
+
+def cost_from_skeleton_grad(model, skeleton, soft_max = 2.0):
+  """Skeleton cost and its gradient with respect to the center points
+  
+  Arguments:
+    model (WormModel): the worm model
+    skeleton (mx2 array): skeleton points
+    soft_max (float): soft max factor
+    
+  Returns:
+    n array: cost for each center point (see :func:`cost_from_skeleton`)
+    nx2 array: gradient of the total cost with respect to the center points
+  """
+  c = model_center(model);
+  delta = c[:,np.newaxis,:] - skeleton[np.newaxis,:,:];
+  dist = np.linalg.norm(delta, axis = 2);
+  edist = np.exp(-soft_max * dist);
+  w = edist / np.sum(edist, axis = 1)[:,None];
+  cost = np.sum(w * dist, axis = 1);
+  
+  # d cost_i / d dist_ij for the soft max weighted distance
+  dcost = w * (1 - soft_max * (dist - cost[:,None]));
+  dist[dist == 0] = np.inf;
+  grad = np.sum((dcost / dist)[:,:,np.newaxis] * delta, axis = 1);
+  return cost, grad
+
+
+def cost_from_spacing_grad(center, length, weight_distances = 1.0):
+  """Cost for deviations from equal spacing of the center points and its gradient
+  
+  Arguments:
+    center (nx2 array): center line
+    length (float): length of the center line
+    weight_distances (float): weight of the spacing cost
+  
+  Returns:
+    float: the spacing cost
+    nx2 array: gradient with respect to the center points
+    float: gradient with respect to the length
+  """
+  d = np.diff(center, axis = 0);
+  n = np.linalg.norm(d, axis = 1);
+  ns = len(n);
+  l0 = float(length) / ns;
+  r = n - l0;
+  cost = weight_distances * np.sum(r*r) / ns;
+  
+  n[n == 0] = np.inf;
+  gd = (2.0 * weight_distances / ns * r / n)[:,np.newaxis] * d;
+  grad = np.zeros(center.shape);
+  grad[1:] += gd;
+  grad[:-1] -= gd;
+  grad_length = - 2.0 * weight_distances / ns**2 * np.sum(r);
+  return cost, grad, grad_length
+
+
+def cost_func_center_grad(model, skeleton, weight_distances = 1.0):
+  """Analytic gradient of :func:`cost_func` with respect to the center points
+  
+  Returns:
+    float: the cost
+    nx2 array: gradient with respect to the center points
+    float: gradient with respect to the length
+  """
+  c, gc = cost_from_skeleton_grad(model, skeleton);
+  cs, gs, gl = cost_from_spacing_grad(model_center(model), model.length, weight_distances = weight_distances);
+  return np.sum(c) + cs, gc + gs, gl
+
+
+def shape_gradient_to_center(center, width, normals, grad_left, grad_right, grad_angle = None):
+  """Chains gradients with respect to the side lines to center and width
+  
+  Arguments:
+    center (nx2 array): center line
+    width (n array): width profile
+    normals (nx2 array): normals along the center line
+    grad_left, grad_right (nx2 array): gradients with respect to the left and right side points
+    grad_angle (n array or None): additional gradient with respect to the angle of the normals
+  
+  Returns:
+    nx2 array: gradient with respect to the center points
+    n array: gradient with respect to the width
+    
+  Note:
+    The sides are left/right = center +/- 0.5 * width * normals, where the
+    normal angle is the angle of the incoming segment at the tail, of the outgoing 
+    segment at the head and the mean of both in between, see
+    :func:`worm.geometry.normals_from_center_discrete`.
+  """
+  tangents = np.vstack([-normals[:,1], normals[:,0]]).T;
+  
+  gdiff = grad_left - grad_right;
+  grad_center = grad_left + grad_right;
+  grad_width = 0.5 * np.sum(gdiff * normals, axis = 1);
+  ga = 0.5 * width * np.sum(gdiff * tangents, axis = 1);
+  if grad_angle is not None:
+    ga = ga + grad_angle;
+  
+  # angles of the segments
+  gphi = 0.5 * (ga[:-1] + ga[1:]);
+  gphi[0] += 0.5 * ga[0];
+  gphi[-1] += 0.5 * ga[-1];
+  
+  d = np.diff(center, axis = 0);
+  d2 = np.sum(d * d, axis = 1);
+  d2[d2 == 0] = np.inf;
+  gd = (gphi / d2)[:,np.newaxis] * np.vstack([-d[:,1], d[:,0]]).T;
+  grad_center[1:] += gd;
+  grad_center[:-1] -= gd;
+  
+  return grad_center, grad_width
+
+
+def center_gradient_to_theta(grad_center, center, length):
+  """Chains a gradient with respect to the center points to the theta parameterization
+  
+  Arguments:
+    grad_center (nx2 array): gradient with respect to the center points
+    center (nx2 array): center line obtained from :func:`worm.geometry.center_from_theta_discrete`
+    length (float): length of the center line
+    
+  Returns:
+    n-2 array: gradient with respect to theta
+    float: gradient with respect to the orientation
+    2 array: gradient with respect to the position xy
+    float: gradient with respect to the length
+  """
+  n = center.shape[0];
+  n2 = (n-1)//2;
+  delta = 1.0 / (n-1);
+  
+  grad_xy = np.sum(grad_center, axis = 0);
+  g = grad_center.copy();
+  g[n2] -= grad_xy;
+  
+  # segment m moves all points j > m
+  s = np.cumsum(g[::-1], axis = 0)[::-1][1:];
+  d = np.diff(center, axis = 0);
+  gpsi = s[:,1] * d[:,0] - s[:,0] * d[:,1];
+  grad_length = np.sum(s * d) / float(length);
+  grad_orientation = np.sum(gpsi);
+  
+  grad_theta = np.cumsum(gpsi[::-1])[::-1][1:];
+  grad_theta[:n2] -= grad_orientation;
+  grad_theta *= delta;
+  
+  return grad_theta, grad_orientation, grad_xy, grad_length
+
+
+def parameter_gradient(model, grad_center, grad_width = None, grad_length = 0.0, full = False):
+  """Chains gradients with respect to center line and width to the model parameter
+  
+  Arguments:
+    model (WormModel): center, theta or spline based worm model
+    grad_center (nx2 array): gradient with respect to the center points
+    grad_width (n array or None): gradient with respect to the width
+    grad_length (float): direct gradient with respect to the length
+    full (bool): if True return gradient for the full parameter set
+  
+  Returns:
+    array: gradient with respect to the parameter as returned by model.get_parameter(full = full)
+  """
+  if grad_width is None:
+    grad_width = np.zeros(grad_center.shape[0]);
+  
+  if not callable(model.center): # center parameterization
+    grad = grad_center.flatten();
+    if full:
+      grad = np.hstack([grad, grad_length, 0, grad_width]);
+    return grad;
+  
+  center = model.center();
+  gt, go, gxy, gl = center_gradient_to_theta(grad_center, center, model.length);
+  if hasattr(model.theta, 'projection'): # spline parameterization
+    gt = model.theta.projection.T.dot(gt);
+    if full:
+      grad_width = model.width.projection.T.dot(grad_width);
+  grad = np.hstack([gt, go, gxy, 0]);
+  if full:
+    grad = np.hstack([grad, gl + grad_length, grad_width]);
+  return grad;
+
+
+def cost_from_distance_grad(res, left, right, normals, contour, weight_shape = 0.1, weight_head_tail = 0.9, match_head_tail = None, min_cos = 0.1):
+  """Gradient of :func:`cost_from_distance` with respect to the shape
+  
+  Arguments:
+    res (tuple): result of :func:`worm.geometry.distance_shape_to_contour_discrete`
+    left, right (nx2 array): side lines of the shape
+    normals (nx2 array): normals along the center line
+    contour (Curve or mx2 array): the contour
+    weight_shape, weight_head_tail (float): weights as in :func:`cost_from_distance`
+    match_head_tail (kx2 array or None): head tail candidates used for the distances
+    min_cos (float): minimal cosine between search line and contour normal, for
+                     more grazing intersections the contour is treated as perpendicular
+  
+  Returns:
+    nx2 array: gradient with respect to the left side points
+    nx2 array: gradient with respect to the right side points
+    n array: gradient with respect to the angle of the normals
+  
+  Note:
+    A distance d is measured along the normal line of a side point p to its
+    intersection with the contour segment with normal m. Moving p or rotating 
+    the normal slides the intersection along the contour segment which gives 
+    dd/dp = - m / (m.u) and dd/dv = - d m / (m.v) with u the unit vector from p 
+    to the intersection and v the direction of the search line.
+  """
+  if match_head_tail is not None:
+    dl, xy_l, dr, xy_r, dh, hm, dt, tm = res;
+    offset = 1;
+  else:
+    dl, xy_l, dr, xy_r = res[:4];
+    dh = dt = hm = tm = None;
+    offset = 0;
+  
+  if isinstance(contour, Curve):
+    points = contour.get_points(error = 'cannot determine sample points needed for the gradient');
+    contour = contour(points);
+  
+  n = left.shape[0];
+  grad_left = np.zeros((n,2));
+  grad_right = np.zeros((n,2));
+  grad_angle = np.zeros(n);
+  tangents = np.vstack([-normals[:,1], normals[:,0]]).T;
+  
+  for d, xy, pts, gp, sign in [(dl, xy_l, left, grad_left, 1), (dr, xy_r, right, grad_right, -1)]:
+    good = np.where(np.logical_not(np.isnan(d)))[0];
+    if len(good) == 0:
+      continue;
+    ids = good + offset;
+    w = weight_shape / len(good);
+    
+    # contour normals at intersections
+    xyg = xy[good];
+    s, t = project_points_to_polyline(xyg, contour, with_segment = True)[1:];
+    e = contour[s+1] - contour[s];
+    m = np.vstack([-e[:,1], e[:,0]]).T;
+    m /= np.linalg.norm(m, axis = 1)[:,np.newaxis];
+    
+    dd = d[good];
+    u = xyg - pts[ids];
+    u /= np.maximum(dd, 1e-12)[:,np.newaxis];
+    v = sign * normals[ids];
+    mu = np.sum(m * u, axis = 1);
+    mv = np.sum(m * v, axis = 1);
+    
+    graze = np.abs(mu) < min_cos;
+    mu[graze] = 1; mv[graze] = 1;
+    m[graze] = u[graze];
+    
+    gp[ids] += - w * m / mu[:,np.newaxis];
+    gv = - w * (dd / mv)[:,np.newaxis] * m;
+    gv[graze] = 0;
+    grad_angle[ids] += sign * np.sum(gv * tangents[ids], axis = 1);
+  
+  nht = 2;
+  if dh is None:
+    nht -= 1;
+  if dt is None:
+    nht -= 1;
+  if nht > 0:
+    for d, mid, i in [(dh, hm, 0), (dt, tm, -1)]:
+      if d is None or mid is None:
+        continue;
+      dv = left[i] - match_head_tail[mid];
+      dn = np.linalg.norm(dv);
+      if dn > 0:
+        grad_left[i] += weight_head_tail / nht * dv / dn;
+  
+  return grad_left, grad_right, grad_angle
+
+
+def cost_from_countour_grad(model, contour, head_tail_xy = None, verbose = False, weight_head_tail = 0.9, weight_shape = 0.1, full = False):
+  """Contour cost and its analytic gradient with respect to the model parameter
+  
+  Arguments:
+    model (WormModel): the worm model
+    contour (Curve): the contour
+    head_tail_xy (kx2 array or None): head tail candidates, if None detect from contour
+    full (bool): if True return gradient for the full parameter set
+    
+  Returns:
+    float: the cost as in :func:`cost_from_countour`
+    array: gradient of the cost with respect to the model parameter
+  """
+  if head_tail_xy is None:
+    head_tail_xy = wgeo.head_tail_from_contour_discrete(contour, delta = 0.3, with_index = False);
+  
+  left, right, center, normals, width = model.shape(with_center = True, with_normals = True, with_width = True);
+  if not isinstance(width, np.ndarray):
+    width = width.values;
+  res = wgeo.distance_shape_to_contour_discrete(left,right,normals,contour,
+                                           search_radius=[15,20], min_alignment=0, match_head_tail=head_tail_xy,
+                                           verbose = verbose);
+  cost = cost_from_distance(res, weight_head_tail = weight_head_tail, weight_shape = weight_shape);
+  
+  gl, gr, ga = cost_from_distance_grad(res, left, right, normals, contour, match_head_tail = head_tail_xy,
+                                       weight_head_tail = weight_head_tail, weight_shape = weight_shape);
+  gc, gw = shape_gradient_to_center(center, width, normals, gl, gr, grad_angle = ga);
+  return cost, parameter_gradient(model, gc, grad_width = gw, full = full);
+
+
+def cost_from_image_grad(model, image, nsamples = 100, nparameter = 50, full = False):
+  """Image cost and its analytic gradient with respect to the model parameter
+  
+  Note:
+    The contour is extracted from the image once, the gradient is the one of 
+    :func:`cost_from_countour_grad` for this contour.
+  """
+  cntrs = wgeo.contours_from_image(image, sigma = 1, absolute_threshold = None, threshold_factor = 0.9, 
+                             verbose = False, save = None);
+  contour = Curve(resample(cntrs[0], nsamples), nparameter = nparameter);
+  return cost_from_countour_grad(model, contour, full = full);
+
+
+def cost_func_contour(model, parameter, contour, head_tail_xy = None, weight_head_tail = 0.9, weight_shape = 0.1):
+  """Contour cost function :func:`cost_from_countour` at the given parameter"""
+  model.set_parameter(parameter);
+  return cost_from_countour(model, contour, head_tail_xy = head_tail_xy, weight_head_tail = weight_head_tail, weight_shape = weight_shape);
+
+
+def cost_func_contour_grad(model, parameter, contour, head_tail_xy = None, weight_head_tail = 0.9, weight_shape = 0.1, 
+                           epsilon = 0.1, analytic = True):
+  """Gradient of the contour cost function :func:`cost_func_contour`
+  
+  Arguments:
+    model (WormModel): the worm model
+    parameter (array): parameter at which to evaluate the gradient
+    contour (Curve): the contour
+    head_tail_xy (kx2 array or None): head tail candidates, if None detect from contour
+    weight_head_tail, weight_shape (float): weights as in :func:`cost_from_countour`
+    epsilon (float or array): step sizes for the finite difference approximation
+    analytic (bool): if True use the analytic gradient, otherwise finite differences
+  
+  Returns:
+    array: gradient of the cost with respect to the parameter
+  """
+  if head_tail_xy is None:
+    head_tail_xy = wgeo.head_tail_from_contour_discrete(contour, delta = 0.3, with_index = False);
+  
+  if analytic:
+    model.set_parameter(parameter);
+    return cost_from_countour_grad(model, contour, head_tail_xy = head_tail_xy, weight_head_tail = weight_head_tail, weight_shape = weight_shape, 
+                                   full = len(parameter) > model.nparameter)[1];
+  
+  nparameter = parameter.shape[0];
+  c0 = cost_func_contour(model, parameter, contour, head_tail_xy = head_tail_xy, weight_head_tail = weight_head_tail, weight_shape = weight_shape);
+  epsilon = np.array(epsilon);
+  grad = np.zeros(nparameter);
+  if epsilon.ndim == 0:
+    epsilon = np.ones(nparameter) * epsilon;
+  for i in range(nparameter):
+    p = parameter.copy(); p[i] += epsilon[i];
+    cs = cost_func_contour(model, p, contour, head_tail_xy = head_tail_xy, weight_head_tail = weight_head_tail, weight_shape = weight_shape);
+    grad[i] = (cs - c0) / epsilon[i];
+  return grad;
+
+
+def fit_contour(model, contour, head_tail_xy = None, full = False, iterations = 100, analytic = True,
+                weight_head_tail = 0.9, weight_shape = 0.1, verbose = False):
+  """Fits the worm model to a contour by minimizing :func:`cost_from_countour`
+  
+  Arguments:
+    model (WormModel): the worm model, set to the fitted parameter
+    contour (Curve): the contour
+    head_tail_xy (kx2 array or None): head tail candidates, if None detect from contour
+    full (bool): if True also fit length and width
+    iterations (int): maximal number of iterations
+    analytic (bool): if True use the analytic gradient, otherwise finite differences
+    weight_head_tail, weight_shape (float): weights as in :func:`cost_from_countour`
+    verbose (bool): print the final cost
+  
+  Returns:
+    float: the cost of the fitted model
+  
+  Note:
+    The head tail candidates are detected only once. The cost is minimized 
+    with L-BFGS-B using the gradient of :func:`cost_func_contour_grad`.
+  """
+  if head_tail_xy is None:
+    head_tail_xy = wgeo.head_tail_from_contour_discrete(contour, delta = 0.3, with_index = False);
+  
+  weights = dict(head_tail_xy = head_tail_xy, weight_head_tail = weight_head_tail, weight_shape = weight_shape);
+  cost = lambda p: cost_func_contour(model, p, contour, **weights);
+  grad = lambda p: cost_func_contour_grad(model, p, contour, analytic = analytic, **weights);
+  
+  res = minimize(cost, model.get_parameter(full = full), jac = grad, method = 'L-BFGS-B', options = dict(maxiter = iterations));
+  model.set_parameter(res.x);
+  if verbose:
+    print('contour fit: cost %f after %d iterations' % (res.fun, res.nit));
+  return res.fun;
+
+
+
+### Multi-scale image costs
+
+# image pyramids are computed once per frame and shared by all fits to it
+
+_pyramid_cache = {};
+_pyramid_cache_size = 256;
+
+def clear_pyramid_cache():
+  """Clears the process wide cache of image pyramids"""
+  _pyramid_cache.clear();
+
+
+def image_pyramid(image, scales = (4,2,1), sigma = 1, absolute_threshold = None, threshold_factor = 0.95, frame = None):
+  """Contour representations of the thresholded worm image at several resolutions
+  
+  Arguments:
+    image (array): full resolution image
+    scales (tuple): downsampling factors of the levels, (4,2,1) gives 38x38, 76x76 and 151x151 levels for a 151x151 image
+    sigma (float or None): width of Gaussian smoothing on image, if None use raw image
+    absolute_threshold (float or None): if set use this as the threshold, if None the threshold is set via Otsu
+    threshold_factor (float): in case the threshold is determined by Otsu multiply by this factor
+    frame (hashable or None): if not None cache the pyramid under this frame id
+  
+  Returns:
+    list of tuples (factor, phi, offset): coordinate scale factors (x,y), contour representations
+                                          of the foreground in full resolution pixel units and 
+                                          cost offsets, see :func:`cost_from_phi_batch`
+  
+  Note:
+    The threshold is determined once at full resolution and applied to the area
+    averaged smoothed image at each level. The pixel centers of a level are at 
+    (xy + 0.5) / factor - 0.5 in full resolution coordinates xy.
+    
+    Cached pyramids are identified by frame id, image shape and the arguments, 
+    so frame ids need to be unique across the images fitted in a process.
+  """
+  image = np.asarray(image);
+  if frame is not None:
+    key = (frame, image.shape, tuple(scales), sigma, absolute_threshold, threshold_factor);
+    pyramid = _pyramid_cache.get(key);
+    if pyramid is not None:
+      return pyramid;
+  
+  if sigma is not None:
+    imgs = nd.gaussian_filter(np.asarray(image, dtype = float), sigma);
+  else:
+    imgs = np.asarray(image, dtype = float);
+  
+  if absolute_threshold is not None:
+    level = absolute_threshold;
+  else:
+    level = threshold_factor * threshold_otsu(imgs);
+  
+  h, w = imgs.shape;
+  pyramid = [];
+  for s in scales:
+    size = (max(int(round(w / float(s))), 1), max(int(round(h / float(s))), 1));
+    if size == (w, h):
+      imgl = imgs;
+    else:
+      imgl = cv2.resize(imgs, size, interpolation = cv2.INTER_AREA);
+    factor = np.array([w / float(size[0]), h / float(size[1])]);
+    phi = mask_to_phi_band(imgl >= level, band = all) * np.mean(factor);
+    phi.setflags(write = False);
+    offset = -np.sum(phi[phi < 0]);
+    pyramid.append((factor, phi, offset));
+  
+  if frame is not None:
+    if len(_pyramid_cache) >= _pyramid_cache_size:
+      _pyramid_cache.clear();
+    _pyramid_cache[key] = pyramid;
+  return pyramid;
+
+
+def cost_from_phi_batch(center, width, phi, factor = 1.0, offset = 0.0):
+  """Region cost of many worm shapes with respect to the contour representation of an image
+  
+  Arguments:
+    center (Bxnx2 array): center lines in full resolution coordinates
+    width (Bxn or n array): width profiles in full resolution pixel
+    phi (hxw array): contour representation of the image at this level, negative inside the worm
+    factor (float or 2 array): coordinate scale factors of the level
+    offset (float): the sum of -phi over all pixel inside the worm
+  
+  Returns:
+    B array: costs
+  
+  Note:
+    Pixels covered by only one of the worm shape and the image foreground count
+    with their distance to the image contour. This is sum(mask * phi) + offset
+    for the rasterized worm shape mask, which is cheap to evaluate for many shapes 
+    and does not require a contour representation of the worm models.
+  """
+  left, right = wgeo.shape_from_center_discrete_batch(np.asarray(center, dtype = float), width);
+  polygon = np.concatenate([left, right[:,::-1]], axis = 1);
+  polygon = (polygon + 0.5) / factor - 0.5;
+  mask = mask_from_polygon(polygon, phi.shape);
+  cost = np.reshape(mask, (mask.shape[0], -1)).dot(phi.ravel()) + offset;
+  return cost * np.prod(factor);
+
+
+def fit_image_multiscale(center, width, image, scales = (4,2,1), iterations = (60,30,15), 
+                         nsamples = 128, nelite = 16, nmodes = 4, spread = (8.0, 0.5, 0.1, 0.1, 2.0), 
+                         alpha = 0.5, tolerance = 0.0125,
+                         sigma = 1, absolute_threshold = None, threshold_factor = 0.95,
+                         frame = None, random_state = None, verbose = False):
+  """Coarse to fine fit of a worm shape to an image
+  
+  Arguments:
+    center (nx2 or Bxnx2 array): initial center line or several initial center lines
+    width (n or Bxn array): initial width profile or profiles
+    image (array): full resolution image
+    scales (tuple): downsampling factors of the levels from coarse to fine
+    iterations (int or tuple): maximal number of iterations for each level
+    nsamples (int): number of candidate shapes evaluated per iteration
+    nelite (int): number of best candidates used to update the sampling distribution
+    nmodes (int): number of cosine modes of the bending angles to optimize
+    spread (tuple): initial standard deviations of position, orientation, log length, 
+                    log width and bending mode amplitudes
+    alpha (float): update rate of the sampling distribution
+    tolerance (float): stop a level if all standard deviations fall below this fraction of 
+                       the spread, relative to the resolution of the level 
+    sigma, absolute_threshold, threshold_factor: image thresholding as in :func:`image_pyramid`
+    frame (hashable or None): frame id to cache the image pyramid
+    random_state (int, RandomState or None): random number generator or seed
+    verbose (bool): print the costs at each level
+  
+  Returns:
+    nx2 array: fitted center line
+    n array: fitted width profile
+    float: cost at the finest level
+  
+  Note:
+    The shape is parameterized by position, orientation, length, a global width
+    factor and cosine modes of the bending angles along the center line. At each 
+    level a cross entropy search samples candidate shapes around the current 
+    estimate and evaluates all of them in a single call to :func:`cost_from_phi_batch`.
+    Most iterations are spent on the cheap coarse levels, finer levels restart 
+    with a spread matched to their resolution and only refine the shape.
+    
+    For several initial shapes, e.g. from a :class:`worm.postures.PostureLibrary`, 
+    only the best one at the coarsest level is optimized.
+  """
+  if not isinstance(random_state, np.random.RandomState):
+    random_state = np.random.RandomState(random_state);
+  
+  pyramid = image_pyramid(image, scales = scales, sigma = sigma, absolute_threshold = absolute_threshold, 
+                          threshold_factor = threshold_factor, frame = frame);
+  if not isinstance(iterations, (tuple, list)):
+    iterations = (iterations,) * len(pyramid);
+  
+  center = np.asarray(center, dtype = float);
+  width = np.asarray(width, dtype = float);
+  if center.ndim == 3:
+    if width.ndim == 1:
+      width = np.repeat(width[np.newaxis], center.shape[0], axis = 0);
+    factor, phi, offset = pyramid[0];
+    best = np.argmin(cost_from_phi_batch(center, width, phi, factor = factor, offset = offset));
+    center, width = center[best], width[best];
+  
+  theta, orientation, xy, length = wgeo.theta_from_center_discrete_batch(center);
+  nmodes = min(nmodes, theta.shape[0]);
+  modes = np.cos(np.pi * np.arange(nmodes)[:,np.newaxis] * np.linspace(0, 1, theta.shape[0]));
+  
+  # parameter: x, y, orientation, log length, log width, bending modes
+  spread = np.hstack([spread[0], spread[0], spread[1:4], np.ones(nmodes) * spread[4]]);
+  ndim = spread.shape[0];
+  
+  def shapes(p):
+    t = theta + p[:,5:].dot(modes);
+    c = wgeo.center_from_theta_discrete_batch(t, orientation + p[:,2], xy + p[:,:2], length * np.exp(p[:,3]));
+    return c, width * np.exp(p[:,4:5]);
+  
+  best = np.zeros(ndim);
+  std = spread.copy();
+  for l, (factor, phi, offset) in enumerate(pyramid):
+    rel = np.mean(factor) / np.mean(pyramid[0][0]);
+    if l > 0:
+      std = np.maximum(std, 0.5 * rel * spread);
+    mean = best.copy();
+    c, w = shapes(best[np.newaxis]);
+    best_cost = cost_from_phi_batch(c, w, phi, factor = factor, offset = offset)[0];
+    
+    i = -1;
+    for i in range(iterations[l]):
+      p = mean + std * random_state.randn(nsamples, ndim);
+      p[0] = best;
+      c, w = shapes(p);
+      cost = cost_from_phi_batch(c, w, phi, factor = factor, offset = offset);
+      elite = np.argsort(cost)[:nelite];
+      if cost[elite[0]] < best_cost:
+        best, best_cost = p[elite[0]], cost[elite[0]];
+      mean = alpha * np.mean(p[elite], axis = 0) + (1 - alpha) * mean;
+      std  = alpha * np.std(p[elite], axis = 0)  + (1 - alpha) * std;
+      if np.all(std < tolerance * rel * spread):
+        break;
+    if verbose:
+      print('level %d (%dx%d): cost %f after %d iterations' % ((l,) + phi.shape + (best_cost, i + 1)));
+  
+  c, w = shapes(best[np.newaxis]);
+  return c[0], w[0], best_cost;
+
+
+
+### Windowed trajectory fits
+
+def align_window_head_tail(center, width = None, reference = None):
+  """Orients a sequence of center lines consistently
+  
+  Arguments:
+    center (Wxnx2 array): center lines of consecutive frames
+    width (Wxn array or None): width profiles of the frames
+    reference (nx2 array or None): center line preceeding the sequence, if None keep the orientation of the first frame
+  
+  Returns:
+    Wxnx2 array: center lines with head and tail swapped where they match the preceeding frame better
+    Wxn array: width profiles swapped accordingly (if width is not None)
+  """
+  center = np.array(center, dtype = float);
+  if width is not None:
+    width = np.array(width, dtype = float);
+  previous = reference;
+  for t in range(center.shape[0]):
+    if previous is not None:
+      if np.sum((center[t,::-1] - previous)**2) < np.sum((center[t] - previous)**2):
+        center[t] = center[t,::-1];
+        if width is not None:
+          width[t] = width[t,::-1];
+    previous = center[t];
+  if width is not None:
+    return center, width;
+  else:
+    return center;
+
+
+def smooth_trajectory(center, smoothness = (1.0, 1.0, 1.0), weights = None, order = 2):
+  """Temporally smoothed sequence of center lines
+  
+  Arguments:
+    center (Wxnx2 array): center lines of consecutive frames
+    smoothness (tuple): weights of the squared finite differences in time of the center position, 
+                        the shape (bending angles, orientation and length) and the head position
+    weights (W array or None): weights of the individual frames, if None all weights are 1
+    order (int): order of the finite differences in time, 2 leaves uniform motion and bending unchanged
+  
+  Returns:
+    Wxnx2 array: smoothed center lines
+  
+  Note:
+    Smoothing is done on the shape parameters and not on the center points to avoid 
+    shrinking bent worms. The shape is smoothed first, the position xy of the middle point 
+    then minimizes 
+    
+      sum_t w_t |xy_t - xy0_t|^2 + s_c |(D xy)_t|^2 + s_h |(D h)_t|^2
+    
+    where the head h_t = xy_t + r_t is at a fixed offset r_t from the middle point 
+    of the smoothed shape and D is the finite difference in time. All terms are banded
+    in time and solved with :func:`scipy.linalg.solve_banded`.
+  """
+  center = np.asarray(center, dtype = float);
+  nframes = center.shape[0];
+  smooth_center, smooth_shape, smooth_head = smoothness;
+  if nframes <= order:
+    return center.copy();
+  if weights is None:
+    weights = np.ones(nframes);
+  weights = np.asarray(weights, dtype = float);
+  
+  theta, orientation, xy, length = wgeo.theta_from_center_discrete_batch(center);
+  if smooth_shape > 0:
+    theta = smooth_banded(theta, smoothness = smooth_shape, weights = weights, order = order);
+    orientation = smooth_banded(np.unwrap(orientation), smoothness = smooth_shape, weights = weights, order = order);
+    length = np.exp(smooth_banded(np.log(length), smoothness = smooth_shape, weights = weights, order = order));
+  smoothed = wgeo.center_from_theta_discrete_batch(theta, orientation, xy, length);
+  
+  if smooth_center > 0 or smooth_head > 0:
+    head = smoothed[:,0] - xy;
+    ab = smoothing_matrix(nframes, smoothness = smooth_center + smooth_head, weights = weights, order = order);
+    xy_smooth = solve_banded((order, order), ab, weights[:,np.newaxis] * xy - smooth_head * difference_penalty(head, order = order));
+    smoothed += (xy_smooth - xy)[:,np.newaxis,:];
+  
+  return smoothed;
+
+
+def fit_image_window(center, width, images, scales = (4,2,1), iterations = (20,10,5), 
+                     nsamples = 128, nelite = 16, nmodes = 4, spread = (8.0, 0.5, 0.1, 0.1, 2.0), 
+                     alpha = 0.5, tolerance = 0.0125, smoothness = (5.0, 5.0, 5.0), weight_prior = 0.1,
+                     sigma = 1, absolute_threshold = None, threshold_factor = 0.95,
+                     frames = None, random_state = None, verbose = False):
+  """Joint coarse to fine fit of the worm shapes in a window of consecutive frames
+  
+  Arguments:
+    center (nx2 or Wxnx2 array): initial center line or center lines for each frame
+    width (n or Wxn array): initial width profile or profiles for each frame
+    images (list of W arrays): full resolution images of consecutive frames
+    scales (tuple): downsampling factors of the levels from coarse to fine
+    iterations (int or tuple): maximal number of iterations for each level
+    nsamples (int): number of candidate shapes evaluated per frame and iteration
+    nelite (int): number of best candidates used to update the sampling distributions
+    nmodes (int): number of cosine modes of the bending angles to optimize
+    spread (tuple): initial standard deviations as in :func:`fit_image_multiscale`
+    alpha (float): update rate of the sampling distributions
+    tolerance (float): stop a level if all standard deviations fall below this fraction of 
+                       the spread, relative to the resolution of the level 
+    smoothness (tuple): temporal smoothness of the center position, shape and head position 
+                        relative to the weight of the per frame estimates, see :func:`smooth_trajectory`
+    weight_prior (float): weight of the squared distance of candidates to the smoothed trajectory
+    sigma, absolute_threshold, threshold_factor: image thresholding as in :func:`image_pyramid`
+    frames (list or None): frame ids to cache the image pyramids
+    random_state (int, RandomState or None): random number generator or seed
+    verbose (bool): print the costs at each level
+  
+  Returns:
+    Wxnx2 array: fitted smooth trajectory of center lines
+    Wxn array: fitted width profiles
+    W array: image costs at the finest level
+  
+  Note:
+    The shapes c_t of the frames and a smooth trajectory x_t are optimized alternately for
+    
+      sum_t cost(c_t) + weight_prior |c_t - x_t|^2 + smoothness terms of x
+    
+    Each frame runs the cross entropy search of :func:`fit_image_multiscale` with c_t the 
+    best candidate so far, the trajectory is updated after every iteration as the banded 
+    least squares solution :func:`smooth_trajectory` of the current shapes. Frames with ambiguous 
+    images are thus constrained by their neighbours and the returned trajectory needs no 
+    further temporal smoothing.
+  """
+  if not isinstance(random_state, np.random.RandomState):
+    random_state = np.random.RandomState(random_state);
+  
+  nframes = len(images);
+  if frames is None:
+    frames = [None] * nframes;
+  pyramids = [image_pyramid(image, scales = scales, sigma = sigma, absolute_threshold = absolute_threshold, 
+                            threshold_factor = threshold_factor, frame = frame) for image, frame in zip(images, frames)];
+  if not isinstance(iterations, (tuple, list)):
+    iterations = (iterations,) * len(pyramids[0]);
+  
+  center = np.asarray(center, dtype = float);
+  if center.ndim == 2:
+    center = np.repeat(center[np.newaxis], nframes, axis = 0);
+  width = np.asarray(width, dtype = float);
+  if width.ndim == 1:
+    width = np.repeat(width[np.newaxis], nframes, axis = 0);
+  center, width = align_window_head_tail(center, width);
+  
+  nmodes = min(nmodes, center.shape[1] - 2);
+  modes = np.cos(np.pi * np.arange(nmodes)[:,np.newaxis] * np.linspace(0, 1, center.shape[1] - 2));
+  
+  # parameter: x, y, orientation, log length, log width, bending modes relative to the current shapes
+  spread = np.hstack([spread[0], spread[0], spread[1:4], np.ones(nmodes) * spread[4]]);
+  ndim = spread.shape[0];
+  
+  def shapes(p, center, width):
+    theta, orientation, xy, length = wgeo.theta_from_center_discrete_batch(center);
+    t = theta[:,np.newaxis] + p[...,5:].dot(modes);
+    c = wgeo.center_from_theta_discrete_batch(t, orientation[:,np.newaxis] + p[...,2], xy[:,np.newaxis] + p[...,:2], 
+                                              length[:,np.newaxis] * np.exp(p[...,3]));
+    return c, width[:,np.newaxis] * np.exp(p[...,4:5]);
+  
+  trajectory = smooth_trajectory(center, smoothness = smoothness);
+  std = np.repeat(spread[np.newaxis], nframes, axis = 0);
+  cost = np.zeros((nframes, nsamples));
+  for l in range(len(pyramids[0])):
+    rel = np.mean(pyramids[0][l][0]) / np.mean(pyramids[0][0][0]);
+    if l > 0:
+      std = np.maximum(std, 0.5 * rel * spread);
+    anchor, anchor_width = center.copy(), width.copy();
+    best = np.zeros((nframes, ndim));
+    mean = best.copy();
+    
+    active = np.arange(nframes);
+    i = -1;
+    for i in range(iterations[l]):
+      p = mean[active,np.newaxis] + std[active,np.newaxis] * random_state.randn(len(active), nsamples, ndim);
+      p[:,0] = best[active];
+      c, w = shapes(p, anchor[active], anchor_width[active]);
+      for a, f in enumerate(active):
+        factor, phi, offset = pyramids[f][l];
+        cost[f] = cost_from_phi_batch(c[a], w[a], phi, factor = factor, offset = offset);
+      cost[active] += weight_prior * np.sum((c - trajectory[active,np.newaxis])**2, axis = (2,3));
+      
+      elite = np.argsort(cost[active], axis = 1)[:,:nelite];
+      pe = np.take_along_axis(p, elite[...,np.newaxis], axis = 1);
+      best[active] = pe[:,0];
+      mean[active] = alpha * np.mean(pe, axis = 1) + (1 - alpha) * mean[active];
+      std[active]  = alpha * np.std(pe, axis = 1)  + (1 - alpha) * std[active];
+      
+      center[active] = np.take_along_axis(c, elite[:,:1,np.newaxis,np.newaxis], axis = 1)[:,0];
+      width[active]  = np.take_along_axis(w, elite[:,:1,np.newaxis], axis = 1)[:,0];
+      trajectory = smooth_trajectory(center, smoothness = smoothness);
+      
+      active = active[np.any(std[active] >= tolerance * rel * spread, axis = 1)];
+      if len(active) == 0:
+        break;
+    if verbose:
+      print('level %d: mean cost %f after %d iterations' % (l, np.mean(np.min(cost, axis = 1)), i + 1));
+  
+  cost = np.array([cost_from_phi_batch(trajectory[f:f+1], width[f:f+1], pyramid[-1][1], 
+                                       factor = pyramid[-1][0], offset = pyramid[-1][2])[0] for f, pyramid in enumerate(pyramids)]);
+  return trajectory, width, cost;
+
+
+def fit_images_windowed(images, center, width, window = 8, overlap = 2, seed_iterations = (20,10,5), frames = None, random_state = None, verbose = False, **kwargs):
+  """Fits worm shapes to a recording in overlapping windows of jointly fitted frames
+  
+  Arguments:
+    images (list or array of T images): full resolution images of consecutive frames
+    center (nx2 or Txnx2 array): initial center line of the first frame or of all frames
+    width (n or Txn array): initial width profile of the first frame or of all frames
+    window (int): number of frames fitted jointly
+    overlap (int): number of frames shared by consecutive windows
+    seed_iterations (tuple or None): iterations of the fits seeding the entering frames, if None 
+                                     the extrapolated predecessors are used directly
+    frames (list or None): frame ids to cache the image pyramids
+    random_state (int, RandomState or None): random number generator or seed
+    verbose (bool): print progress
+    **kwargs: parameter passed to :func:`fit_image_window`
+  
+  Returns:
+    Txnx2 array: fitted center lines
+    Txn array: fitted width profiles
+    T array: image costs at the finest level
+  
+  Note:
+    Unless initial shapes for all frames are given, each frame entering a window is
+    seeded by its fitted or seeded predecessor shifted by the last displacement and 
+    refined by a short fit of :func:`fit_image_multiscale`. A single seed for all frames 
+    of a window lets the fits of moving worms slide along the body and shrink.
+    Results of overlapping frames are blended linearly from the earlier to the later window.
+  """
+  if not isinstance(random_state, np.random.RandomState):
+    random_state = np.random.RandomState(random_state);
+  
+  nframes = len(images);
+  center = np.asarray(center, dtype = float);
+  width = np.asarray(width, dtype = float);
+  initial = center.ndim == 3;
+  
+  centers = np.zeros((nframes,) + center.shape[-2:]);
+  widths = np.zeros((nframes, width.shape[-1]));
+  costs = np.zeros(nframes);
+  step = max(window - overlap, 1);
+  
+  seed_kwargs = dict((k, v) for k, v in kwargs.items() if k in ('scales', 'nsamples', 'nelite', 'nmodes', 'spread', 'alpha', 
+                                                                 'tolerance', 'sigma', 'absolute_threshold', 'threshold_factor'));
+  
+  fitted = 0;
+  for start in range(0, nframes, step):
+    stop = min(start + window, nframes);
+    if initial:
+      c0, w0 = center[start:stop].copy(), np.broadcast_to(width, (nframes, width.shape[-1]))[start:stop].copy();
+    else:
+      # seed entering frames by their predecessors extrapolated with constant velocity
+      for f in range(fitted, stop):
+        if f == 0:
+          c, w = center, width;
+        else:
+          c, w = centers[f-1], widths[f-1];
+          if f > 1:
+            c = c + np.mean(centers[f-1] - centers[f-2], axis = 0);
+        if seed_iterations is not None:
+          c, w, _ = fit_image_multiscale(c, w, images[f], iterations = seed_iterations, 
+                                         frame = None if frames is None else frames[f], 
+                                         random_state = random_state, **seed_kwargs);
+        centers[f], widths[f] = c, w;
+      c0, w0 = centers[start:stop].copy(), widths[start:stop].copy();
+    if initial and fitted > start:
+      c0[:fitted - start] = centers[start:fitted];
+      w0[:fitted - start] = widths[start:fitted];
+    
+    c, w, cost = fit_image_window(c0, w0, images[start:stop], 
+                                  frames = None if frames is None else frames[start:stop], 
+                                  random_state = random_state, **kwargs);
+    if start > 0:
+      c, w = align_window_head_tail(c, w, reference = centers[start - 1]);
+    
+    n = max(fitted - start, 0);
+    blend = (np.arange(n) + 1.0) / (n + 1);
+    centers[start:fitted] = (1 - blend[:,np.newaxis,np.newaxis]) * centers[start:fitted] + blend[:,np.newaxis,np.newaxis] * c[:n];
+    widths[start:fitted]  = (1 - blend[:,np.newaxis]) * widths[start:fitted] + blend[:,np.newaxis] * w[:n];
+    costs[start:fitted]   = (1 - blend) * costs[start:fitted] + blend * cost[:n];
+    centers[fitted:stop], widths[fitted:stop], costs[fitted:stop] = c[n:], w[n:], cost[n:];
+    fitted = stop;
+    
+    if verbose:
+      print('frames %d-%d: mean cost %f' % (start, stop, np.mean(cost)));
+    if stop == nframes:
+      break;
+  
+  return centers, widths, costs;
+
+
+
+def test():
+  import numpy as np
+  import worm.model as wm
+  import worm.costs as wc
+  from interpolation.curve import Curve
+  from interpolation.resampling import resample
+  
+  # contour of a shifted worm
+  s = np.linspace(0, 1, 21);
+  center = np.stack([75 + 40 * (s - 0.5), 75 + 8 * np.sin(3 * s)], axis = 1);
+  left, right = wm.WormModel(center = center + [2,1]).shape();
+  contour = Curve(resample(np.vstack([left, right[-2:0:-1], left[:1]]), 100), nparameter = 50);
+  
+  # analytic gradient with head tail detection vs central finite differences
+  w = wm.WormModel(center = center);
+  parameter = w.get_parameter();
+  grad = wc.cost_func_contour_grad(w, parameter, contour);
+  grad_fd = np.zeros_like(parameter); eps = 1e-5;
+  for i in range(len(parameter)):
+    p1 = parameter.copy(); p1[i] += eps;
+    p2 = parameter.copy(); p2[i] -= eps;
+    grad_fd[i] = (wc.cost_func_contour(w, p1, contour) - wc.cost_func_contour(w, p2, contour)) / (2 * eps);
+  print('max deviation to finite differences: %r' % np.max(np.abs(grad - grad_fd)));
+  
+  w.set_parameter(parameter);
+  print('contour fit cost: %f -> %f' % (wc.cost_from_countour(w, contour), wc.fit_contour(w, contour)));
+
+
+if __name__ == "__main__":
+  test();
@@ -30,13 +30,17 @@ import cv2
 from interpolation.spline import Spline
 from interpolation.curve import Curve
 
-from interpolation.resampling import resample as resample_curve
+from interpolation.resampling import resample as resample_curve, resample_arc_length
+import interpolation.fourier as fourier
+from interpolation.projection import project_points_to_polyline, project_points_to_segments, width_from_sides
+from interpolation.polygon import winding_number, distance_to_segments
+from interpolation.intersections import segments_polyline_intersections
 #from interpolation.intersections import curve_intersections_discrete;
 
-from signalprocessing.peak_detection import find_peaks
+from signalprocessing.peak_detection import find_peaks, find_peaks_circular
 
 from imageprocessing.contours import detect_contour, sort_points_to_line, inside_polygon;
-from imageprocessing.skeleton_graph import skeleton_to_adjacency
+from imageprocessing.skeleton_graph import skeleton_to_line, skeleton_to_sparse, skeleton_end_points
   
 
 
@@ -127,16 +131,7 @@ def center_from_sides_vonroi(left, right, npoints = all, nsamples = all, resampl
     return center;
   
   # calculate normals along midline and intersection to left/right curves
-  width = np.zeros(npoints);
-  
-  rightline = geom.LineString(rightcurve);
-  leftline  = geom.LineString(leftcurve);
-  
-  for i in range(npoints):
-    mid_point = geom.Point(center[i,0], center[i,1]);
-    right_point = rightline.interpolate(rightline.project(mid_point));
-    left_point  =  leftline.interpolate( leftline.project(mid_point));
-    width[i] = np.linalg.norm(np.array([left_point.x - right_point.x, left_point.y - right_point.y]));
+  width = width_from_sides(center, leftcurve, rightcurve);
 
   return center, width
   
@@ -170,81 +165,27 @@ def center_from_sides_projection(left, right, npoints = all, nsamples = all, res
     rightcurve = right;
   
   # calculate center
-  center = np.zeros((nsamples,2));
-    
   if nneighbours is all:
-    rightline = geom.LineString(rightcurve);
-    leftline  = geom.LineString(leftcurve);
+    left_right  = project_points_to_polyline( leftcurve, rightcurve);
+    right_left  = project_points_to_polyline(rightcurve,  leftcurve);
+  else: # only consider a certain subset of neighbours in projection (useful when worm is highly bend)
+    left_right  = project_points_to_polyline( leftcurve, rightcurve, nneighbours = nneighbours);
+    right_left  = project_points_to_polyline(rightcurve,  leftcurve, nneighbours = nneighbours);
   
-    for i in range(nsamples):
-      right_point = geom.Point(rightcurve[i,0], rightcurve[i,1]);
-      left_point  = geom.Point(leftcurve[i,0], leftcurve[i,1]);
-        
-      right_left_point =  leftline.interpolate( leftline.project(right_point));
-      left_right_point = rightline.interpolate(rightline.project( left_point));
-      
-      center[i] = 0.25 * np.array([right_point.x + left_point.x + right_left_point.x + left_right_point.x,
-                                   right_point.y + left_point.y + right_left_point.y + left_right_point.y]);
-      
-    center = resample_curve(center, npoints, smooth = smooth);
+  center = 0.25 * (leftcurve + rightcurve + left_right + right_left);
+  center = resample_curve(center, npoints, smooth = smooth);
+
+  if not with_width:
+    return center;
   
-    if not with_width:
-      return center;
-    
-    # calculate normals along midline and intersection to left/right curves
-    width = np.zeros(npoints);
-    
-    rightline = geom.LineString(rightcurve);
-    leftline  = geom.LineString(leftcurve);
-    
-    for i in range(npoints):
-      mid_point = geom.Point(center[i,0], center[i,1]);
-      right_point = rightline.interpolate(rightline.project(mid_point));
-      left_point  =  leftline.interpolate( leftline.project(mid_point));
-      width[i] = np.linalg.norm(np.array([left_point.x - right_point.x, left_point.y - right_point.y]));
+  # calculate normals along midline and intersection to left/right curves
+  if nneighbours is all:
+    width = width_from_sides(center, leftcurve, rightcurve);
+  else:
+    index = np.asarray(np.round(np.linspace(0, nsamples-1, npoints)), dtype = int);
+    width = width_from_sides(center, leftcurve, rightcurve, nneighbours = nneighbours, index = index);
   
-    return center, width
-
-  else: # only consider a certain subset of neighbours in projection (useful when worm is highly bend)
-    #nneighbours2 = int(np.ceil(nneighbours/2.0));
-    nneighbours2 = nneighbours;
-    for i in range(nsamples):
-      il = max(0, i-nneighbours2);
-      ir = min(i+nneighbours2, nsamples);
-      
-      rightline = geom.LineString(rightcurve[il:ir]);
-      leftline  = geom.LineString( leftcurve[il:ir]);
-      
-      right_point = geom.Point(rightcurve[i,0], rightcurve[i,1]);
-      left_point  = geom.Point(leftcurve[i,0], leftcurve[i,1]);
-        
-      right_left_point =  leftline.interpolate( leftline.project(right_point));
-      left_right_point = rightline.interpolate(rightline.project( left_point));
-      
-      center[i] = 0.25 * np.array([right_point.x + left_point.x + right_left_point.x + left_right_point.x,
-                                   right_point.y + left_point.y + right_left_point.y + left_right_point.y]);
-    
-    center = resample_curve(center, npoints, smooth = smooth);
-
-    if not with_width:
-      return center;
-    
-    # calculate normals along midline and intersection to left/right curves
-    width = np.zeros(npoints);
-    
-    for i in range(nsamples):
-      il = max(0, i-nneighbours2);
-      ir = min(i+nneighbours2, nsamples);
-      
-      rightline = geom.LineString(rightcurve[il:ir]);
-      leftline  = geom.LineString( leftcurve[il:ir]);
-      
-      mid_point = geom.Point(center[i,0], center[i,1]);
-      right_point = rightline.interpolate(rightline.project(mid_point));
-      left_point  =  leftline.interpolate( leftline.project(mid_point));
-      width[i] = np.linalg.norm(np.array([left_point.x - right_point.x, left_point.y - right_point.y]));
-    
-    return center, width
+  return center, width
 
 
 
@@ -276,46 +217,32 @@ def center_from_sides_min_projection(left, right, npoints = all, nsamples = all,
     leftcurve = left;
     rightcurve = right;
   
+  # projections of all points onto all segments of the opposite side
+  # t_rl[ir,il-1]: position of right point ir on left segment [il-1,il]
+  t_rl, xy_rl = project_points_to_segments(rightcurve, leftcurve);
+  t_lr, xy_lr = project_points_to_segments(leftcurve, rightcurve);
+  
   # calculate center
   full_left = [leftcurve[i] for i in range(center_offset)];
   full_right = [rightcurve[i] for i in range(center_offset)];
-  width = [0];
-  il = center_offset-1; ir = center_offset-1;
-  rightline = geom.LineString(rightcurve[il:il+2]);
-  leftline  = geom.LineString( leftcurve[ir:ir+2]); 
   
   il = center_offset; ir = center_offset;
-  left_point  = geom.Point(leftcurve[il,0], leftcurve[il,1]);
-  right_point = geom.Point(rightcurve[ir,0], rightcurve[ir,1]); 
-  
   while il < nsamples-center_offset-1 and ir < nsamples-center_offset-1:
-    #print il,ir
-    ul = leftline.project(right_point, normalized = True);
-    ur = rightline.project(left_point, normalized = True);
-    #print ul,ur
-    #print left_point, right_point
+    ul = t_rl[ir, il-1];
+    ur = t_lr[il, ir-1];
     if ul == ur:
-      full_left.append(left_point.coords[0]);
-      full_right.append(right_point.coords[0]);
-      leftline = geom.LineString(leftcurve[il:il+2]);
-      rightline = geom.LineString(rightcurve[ir:ir+2]);
+      full_left.append(leftcurve[il]);
+      full_right.append(rightcurve[ir]);
       il+=1;
       ir+=1;
-      left_point = geom.Point(leftcurve[il,0], leftcurve[il,1]);
-      right_point = geom.Point(rightcurve[ir,0], rightcurve[ir,1]);
     elif ul < ur: # add center from right
-      full_left.append(leftline.interpolate(ul, normalized = True).coords[0]);
-      full_right.append(right_point.coords[0]);
-      rightline = geom.LineString(rightcurve[ir:ir+2]);
+      full_left.append(xy_rl[ir, il-1]);
+      full_right.append(rightcurve[ir]);
       ir+=1;
-      right_point = geom.Point(rightcurve[ir,0], rightcurve[ir,1]);
     else:
-      full_left.append(left_point.coords[0]);
-      full_right.append(rightline.interpolate(ur, normalized = True).coords[0]);
-      leftline = geom.LineString(leftcurve[il:il+2]);
+      full_left.append(leftcurve[il]);
+      full_right.append(xy_lr[il, ir-1]);
       il+=1;
-      left_point = geom.Point(leftcurve[il,0], leftcurve[il,1]);
-  
   
   full_left.extend([leftcurve[i] for i in range(-center_offset,0)]);
   full_right.extend([rightcurve[i] for i in range(-center_offset,0)]);
@@ -709,6 +636,39 @@ def theta_from_center_spline(center, npoints = all, nsamples = all, resample = F
   return theta, orientation, xy, length
 
 
+def theta_from_center_discrete_batch(center):
+  """Calculates bending angles of many center lines on their discrete mesh
+  
+  Arguments:
+    center (...xnx2 array): center lines
+  
+  Returns:
+    ...xn-2 array: bending angles along the center lines
+    ... array: absolute orientations
+    ...x2 array: positions
+    ... array: lengths
+  
+  Note:
+    Vectorized version of :func:`theta_from_center_discrete` without resampling.
+  """
+  center = np.asarray(center, dtype = float);
+  nsamples = center.shape[-2];
+  n2 = (nsamples-1)//2;
+  
+  centervec = np.diff(center, axis = -2);
+  phi = np.arctan2(centervec[...,1], centervec[...,0]);
+  
+  orientation = phi[...,n2];
+  xy = center[...,n2,:];
+  
+  theta = np.mod(np.diff(phi, axis = -1) + np.pi, 2 * np.pi) - np.pi;
+  theta *= (nsamples-1);
+  
+  length = np.sum(np.linalg.norm(centervec, axis = -1), axis = -1);
+  
+  return theta, orientation, xy, length
+
+
 theta_from_center = theta_from_center_discrete;
 
 
@@ -846,6 +806,45 @@ def center_from_theta_spline(theta, orientation = 0, xy = [0,0], length = 1, npo
 #center_from_theta = center_from_theta_discrete;
 #theta_from_center = theta_from_center_discrete;
 
+def center_from_theta_discrete_batch(theta, orientation = 0, xy = [0,0], length = 1, with_normals = False):
+  """Constructs many center lines from theta on discrete mesh
+  
+  Arguments:
+    theta (...xn-2 array): angles along center lines
+    orientation (... array or float): absolute orientations of the center lines
+    xy (...x2 array): absolute positions of the center lines
+    length (... array or float): lengths of center lines
+    with_normals (bool): if True also return the normals
+
+  Returns
+    ...xnx2 array: the sample points along the center lines
+    ...xnx2 array: the normal vectors along the center lines (if with_normals is True)
+  
+  Note:
+    Vectorized version of :func:`center_from_theta_discrete` without resampling.
+  """
+  theta = np.asarray(theta, dtype = float);
+  nsamples = theta.shape[-1] + 2;
+  n2 = (nsamples-1)//2;
+  delta = 1.0 / (nsamples-1);
+  
+  itheta = np.cumsum(np.concatenate([np.zeros(theta.shape[:-1] + (1,)), theta], axis = -1), axis = -1) * delta;
+  itheta += (np.asarray(orientation, dtype = float) - itheta[...,n2])[...,np.newaxis];
+  
+  center = np.zeros(theta.shape[:-1] + (nsamples, 2));
+  center[...,1:,0] = np.cumsum(np.cos(itheta), axis = -1);
+  center[...,1:,1] = np.cumsum(np.sin(itheta), axis = -1);
+  center *= (np.asarray(length, dtype = float) * delta)[...,np.newaxis,np.newaxis];
+  center += (np.asarray(xy, dtype = float) - center[...,n2,:])[...,np.newaxis,:];
+  
+  if with_normals:
+    alpha = np.concatenate([itheta, itheta[...,-1:]], axis = -1) + np.pi/2;
+    alpha[...,1:-1] -= np.diff(itheta, axis = -1) / 2;
+    return center, np.stack([np.cos(alpha), np.sin(alpha)], axis = -1);
+  else:
+    return center;
+
+
 center_from_theta = center_from_theta_discrete;
 
 
@@ -913,6 +912,29 @@ def normals_from_center_discrete(center):
   return normals_from_theta_discrete(theta, orientation);
   
 
+def normals_from_center_discrete_batch(center):
+  """Construct normals along many center lines
+  
+  Arguments:
+    center (...xnx2 array): center lines
+  
+  Returns:
+    array (...xnx2): normals along center points
+  
+  Note:
+    Vectorized version of :func:`normals_from_center_discrete`, the normal 
+    angle is the mean angle of the adjacent segments rotated by pi/2.
+  """
+  centervec = np.diff(np.asarray(center, dtype = float), axis = -2);
+  phi = np.arctan2(centervec[...,1], centervec[...,0]);
+  dphi = np.mod(np.diff(phi, axis = -1) + np.pi, 2 * np.pi) - np.pi;
+  
+  alpha = np.concatenate([phi, phi[...,-1:]], axis = -1);
+  alpha[...,1:-1] -= dphi / 2;
+  alpha += np.pi/2;
+  return np.stack([np.cos(alpha), np.sin(alpha)], axis = -1);
+
+
 normals_from_center = normals_from_center_discrete;
 
 
@@ -959,6 +981,38 @@ def shape_from_theta_discrete(theta, width, orientation = 0, xy = [0,0], length
   
 
 
+def shape_from_theta_discrete_batch(theta, width, orientation = 0, xy = [0,0], length = 1, with_normals = False):
+  """Constructs many shapes from theta on discrete mesh
+  
+  Arguments:
+    theta (...xn-2 array): angles along center lines
+    width (...xn array): width profiles
+    orientation (... array or float): absolute orientations of the center lines
+    xy (...x2 array): absolute positions of the center lines
+    length (... array or float): lengths of center lines
+    with_normals (bool): if True also return the normals
+
+  Returns
+    ...xnx2 array: the sample points along the left sides
+    ...xnx2 array: the sample points along the right sides
+    ...xnx2 array: the sample points along the center lines
+    ...xnx2 array: the normal vectors along the center lines (if with_normals is True)
+  
+  Note:
+    Vectorized version of :func:`shape_from_theta_discrete` without resampling.
+  """
+  center, normals = center_from_theta_discrete_batch(theta, orientation = orientation, xy = xy, length = length, with_normals = True);
+  
+  w = 0.5 * np.asarray(width, dtype = float)[...,np.newaxis];
+  left  = center + w * normals;
+  right = center - w * normals;
+  
+  if with_normals:
+    return left, right, center, normals
+  else:
+    return left, right, center
+
+
 def shape_from_theta_spline(theta, width, orientation = 0, xy = [0,0], length = 1, npoints = all, nsamples = all, resample = False, smooth = 0, with_normals = False):
   """Constructs center line from theta on discrete mesh
   
@@ -1036,6 +1090,31 @@ def shape_from_center_discrete(center, width, normals = None, with_normals = Fal
     return left, right
 
 
+def shape_from_center_discrete_batch(center, width, normals = None, with_normals = False):
+  """Get side lines of many worms from center lines and widths
+  
+  Arguments:
+    center (...xnx2 array): center lines
+    width (...xn array): width profiles
+    normals (...xnx2 or None): normals, if None calculate
+    with_normals (bool): if True also return normals
+  
+  Returns:
+    tuple of arrays (...xnx2): left, right lines and normals
+  """
+  if normals is None:
+    normals = normals_from_center_discrete_batch(center);
+  
+  w = 0.5 * np.asarray(width, dtype = float)[...,np.newaxis];
+  left  = center + w * normals;
+  right = center - w * normals;
+
+  if with_normals:
+    return left, right, normals
+  else:
+    return left, right
+
+
 shape_from_center = shape_from_center_discrete;
 
 
@@ -1184,6 +1263,47 @@ def move_forward_center_discrete(distance, center, straight = True):
     
   return cline2;
 
+
+def move_forward_center_discrete_batch(distance, center, straight = True):
+  """Move many worms forward peristaltically
+  
+  Arguments:
+    distance (float or B array): distance to move forward in units of the worm length
+    center (Bxnx2 array): center points
+    
+  Returns:
+    Bxnx2 array: moved center points
+    
+  Note:
+    In contrast to :func:`move_forward_center_discrete` the center lines are
+    interpolated linearly along the normalized arc length instead of via a 
+    spline. Points beyond the ends are extrapolated straight along the end 
+    segments, i.e. straight is always True.
+  """
+  center = np.asarray(center, dtype = float);
+  nb, n = center.shape[:2];
+  
+  # normalized arc length parameter as in splprep
+  d = np.linalg.norm(np.diff(center, axis = 1), axis = 2);
+  u = np.hstack([np.zeros((nb,1)), np.cumsum(d, axis = 1)]);
+  u /= u[:,-1:];
+  us = u - np.reshape(distance, (-1,1));
+  
+  # segments containing the new positions, offset rows to search all at once
+  offset = 2 * np.arange(nb)[:,np.newaxis];
+  k = np.searchsorted((u + offset).flatten(), (np.clip(us, 0, 1) + offset).flatten(), side = 'right');
+  k = np.reshape(k, (nb, n)) - np.arange(nb)[:,np.newaxis] * n - 1;
+  k = np.clip(k, 0, n-2);
+  
+  rows = np.arange(nb)[:,np.newaxis];
+  u0 = u[rows, k]; u1 = u[rows, k+1];
+  du = u1 - u0;
+  du[du == 0] = 1;
+  t = ((us - u0) / du)[:,:,np.newaxis];
+  
+  return (1 - t) * center[rows, k] + t * center[rows, k+1];
+
+
   
 def move_forward_discrete(distance, theta, orientation, xy, length, straight = True):
   """Move worm forward peristaltically
@@ -1640,32 +1760,15 @@ def center_from_image_skeleton(image, sigma = 1, absolute_threshold = None, thre
   # Note: here we return an error in case this is not a trivial line with two endpoints
   # potentiall can extend to detect overlapping shapes etc
   x,y = np.where(skel);
-  adj = skeleton_to_adjacency(skel)
+  xy = skeleton_to_line(skel);
   
-  # find end points:
-  nhs = np.array([len(v) for v in adj.values()]);
-  ht = np.where(nhs == 1)[0];
-  
-  if len(ht) != 2:
+  if xy is None:
     if verbose:
       plt.imshow(imgs);
       plt.scatter(y,x, s = 10, c = 'r');
-    raise RuntimeError('skeletonization detected %d possible heat/tail locations' % len(ht));
-  
-  e = adj.keys()[ht[1]];  
-  p = adj.keys()[ht[0]];  
-  xy = np.zeros((len(adj), 2));
-  xy[0] = p;
-  i = 1;
-  p0 = p;
-  while p != e:
-    neighbrs = adj[p];
-    if neighbrs[0] != p0:
-      p0, p = p, neighbrs[0];
-    else:
-      p0, p = p, neighbrs[1];
-    xy[i] = p; i+=1;
-  xy = xy[:,::-1];
+    raise RuntimeError('skeletonization detected %d possible heat/tail locations' % len(skeleton_end_points(skeleton_to_sparse(skel)[1])));
+  
+  xy = np.asarray(xy[:,::-1], dtype = float);
   
   #Note: could add head tail positions detected in contour  and width detection here
   
@@ -1718,9 +1821,7 @@ def skeleton_from_image_discrete(image, sigma = 1, absolute_threshold = None, th
   
   if with_head_tail:
     # find end points:
-    adj = skeleton_to_adjacency(skel);
-    nhs = np.array([len(v) for v in adj.values()]);
-    ht = np.where(nhs == 1)[0];
+    ht = skeleton_end_points(skeleton_to_sparse(skel)[1]);
     
     if verbose:
       xy = np.vstack([x,y]).T;
@@ -1833,7 +1934,21 @@ def contours_from_shape_discrete(left, right):
   return tuple(cts)  
 
 
-def curvature_from_contour(contour,ncontour = all, smooth = 1.0):
+def curvature_from_contour(contour,ncontour = all, smooth = 1.0, method = 'spline'):
+  """Curvature along a closed contour
+  
+  Arguments:
+    contour (Curve or nx2 array): closed contour (contour[0] = contour[-1])
+    ncontour (int or all): number of sample points
+    smooth (float or None): smoothing factor for the spline or Gaussian smoothing width in sample points for the 'fourier' method
+    method (str): 'spline' to use a periodic spline or 'fourier' to use Fourier descriptors
+  
+  Returns:
+    array: curvature at ncontour-1 points along the contour
+  
+  Note:
+    Both methods sample the contour at ncontour-1 points equidistant in arc length starting at contour[0].
+  """
   if isinstance(contour, Curve):
     contour = contour.values;
   
@@ -1841,6 +1956,10 @@ def curvature_from_contour(contour,ncontour = all, smooth = 1.0):
   if ncontour is all:
     ncontour = contour.shape[0];
   
+  if method == 'fourier':
+    cnt = resample_arc_length(contour[:-1], npoints = ncontour - 1, periodic = True, method = 'cubic');
+    return fourier.curvature(cnt, sigma = smooth if smooth else None);
+  
   cinterp, u = splprep(contour.T, u = None, s = smooth, per = 1) 
   us = np.linspace(u.min(), u.max(), ncontour)
   x, y = splev(us[:-1], cinterp, der = 0)
@@ -1853,6 +1972,70 @@ def curvature_from_contour(contour,ncontour = all, smooth = 1.0):
   return k;
   
 
+def curvature_from_contour_discrete(contours):
+  """Curvature along closed contours as angle between subsequent segments
+  
+  Arguments:
+    contours (...xnx2 array): closed contours with contours[...,0,:] = contours[...,-1,:]
+  
+  Returns:
+    ...xn array: turning angle at each contour point
+  """
+  contours = np.asarray(contours, dtype = float);
+  xyvec = np.diff(np.concatenate([contours, contours[...,1:2,:]], axis = -2), axis = -2);
+  
+  k = np.arctan2(xyvec[...,:-1,0], xyvec[...,:-1,1]) - np.arctan2(xyvec[...,1:,0], xyvec[...,1:,1]);
+  k = np.mod(k + np.pi, 2 * np.pi) - np.pi;
+  
+  return np.concatenate([k[...,-1:], k], axis = -1);
+
+
+def head_tail_candidates_discrete(curvature, delta = 0.3, max_curvature = -0.5, nextra = 20):
+  """Detect candidates for head an tail positions from the curvature along many contours
+  
+  Arguments:
+    curvature (...xn array): curvature along closed contours, e.g. from :func:`curvature_from_contour_discrete`
+    delta (float): min height of peak in curvature to detect the head
+    max_curvature (float or None): the peak should have at least a curvature less than this
+    nextra (int): number of points the curvature is extended periodically for the peak detection
+  
+  Returns:
+    ...xn array of bools: True at the positions of the candidates
+  
+  Note:
+    Negative curvature peaks are heads / tails. The peaks of all contours are
+    detected in one vectorized pass via :func:`find_peaks_circular`.
+  """
+  curvature = np.asarray(curvature, dtype = float);
+  peaks = find_peaks_circular(-curvature, delta = delta, nextra = nextra);
+  if max_curvature is not None:
+    peaks = np.logical_and(peaks, curvature < max_curvature);
+  return peaks;
+
+
+def head_tail_from_candidates(curvature, candidates):
+  """Head and tail as the two strongest candidates for many contours
+  
+  Arguments:
+    curvature (...xn array): curvature along closed contours
+    candidates (...xn array of bools): candidate positions, e.g. from :func:`head_tail_candidates_discrete`
+  
+  Returns:
+    ...x2 array: sorted indices of the two candidates with most negative curvature, -1 if missing
+    ... array: number of candidates
+  """
+  candidates = np.asarray(candidates, dtype = bool);
+  ncandidates = np.sum(candidates, axis = -1);
+  
+  strength = np.where(candidates, -np.asarray(curvature, dtype = float), -np.inf);
+  ids = np.sort(np.argsort(strength, axis = -1)[...,-2:], axis = -1);
+  
+  valid = np.take_along_axis(candidates, ids, axis = -1);
+  ids[np.logical_not(np.all(valid, axis = -1))] = -1;
+  
+  return ids, ncandidates;
+
+
 def head_tail_from_contour_discrete(contour, delta = 0.3, max_curvature = -0.5, with_index = False,
                                     verbose = False, save = None, image = None):
   """Detect candidates for head an tail positions along a contour
@@ -1886,42 +2069,11 @@ def head_tail_from_contour_discrete(contour, delta = 0.3, max_curvature = -0.5,
   #d2x, d2y = splev(us[:-1], cinterp, der = 2)
   #k = (dx * d2y - dy * d2x)/np.power(dx**2 + dy**2, 1.5);
 
-  ### curvature as angle between subsequent segments
-  
-  #vectors along center line
-  xyvec = np.diff(np.vstack([contour, contour[1]]), axis = 0);
-  
-  k = np.arctan2(xyvec[:-1,0], xyvec[:-1,1]) - np.arctan2(xyvec[1:,0], xyvec[1:,1]);
-  k = np.mod(k + np.pi, 2 * np.pi) - np.pi;
-  
-  k = np.hstack([k[-1], k]);
-  
-  
-  print(k.shape)
-  print(contour.shape)
+  ### curvature and peaks via batch detection
+  k = curvature_from_contour_discrete(contour)[:-1]; # last point repeats the first
+  idx = np.where(head_tail_candidates_discrete(k, delta = delta, max_curvature = max_curvature))[0];
+  peaks = contour[idx];
   
-  ### find tail / head via peak detection
-  #pad k to detect peaks on both sides
-  nextra = 20;
-  kk = -k; # negative curvature peaks are heads/tails
-  kk = np.hstack([kk,kk[:nextra]]);
-  kpeaks = find_peaks(kk, delta = delta);
-  #print peaks.shape
-  if kpeaks.shape[0] > 0:  
-    kpeaks = kpeaks[kpeaks[:,0] < k.shape[0],:];
-    idx = np.asarray(kpeaks[:,0], dtype = int);
-    
-    if max_curvature is not None:
-      idk = -kk[idx] < max_curvature;
-      kpeaks = kpeaks[idk];
-      idx = idx[idk];
-  
-    print(kk[idx]);
-    peaks = np.vstack([contour[idx,0], contour[idx,1]]).T;
-  else:
-    peaks = np.zeros((0,2));
-    idx = np.zeros(0,dtype = int);
-    
   ### plotting
   if verbose:
     #plt.figure(11); plt.clf();
@@ -1937,8 +2089,8 @@ def head_tail_from_contour_discrete(contour, delta = 0.3, max_curvature = -0.5,
     
     plt.plot(k)
     #plt.scatter(imax, k[imax], c = 'r', s= 100);
-    if kpeaks.shape[0] > 0:
-      plt.scatter(kpeaks[:,0], -kpeaks[:,1], c = 'm', s= 40);
+    if len(idx) > 0:
+      plt.scatter(idx, k[idx], c = 'm', s= 40);
     plt.title('curvature')
     
     if isinstance(save, str):
@@ -2009,11 +2161,7 @@ def self_occlusions_from_shape_discrete(left, right, margin = 0.01, with_bools =
     array, array: left,right occluded points
   """
   
-  poly = geom.Polygon(np.vstack([left, right[::-1,:]]));
-  poly = poly.buffer(-margin);
-  
-  inleft = [poly.contains(geom.Point(xy)) for xy in left];
-  inright = [poly.contains(geom.Point(xy)) for xy in right]; 
+  inleft, inright = self_occlusions_from_shape_discrete_batch(left, right, margin = margin);
   
   res = [];
   if with_bools:
@@ -2028,6 +2176,57 @@ def self_occlusions_from_shape_discrete(left, right, margin = 0.01, with_bools =
   return tuple(res);
 
   
+def self_occlusions_from_shape_discrete_batch(left, right, margin = 0.01):
+  """Returns points of many shapes that are occulded by the worm itself
+  
+  Arguments:
+    left,right (...xnx2 array): sides of the worms
+    margin (float): margin by which to reduce width in order to detect real insiders (small fraction of thw width)
+    
+  Returns
+    array, array: left,right (...xn) arrays of bools indicating occluded points
+  
+  Note:
+    The body is decomposed into the quadrilaterals between consecutive points
+    on the sides. A point is occluded if it is inside a non-adjacent quadrilateral
+    and further away than margin from all edges of the body contour other than the 
+    two contour edges meeting at the point. This includes the head and tail caps and
+    the opposite side, which is closer than margin near thin tips. The winding number 
+    with respect to all non-adjacent quadrilaterals is the winding number of the full 
+    body contour minus the ones of the two quadrilaterals adjacent to the point.
+  """
+  left = np.asarray(left, dtype = float);
+  right = np.asarray(right, dtype = float);
+  n = left.shape[-2];
+  
+  points = np.concatenate([left, right], axis = -2);
+  idx = np.mod(np.arange(2*n), n);
+  
+  # winding number of full contour 
+  w = winding_number(np.concatenate([left, right[...,::-1,:]], axis = -2), points);
+  
+  # remove contributions from adjacent body segments
+  quads = np.stack([left[...,:-1,:], left[...,1:,:], right[...,1:,:], right[...,:-1,:]], axis = -2);
+  for adjacent in [idx - 1, idx]:
+    valid = np.logical_and(adjacent >= 0, adjacent < n-1);
+    wa = winding_number(quads[...,np.clip(adjacent, 0, n-2),:,:], points[...,np.newaxis,:])[...,0];
+    w = w - wa * valid;
+  inside = w != 0;
+  
+  if margin > 0:
+    # distances to all edges of the closed body contour including head and tail caps,
+    # except the two contour edges meeting at the point itself
+    contour = np.concatenate([left, right[...,::-1,:]], axis = -2);
+    dist = distance_to_segments(points, contour, np.roll(contour, -1, axis = -2));
+    position = np.hstack([np.arange(n), np.arange(2*n-1, n-1, -1)]);
+    edges = np.arange(2*n);
+    adjacent = np.logical_or(edges == position[:,np.newaxis], edges == np.mod(position[:,np.newaxis] - 1, 2*n));
+    dist[...,adjacent] = np.inf;
+    inside = np.logical_and(inside, np.min(dist, axis = -1) > margin);
+  
+  return inside[...,:n], inside[...,n:];
+
+  
 def distance_shape_to_contour_discrete(left, right, normals, contour, 
                                        search_radius = [10,20], min_alignment = None, 
                                        match_head_tail = None, 
@@ -2064,88 +2263,45 @@ def distance_shape_to_contour_discrete(left, right, normals, contour,
   right_start = rright + search_radius[0] * normals;
   right_end   = rright - search_radius[1] * normals;
 
-  distances_left  = np.zeros(npts);
-  distances_right = np.zeros(npts);
+  # intersect all normal lines with the contour at once
+  points = contour.get_points(error = 'cannot determine sample points needed for the calculation of the intersections');
+  cntr = contour(points);
+  ncntr = cntr.shape[0];
   
-  intersection_pts_left  = np.zeros((npts,2));
-  intersection_pts_right = np.zeros((npts,2));
+  starts = np.vstack([left_start, right_start]);
+  ends   = np.vstack([left_end, right_end]);
+  hit, t, u = segments_polyline_intersections(starts, ends, cntr);
   
-  for i in range(npts):
-    #intersection points
-    xy,ii,ij,pi,pj = contour.intersections(np.vstack([left_start[i], left_end[i]]),  with_xy = True, with_indices = True, with_points = True);
-    #xy,ii,ij,pi,pj = curve_intersections_discrete(np.vstack([left_start[i], left_end[i]]), contour);
-
-    #occuled points:
-    if len(ii) == 0:
-      distances_left[i] = np.nan;
-      intersection_pts_left[i,:] = np.nan;
-      continue
-    
-    if min_alignment is not None:
-      cntnrmls = contour.normals(points = pi, normalize = True);
-            
-      if verbose:
-        for pt, nm in zip(xy, cntnrmls):
-          pt2 = pt + 5 * nm;
-          plt.plot([pt[0], pt2[0]],[pt[1], pt2[1]], 'k');      
-      
-      algnmt = np.dot(cntnrmls, normals[i]);
-      aligned = algnmt >= min_alignment;
-      if np.any(aligned):
-        xy = xy[aligned];
-        ii = ii[aligned];
-        ij = ij[aligned];
-        pi = pi[aligned];
-        pj = pj[aligned];
-      else:
-        distances_left[i] = np.nan;
-        intersection_pts_left[i,:] = np.nan;
-        continue
-    
-    dd = np.linalg.norm(lleft[i] - xy,axis =1);
-    minidx = np.argmin(dd);
-    distances_left[i] = dd[minidx];
-    intersection_pts_left[i,:] = xy[minidx];
-
-  
-  for i in range(npts):
-    #intersection points
-    xy,ii,ij,pi,pj = contour.intersections(np.vstack([right_start[i], right_end[i]]),  with_xy = True, with_indices = True, with_points = True);
-
-       
-    #occuled points:
-    if len(ii) == 0:
-      distances_right[i] = np.nan;
-      intersection_pts_right[i,:] = np.nan;
-      continue
+  ids, jds = np.where(hit);
+  xy = starts[ids] + t[ids,jds][:,np.newaxis] * (ends[ids] - starts[ids]);
+  
+  if min_alignment is not None and len(ids) > 0:
+    pj = points[jds] + u[ids,jds]/(ncntr-1);
+    cntnrmls = contour.normals(points = pj, normalize = True);
+    nrmls = np.vstack([normals, -normals]);
+    aligned = np.sum(cntnrmls * nrmls[ids], axis = 1) >= min_alignment;
     
-    if min_alignment is not None:
-      cntnrmls = contour.normals(points = pi, normalize = True);
-      
-      algnmt = np.dot(cntnrmls, -normals[i]);
-      #print algnmt, npts, i;
-      aligned = algnmt >= min_alignment;
-      if np.any(aligned):
-        xy = xy[aligned];
-        ii = ii[aligned];
-        ij = ij[aligned];
-        pi = pi[aligned];
-        pj = pj[aligned];
-        
-        if verbose:
-          for pt, nm in zip(xy, cntnrmls[aligned]):
-            pt2 = pt + 5 * nm;
-            plt.plot([pt[0], pt2[0]],[pt[1], pt2[1]], 'k');        
-        
-      else:
-        distances_right[i] = np.nan;
-        intersection_pts_right[i,:] = np.nan;
-        continue
+    if verbose:
+      for pt, nm in zip(xy[aligned], cntnrmls[aligned]):
+        pt2 = pt + 5 * nm;
+        plt.plot([pt[0], pt2[0]],[pt[1], pt2[1]], 'k');
     
-    dd = np.linalg.norm(rright[i] - xy,axis =1);
-    minidx = np.argmin(dd);
-    distances_right[i] = dd[minidx];
-    intersection_pts_right[i,:] = xy[minidx];
+    ids = ids[aligned]; xy = xy[aligned];
+  
+  # nearest intersection for each point, occluded points are set to nan
+  pts = np.vstack([lleft, rright]);
+  dd = np.linalg.norm(pts[ids] - xy, axis = 1);
+  order = np.lexsort((dd, ids));
+  ids = ids[order]; dd = dd[order]; xy = xy[order];
+  first = np.hstack([True, ids[1:] != ids[:-1]]) if len(ids) > 0 else np.zeros(0, dtype = bool);
+  
+  distances = np.full(2 * npts, np.nan);
+  intersection_pts = np.full((2 * npts, 2), np.nan);
+  distances[ids[first]] = dd[first];
+  intersection_pts[ids[first]] = xy[first];
+  
+  distances_left,  distances_right  = distances[:npts], distances[npts:];
+  intersection_pts_left, intersection_pts_right = intersection_pts[:npts], intersection_pts[npts:];
   
   if match_head_tail is not None:
     if len(match_head_tail) > 0:
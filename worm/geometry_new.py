@@ -18,6 +18,7 @@ import matplotlib.pyplot as plt
 
 import shapely.geometry as geom
 from skimage.filters import threshold_otsu
+from skimage.morphology import skeletonize
 
 import scipy.ndimage.filters as filters
 from scipy.interpolate import splev, splprep #, UnivariateSpline
@@ -28,13 +29,14 @@ import cv2
 #from interpolation.spline import Spline
 #from interpolation.curve import Curve
 
-from interpolation.resampling import resample as resample_curve, resample_nd
+from interpolation.resampling import resample as resample_curve, resample_nd, resample_arc_length
 
 #from interpolation.intersections import curve_intersections_discrete;
 
 from signalprocessing.peak_detection import find_peaks
 
 from imageprocessing.contours import detect_contour
+from imageprocessing.skeleton_graph import skeleton_to_line
 
 
 import worm.geometry as wgeo
@@ -232,18 +234,19 @@ def status(s):
   r = '';
   if s < 0:
     r += 'failed ';
+    s = -1-s;
   else:
     r += 'succes '
   
-  cont_dict = {0 : 'no contour', 1 : 'single contour', 2 : 'single outer contour', 3 : 'multiple outer contours (contour hint)', 4 : 'multiple outer contours (size hint)', 5 : 'multiple outer contours (center)'}
+  cont_dict = {0 : 'no contour', 1 : 'single contour', 2 : 'single outer contour', 3 : 'multiple outer contours (contour hint)', 4 : 'multiple outer contours (size hint)', 5 : 'multiple outer contours (center)', 6 : 'no outer contour'}
   r += cont_dict[s % 10] + ' ';
   
-  peak_dict = {0 : 'no peaks', 1 : 'multiple peaks (head tail hint)', 2 : 'multiple peaks (max)', 3: 'single peak (head tail hint)', 4 : 'single peak (half way)', 5 : 'no peaks (head tail hint)', 6: 'no peaks (0,n/2)'};
-  r += peak_dict[s/100 % 10];
+  peak_dict = {0 : 'no peaks', 1 : 'multiple peaks (head tail hint)', 2 : 'multiple peaks (max)', 3: 'single peak (head tail hint)', 4 : 'single peak (half way)', 5 : 'no peaks (head tail hint)', 6: 'no peaks (0,n/2)', 7 : 'skeleton end points'};
+  r += peak_dict[s//100 % 10];
   
-  if s/1000 > 0:
+  if s//1000 % 10 > 0:
     r += ' (reduced peak detection)';
-  if s/10000 > 0:
+  if s//10000 % 10 > 0:
     r += ' (reduced threshold)';
   
   return r;
@@ -277,7 +280,8 @@ def shape_from_image(image, sigma = 1, absolute_threshold = None, threshold_fact
     arrays (npointsx2): center, left, right side lines of the worm
     
   Note:
-    This is a fast way to detect the worm shape, fails for worms intersecting themselves
+    This is a fast way to detect the worm shape, fails for worms intersecting themselves.
+    Failures are encoded as -1-s with s the status reached before failing (see :func:`status`).
   """
   
   ### smooth image
@@ -310,7 +314,7 @@ def shape_from_image(image, sigma = 1, absolute_threshold = None, threshold_fact
       status += 10000; # indicate we reduced the threshold !
     
     if len(pts) == 0: # we cannot find the worm and give up...      
-      return -1-status, np.zeros((npoints,2)), np.zeros((npoints,2), np.zeros((npoints,2)), np.zeros(npoints))
+      return -1-status, np.zeros((ncontour,2)), np.zeros((ncontour,2)), np.zeros((npoints,2)), np.zeros(npoints)
 
   
   if len(pts) == 1:
@@ -326,7 +330,7 @@ def shape_from_image(image, sigma = 1, absolute_threshold = None, threshold_fact
     #print outer
     
     if len(outer) == 0: # we cannot find the worm and give up...      
-      return -2-status, np.zeros((npoints,2)), np.zeros((npoints,2), np.zeros((npoints,2)), np.zeros(npoints))
+      return -1-(status+6), np.zeros((ncontour,2)), np.zeros((ncontour,2)), np.zeros((npoints,2)), np.zeros(npoints)
     
     elif len(outer) == 1:
       pts = pts[outer[0]]; # only one outer contour (worm mostlikely curled)
@@ -597,3 +601,414 @@ def shape_from_image(image, sigma = 1, absolute_threshold = None, threshold_fact
   #success = pts_inner is None;
   return status, left, right, center, width
 
+
+
+
+##############################################################################
+### Shape Tracking
+
+
+def contour_from_sides(left, right):
+  """Closed contour from the left and right side lines of a shape
+  
+  Arguments:
+    left, right (nx2 arrays): side lines both running from head to tail
+  
+  Returns:
+    mx1x2 array: contour in the format used by cv2
+  """
+  cnt = np.vstack([left, right[-2:0:-1]]);
+  return np.asarray(cnt, dtype = 'float32').reshape(-1,1,2);
+
+
+def shape_consistent(center, width, previous_center, previous_width = None,
+                     max_displacement = 10.0, max_head_tail_displacement = 15.0, max_length_change = 0.2):
+  """Cheap check if a detected shape is consistent with the shape in the previous frame
+  
+  Arguments:
+    center (nx2 array): center line of the current shape
+    width (n array): width profile of the current shape
+    previous_center (nx2 array): center line of the previous shape
+    previous_width (n array or None): width profile of the previous shape
+    max_displacement (float): maximal displacement of the mid point of the center line
+    max_head_tail_displacement (float): maximal displacement of the head and tail
+    max_length_change (float): maximal relative change in length and mean width
+  
+  Returns:
+    bool: True if the shape is consistent with the previous shape
+  """
+  n2 = (center.shape[0]-1)//2;
+  if np.linalg.norm(center[n2] - previous_center[n2]) > max_displacement:
+    return False;
+  
+  if np.any(np.linalg.norm(center[[0,-1]] - previous_center[[0,-1]], axis = 1) > max_head_tail_displacement):
+    return False;
+  
+  l = wgeo.length_from_center_discrete(center);
+  l0 = wgeo.length_from_center_discrete(previous_center);
+  if l0 <= 0 or np.abs(l - l0) > max_length_change * l0:
+    return False;
+  
+  if previous_width is not None:
+    w = np.mean(width); w0 = np.mean(previous_width);
+    if w0 <= 0 or np.abs(w - w0) > max_length_change * w0:
+      return False;
+  
+  return True;
+
+
+def shape_from_image_tracked(image, previous = None, 
+                             max_displacement = 10.0, max_head_tail_displacement = 15.0, max_length_change = 0.2,
+                             with_tracked = False, verbose = False, **kwargs):
+  """Detect the worm shape using the shape in the previous frame as initial guess
+  
+  Arguments:
+    image (array): the image to detect worm from
+    previous (tuple or None): result of :func:`shape_from_image` or of this function for the previous frame
+    max_displacement, max_head_tail_displacement, max_length_change (float): parameter for :func:`shape_consistent`
+    with_tracked (bool): if True also return if the tracked shape was accepted
+    verbose (bool): plot results
+    **kwargs: parameter passed to :func:`shape_from_image`
+  
+  Returns:
+    status (int): status as in :func:`shape_from_image`
+    arrays (npointsx2): left, right, center, width as in :func:`shape_from_image`
+    tracked (bool): True if the tracked shape was accepted
+    
+  Note:
+    The head and tail of the previous center line are used as head tail hint, 
+    its contour to choose among multiple contours and its orientation fixes 
+    head and tail, thus the reduced peak detection is skipped. If the result 
+    is not consistent with the previous shape (see :func:`shape_consistent`) 
+    the full detector without hints is used instead. The status codes of 
+    tracked and untracked shapes are the same, use with_tracked to distinguish 
+    them.
+    The previous shape only provides hints, the contour, peak and center line 
+    detection are still done in full. Tracking is thus not faster than 
+    :func:`shape_from_image` and rejected frames are detected twice.
+  """
+  if previous is not None and previous[0] >= 0:
+    p_status, p_left, p_right, p_center, p_width = previous[:5];
+    
+    kwargs_tracked = kwargs.copy();
+    kwargs_tracked.update(head_tail_hint = p_center[[0,-1]], contour_hint = contour_from_sides(p_left, p_right), delta_reduce = None);
+    res = shape_from_image(image, verbose = verbose, **kwargs_tracked);
+    
+    if res[0] >= 0 and shape_consistent(res[3], res[4], p_center, p_width, 
+                                        max_displacement = max_displacement, 
+                                        max_head_tail_displacement = max_head_tail_displacement,
+                                        max_length_change = max_length_change):
+      return res + (True,) if with_tracked else res;
+    
+    if verbose:
+      print('Tracking failed, using full shape detection!');
+  
+  res = shape_from_image(image, verbose = verbose, **kwargs);
+  return res + (False,) if with_tracked else res;
+
+
+
+##############################################################################
+### Skeleton Fast Path
+
+
+def _width_from_distance(dist, xy):
+  """Width along a line from the distance transform of the foreground"""
+  maps = np.asarray(xy.reshape(1,-1,2), dtype = 'float32');
+  d = np.asarray(cv2.remap(dist, maps[...,0], maps[...,1], cv2.INTER_LINEAR)[0], dtype = float);
+  # the distance transform measures to the centers of the background pixels
+  return np.clip(2 * d - 1, 0, None);
+
+
+def centerline_from_skeleton(image, sigma = 1, absolute_threshold = None, threshold_factor = 0.95,
+                             ncontour = 100, npoints = 21, smooth = 1.0, min_size = 20, head_tail_hint = None, verbose = False):
+  """Detect the worm shape of uncurled worms via the medial axis of the thresholded image
+  
+  Arguments:
+    image (array): the image to detect worm from
+    sigma (float or None): width of Gaussian smoothing on image, if None use raw image
+    absolute_threshold (float or None): if set use this as the threshold, if None the threshold is set via Otsu
+    threshold_factor (float): in case the threshold is determined by Otsu multiply by this factor
+    ncontour (int): number of vertices in the side lines
+    npoints (int): number of vertices in the center line and width profile
+    smooth (float or None): width of the Gaussian smoothing of the skeleton pixels along the line
+    min_size (int): minimal number of pixels of the worm
+    head_tail_hint (2x2 array or None): approximate head and tail positions used to orient the center line
+    verbose (bool): plot results
+  
+  Returns:
+    status (int): status as in :func:`shape_from_image`, 701 if successful
+    arrays (npointsx2): left, right, center, width as in :func:`shape_from_image`
+    quality (float): overlap (intersection over union) of the detected shape with the thresholded worm
+    
+  Note:
+    The skeleton of the largest foreground component is ordered into a line 
+    and extended at both ends by the distance to the boundary to reach head 
+    and tail. The width is read from the distance transform along the center 
+    line. Branched skeletons are reduced to their longest path, skeletons with 
+    loops fail with quality 0. Low quality indicates a shape that should be 
+    passed to :func:`shape_from_image`.
+  """
+  
+  ### smooth image
+  if sigma is not None:
+    imgs = cv2.GaussianBlur(np.asarray(image, dtype = float), ksize = (sigma, sigma), sigmaX = 0);
+  else:
+    imgs = image;
+  
+  if absolute_threshold is not None:
+    level = absolute_threshold;
+  else:
+    level = threshold_factor * threshold_otsu(imgs);
+  
+  failed = (np.zeros((ncontour,2)), np.zeros((ncontour,2)), np.zeros((npoints,2)), np.zeros(npoints), 0.0);
+  
+  ### largest foreground component
+  mask = np.asarray(imgs >= level, dtype = 'uint8');
+  ncomponents, labels, stats = cv2.connectedComponentsWithStats(mask, connectivity = 8)[:3];
+  if ncomponents <= 1:
+    return (-1,) + failed;
+  imax = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA]);
+  if stats[imax, cv2.CC_STAT_AREA] < min_size:
+    return (-1,) + failed;
+  
+  # crop to the worm
+  x0, y0, w, h = stats[imax, :4];
+  x0 = max(x0 - 2, 0); y0 = max(y0 - 2, 0);
+  offset = np.array([x0, y0], dtype = float);
+  mask = np.asarray(labels[y0:y0+h+4, x0:x0+w+4] == imax, dtype = 'uint8');
+  status = 1;
+  
+  ### skeleton as ordered line
+  line = skeleton_to_line(skeletonize(mask > 0), prune = True);
+  if line is None or len(line) < 2:
+    return (-1-status,) + failed;
+  status += 700;
+  
+  dist = cv2.distanceTransform(mask, cv2.DIST_L2, 5);
+  radius = dist[line[[0,-1],0], line[[0,-1],1]];
+  
+  xy = np.asarray(line[:,::-1], dtype = float);
+  if smooth is not None and smooth > 0:
+    xy = filters.gaussian_filter1d(xy, smooth, axis = 0, mode = 'nearest');
+  
+  # extend to head and tail along the end tangents
+  nt = min(3, len(xy)-1);
+  ends = [];
+  for e, d, r in [(xy[0], xy[0] - xy[nt], radius[0]), (xy[-1], xy[-1] - xy[-1-nt], radius[1])]:
+    nd = np.linalg.norm(d);
+    ends.append(e + r * d / nd if nd > 0 else e);
+  xy = np.vstack([ends[0], xy, ends[1]]);
+  
+  ### center, width and sides
+  xy = resample_arc_length(xy, npoints = ncontour, method = 'linear');
+  width = _width_from_distance(dist, xy);
+  left, right = wgeo.shape_from_center_discrete_batch(xy, width);
+  
+  center = resample_arc_length(xy, npoints = npoints, method = 'linear');
+  width = _width_from_distance(dist, center);
+  
+  ### quality as overlap with the foreground
+  shape = np.zeros(mask.shape, dtype = 'uint8');
+  cnt = np.asarray(np.round(16 * contour_from_sides(left, right)), dtype = 'int32');
+  cv2.fillPoly(shape, [cnt], 1, lineType = cv2.LINE_8, shift = 4);
+  union = np.count_nonzero(np.logical_or(shape, mask));
+  quality = np.count_nonzero(np.logical_and(shape, mask)) / float(union) if union > 0 else 0.0;
+  
+  left += offset; right += offset; center += offset;
+  
+  if head_tail_hint is not None:
+    ht = np.asarray(head_tail_hint, dtype = float);
+    if np.sum(np.linalg.norm(center[[-1,0]] - ht, axis = 1)) < np.sum(np.linalg.norm(center[[0,-1]] - ht, axis = 1)):
+      left, right, center, width = right[::-1], left[::-1], center[::-1], width[::-1];
+  
+  if verbose:
+    plt.imshow(imgs, cmap = 'gray', interpolation = 'none');
+    plt.plot(line[:,1] + offset[0], line[:,0] + offset[1], '.y');
+    plt.plot(left[:,0], left[:,1], 'g');
+    plt.plot(right[:,0], right[:,1], 'y');
+    plt.plot(center[:,0], center[:,1], 'b');
+    plt.title('skeleton (quality %.2f)' % quality);
+  
+  return status, left, right, center, width, quality;
+
+
+
+##############################################################################
+### Routing of Frames
+
+
+route_dict = {0 : 'no worm', 1 : 'easy (fast detection)', 2 : 'hard (full detection)'};
+"""Description of the routes returned by :func:`route_from_image`"""
+
+
+def shape_features_from_image(image, level, min_size = 20, min_defect_depth = 0.5):
+  """Cheap features of the thresholded worm image used to classify frames
+  
+  Arguments:
+    image (array): the (smoothed) image to detect worm from
+    level (float): threshold level for the worm
+    min_size (float): minimal area of a contour to be counted
+    min_defect_depth (float): minimal depth of convexity defects to be counted relative to the width estimate
+  
+  Returns:
+    dict: features 'ncontours' (number of outer contours), 'nholes' (number of inner contours),
+          'area', 'perimeter', 'compactness' (4 pi area / perimeter^2), 
+          'thickness' (2 area / perimeter, width estimate for a thin worm),
+          'ndefects' (number of convexity defects deeper than min_defect_depth * thickness) 
+          and 'self_intersection' (True if the contour of the worm intersects itself)
+  
+  Note:
+    The features are based on the cv2 contours of the thresholded image
+    and are orders of magnitudes faster than the full shape detection.
+  """
+  mask = np.asarray(image >= level, dtype = 'uint8');
+  contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)[-2:];
+  
+  features = dict(ncontours = 0, nholes = 0, area = 0.0, perimeter = 0.0, compactness = 0.0, 
+                  thickness = 0.0, ndefects = 0, self_intersection = False);
+  if len(contours) == 0:
+    return features;
+  hierarchy = hierarchy[0];
+  
+  areas = np.array([cv2.contourArea(c) for c in contours]);
+  outer = np.where(np.logical_and(hierarchy[:,3] < 0, areas > min_size))[0];
+  features['ncontours'] = len(outer);
+  if len(outer) == 0:
+    return features;
+  
+  # largest outer contour is the worm
+  imax = outer[np.argmax(areas[outer])];
+  cnt = contours[imax];
+  holes = np.where(np.logical_and(hierarchy[:,3] == imax, areas > 0))[0];
+  features['nholes'] = len(holes);
+  
+  area = areas[imax] - np.sum(areas[holes]);
+  perimeter = cv2.arcLength(cnt, True) + np.sum([cv2.arcLength(contours[h], True) for h in holes]);
+  features['area'] = area;
+  features['perimeter'] = perimeter;
+  if perimeter > 0:
+    features['compactness'] = 4 * np.pi * area / perimeter**2;
+    features['thickness'] = 2.0 * area / perimeter;
+  
+  # contour passing a pixel twice indicates touching body parts
+  features['self_intersection'] = len(np.unique(cnt[:,0,:], axis = 0)) < len(cnt);
+  
+  if len(cnt) > 3:
+    hull = cv2.convexHull(cnt, returnPoints = False);
+    try:
+      defects = cv2.convexityDefects(cnt, hull);
+    except cv2.error: # non-monotonous hull indices for self-touching contours
+      defects = None;
+      features['self_intersection'] = True;
+    if defects is not None:
+      depth = defects.reshape(-1,4)[:,3] / 256.0;
+      features['ndefects'] = int(np.sum(depth > min_defect_depth * features['thickness']));
+  
+  return features;
+
+
+def route_from_image(image, level, max_contours = 1, max_holes = 0, max_compactness = 0.35, max_defects = 4, 
+                     with_features = False, **kwargs):
+  """Classify a frame into easy and hard to detect worm shapes
+  
+  Arguments:
+    image (array): the (smoothed) image to detect worm from
+    level (float): threshold level for the worm
+    max_contours (int): maximal number of outer contours for an easy frame
+    max_holes (int): maximal number of holes in the worm contour for an easy frame
+    max_compactness (float): maximal compactness (4 pi area / perimeter^2) for an easy frame
+    max_defects (int): maximal number of deep convexity defects for an easy frame
+    with_features (bool): if True also return the features
+    **kwargs: parameter passed to :func:`shape_features_from_image`
+  
+  Returns:
+    int: route, 0 no worm, 1 easy frame, 2 hard frame (see :const:`route_dict`)
+    dict: features (see :func:`shape_features_from_image`)
+  
+  Note:
+    Simply bent worms have a single elongated contour without holes. Curled, 
+    coiled and omega shapes form holes, touch themselves or have more compact 
+    contours with many convexity defects and are send to the full detection.
+  """
+  features = shape_features_from_image(image, level, **kwargs);
+  
+  if features['ncontours'] == 0:
+    route = 0;
+  elif (features['ncontours'] > max_contours or features['nholes'] > max_holes or 
+        features['compactness'] > max_compactness or features['ndefects'] > max_defects or
+        features['self_intersection']):
+    route = 2;
+  else:
+    route = 1;
+  
+  if with_features:
+    return route, features;
+  else:
+    return route;
+
+
+def shape_from_image_routed(image, absolute_threshold = None, threshold_factor = 0.95, previous = None, 
+                            route_parameter = None, skeleton = True, min_quality = 0.85, with_tracked = False, verbose = False, **kwargs):
+  """Detect the worm shape using a fast path for easy frames and the full detection for hard frames
+  
+  Arguments:
+    image (array): the (smoothed) image to detect worm from
+    absolute_threshold (float or None): if set use this as the threshold, if None the threshold is set via Otsu
+    threshold_factor (float): in case the threshold is determined by Otsu multiply by this factor
+    previous (tuple or None): result of the previous frame used for tracking (see :func:`shape_from_image_tracked`)
+    route_parameter (dict or None): parameter passed to :func:`route_from_image`
+    skeleton (bool): if True try :func:`centerline_from_skeleton` first for easy frames
+    min_quality (float): minimal quality of the skeleton shape to be accepted
+    with_tracked (bool): if True also return if the tracked shape was accepted (see :func:`shape_from_image_tracked`)
+    verbose (bool): plot results
+    **kwargs: parameter passed to :func:`shape_from_image_tracked`
+  
+  Returns:
+    route (int): the route taken, 0 no worm, 1 fast detection, 2 full detection (see :const:`route_dict`)
+    status (int), arrays (npointsx2): left, right, center, width as in :func:`shape_from_image`
+    tracked (bool): True if the tracked shape was accepted
+  
+  Note:
+    Easy frames are detected via the medial axis (:func:`centerline_from_skeleton`) 
+    which is accepted if its quality is at least min_quality. This is about ten times 
+    faster than :func:`shape_from_image`. Otherwise easy frames are detected without 
+    the failure recoveries of :func:`shape_from_image` (reduced threshold and reduced 
+    peak detection), which are rarely triggered by easy frames, thus with skeleton 
+    False routing gives no speedup. If the fast detection fails the frame is 
+    rerouted to the full detection. Frames without worm at the threshold level are 
+    passed to the full detection as well to try the reduced threshold.
+  """
+  sigma = kwargs.get('sigma', 1);
+  if sigma is not None:
+    imgs = cv2.GaussianBlur(np.asarray(image, dtype = float), ksize = (sigma, sigma), sigmaX = 0);
+  else:
+    imgs = image;
+  
+  if absolute_threshold is None:
+    absolute_threshold = threshold_factor * threshold_otsu(imgs);
+  
+  if route_parameter is None:
+    route_parameter = {};
+  route = route_from_image(imgs, absolute_threshold, **route_parameter);
+  
+  if route == 1 and skeleton:
+    head_tail_hint = previous[3][[0,-1]] if previous is not None and previous[0] >= 0 else None;
+    res = centerline_from_skeleton(image, sigma = sigma, absolute_threshold = absolute_threshold,
+                                   ncontour = kwargs.get('ncontour', 100), npoints = kwargs.get('npoints', 21),
+                                   head_tail_hint = head_tail_hint, verbose = verbose);
+    if res[0] >= 0 and res[-1] >= min_quality:
+      return (route,) + tuple(res[:-1]) + ((False,) if with_tracked else ());
+  
+  if route == 1:
+    kwargs_fast = kwargs.copy();
+    kwargs_fast.update(threshold_reduce = None, delta_reduce = None);
+    res = shape_from_image_tracked(image, previous = previous, absolute_threshold = absolute_threshold, 
+                                   with_tracked = with_tracked, verbose = verbose, **kwargs_fast);
+    if res[0] >= 0:
+      return (route,) + tuple(res);
+    route = 2;
+  
+  res = shape_from_image_tracked(image, previous = previous, absolute_threshold = absolute_threshold, 
+                                 with_tracked = with_tracked, verbose = verbose, **kwargs);
+  return (route,) + tuple(res);
@@ -23,13 +23,14 @@ import cv2
 from scipy.interpolate import splprep, splev #,splrep,
 
 import worm.geometry as wormgeo
+import worm.costs as wormcosts
 
 from interpolation.spline import Spline
 from interpolation.curve import Curve
 from interpolation.resampling import resample as resample_curve
 
 
-from imageprocessing.masking import mask_to_phi #, curvature_from_phi
+from imageprocessing.masking import mask_to_phi, mask_to_phi_band, mask_from_polygon #, curvature_from_phi
 #from utils.utils import isnumber, eps
 
 
@@ -211,22 +212,81 @@ class WormModel(object):
     #self.length = wormgeo.length_from_center_discrete(self.center);
     
   def from_image(self, image, sigma = 1, absolute_threshold = None, threshold_factor = 0.95, 
-                       ncontour = 100, delta = 0.3, smooth = 1.0,
-                       verbose = False, save = None):
+                       ncontour = 100, delta = 0.3, smooth = 1.0, multiscale = False, frame = None,
+                       library = None, templates = None, nstarts = 5, verbose = False, save = None):
+    """Infer the worm shape from an image
     
+    Arguments:
+      image (array): the image
+      sigma, absolute_threshold, threshold_factor, ncontour, delta, smooth: see :func:`worm.geometry.shape_from_image`
+      multiscale (bool or dict): if not False refine the shape by a coarse to fine fit to the image, 
+                                 a dict is passed as arguments to :meth:`fit_image`
+      frame (hashable or None): frame id to cache the image pyramid of the multiscale fit
+      library (PostureLibrary or None): if not None also start the multiscale fit from the best matching postures
+      templates (TemplateBank or None): if not None also start the multiscale fit from the best matching templates
+      nstarts (int): number of postures from the library and templates to start from
+    
+    Note:
+      If the shape detection fails the multiscale fit starts from the current shape.
+      A posture library or template bank implies the multiscale fit.
+    """
     success, center, left, right, width = wormgeo.shape_from_image(image, 
                              sigma = sigma, absolute_threshold = absolute_threshold,
                              threshold_factor = threshold_factor, ncontour = ncontour, 
-                             delta = delta, smooth = smooth,
+                             delta = delta, smooth_head_tail = smooth,
                              npoints = self.npoints, 
                              verbose = verbose, save = save);
     
-    if success:
+    if success >= 0:
       #self.from_lines(shape[1], shape[2], shape[3]);
       self.from_center(center, width);
       self.set_length();
-    else:
+    elif multiscale is False and library is None and templates is None:
       raise RuntimeWarning('failed inferring worm from image');
+    
+    starts = [];
+    if library is not None and len(library) > 0:
+      starts.append(library.match(image, k = nstarts, sigma = sigma, absolute_threshold = absolute_threshold, 
+                                  threshold_factor = threshold_factor)[2:]);
+    if templates is not None:
+      center, width = templates.starts(image, k = nstarts, sigma = sigma, absolute_threshold = absolute_threshold, 
+                                       threshold_factor = threshold_factor);
+      starts.append((center[0], width[0]));
+    if len(starts) > 0:
+      starts = (np.concatenate([st[0] for st in starts]), np.concatenate([st[1] for st in starts]));
+      if multiscale is False:
+        multiscale = True;
+    else:
+      starts = None;
+    
+    if multiscale is not False:
+      options = multiscale if isinstance(multiscale, dict) else {};
+      self.fit_image(image, sigma = sigma, absolute_threshold = absolute_threshold, 
+                     threshold_factor = threshold_factor, frame = frame, starts = starts, **options);
+  
+  
+  def fit_image(self, image, scales = (4,2,1), frame = None, starts = None, **kwargs):
+    """Fit the worm shape to an image coarse to fine on an image pyramid
+    
+    Arguments:
+      image (array): the image
+      scales (tuple): downsampling factors of the pyramid levels from coarse to fine
+      frame (hashable or None): frame id to cache the image pyramid
+      starts (tuple or None): center lines (Bxnx2) and widths (Bxn) of further initial shapes
+      kwargs: further arguments passed to :func:`worm.costs.fit_image_multiscale`
+    
+    Returns:
+      float: cost of the fitted shape at the finest level
+    """
+    center, width = self.center, self.width;
+    if starts is not None:
+      center = np.concatenate([center[np.newaxis], starts[0]]);
+      width = np.concatenate([width[np.newaxis], starts[1]]);
+    center, width, cost = wormcosts.fit_image_multiscale(center, width, image, scales = scales, 
+                                                         frame = frame, **kwargs);
+    self.from_center(center, width);
+    self.set_length();
+    return cost;
       
       
   def distance_to_contour(self, contour,  search_radius=[5,20], min_alignment = 0, match_head_tail = None, with_points = False, verbose = False):
@@ -376,21 +436,15 @@ class WormModel(object):
       array: mask of worm shape
     """
     
-    mask = np.zeros(tuple(size));
-    left, right = self.shape();
-    
-    for i in range(self.npoints-1):
-      poly = np.array([left[i,:], right[i,:], right[i+1,:], left[i+1,:]], dtype = np.int32)
-      cv2.fillPoly(mask, [poly], 1);
-    
-    return np.asarray(mask, dtype = bool)
+    return mask_from_polygon(self.polygon(), size);
   
   
-  def phi(self, size = (151, 151)):
+  def phi(self, size = (151, 151), band = all):
     """Returns implicit contour representation of the worm shape
     
     Arguments:
       size (tuple ro array): size of the contour representation
+      band (int or all): if not all only calculate the representation in a narrow band around the border
     
     Returns:
       array:  contour representation of the worm
@@ -399,7 +453,10 @@ class WormModel(object):
       worm border is given by phi==0
     """
     
-    return mask_to_phi(self.mask(size = size));  
+    if band is all:
+      return mask_to_phi(self.mask(size = size));
+    else:
+      return mask_to_phi_band(self.mask(size = size), band = band);  
   
   
   def head(self):
@@ -606,6 +663,279 @@ class WormModel(object):
 
 
 
+class WormModelBatch(object):
+  """Class modeling the shapes of many worms in contiguous arrays
+  
+  Note:
+    The center lines, widths, lengths and speeds of B worms are stored in 
+    arrays of shape (B,npoints,2), (B,npoints), (B,) and (B,) so that
+    shapes, deformations and costs of many candidate models can be evaluated
+    in single numpy calls, e.g. for population based or multi start optimization.
+  """
+  
+  def __init__(self, center = None, width = None, xy = [75, 75], length = 50,
+               npoints = 21, nmodels = 1):
+    """Constructor of WormModelBatch
+    
+    Arguments:
+      center (Bxnx2 array, list of WormModel or None): center lines or models (if None straight worms)
+      width (Bxn array, n array or None): width profiles (if none use default profile)
+      xy (2 array): position of the worms if center is None
+      length (number or B array): length of the center lines of the worms [in pixel]
+      npoints (int): number of sample points along the center line if center is None
+      nmodels (int): number of worms if center is None
+    """
+    if isinstance(center, list) and len(center) > 0 and isinstance(center[0], WormModel):
+      self.from_models(center);
+      return;
+    
+    if center is None:
+      center = np.vstack([np.linspace(0,1,npoints), np.zeros(npoints)]).T + xy;
+      center = np.repeat(center[np.newaxis], nmodels, axis = 0);
+    self.center = np.array(center, dtype = float);
+    nmodels, self.npoints = self.center.shape[:2];
+    
+    if width is None:
+      width = wormgeo.default_width(self.npoints);
+    width = np.array(width, dtype = float);
+    if width.ndim == 1:
+      width = np.repeat(width[np.newaxis], nmodels, axis = 0);
+    self.width = width;
+    
+    if self.npoints != self.width.shape[1]:
+      raise ValueError('Number of sample points along center line %d does not match sample points for width %d' % (self.npoints, self.width.shape[1]) );
+    
+    self.length = np.ones(nmodels) * length;
+    self.speed = np.zeros(nmodels);
+    
+    self.nparameter = 2 * self.npoints;
+  
+  
+  def from_models(self, models):
+    """Initialize the batch from a list of worm models"""
+    self.center = np.array([m.center for m in models], dtype = float);
+    self.width = np.array([m.width for m in models], dtype = float);
+    self.length = np.array([m.length for m in models], dtype = float).flatten();
+    self.speed = np.array([m.speed for m in models], dtype = float).flatten();
+    self.npoints = self.center.shape[1];
+    self.nparameter = 2 * self.npoints;
+  
+  
+  def model(self, i):
+    """Returns the i-th worm as a WormModel"""
+    w = WormModel(center = self.center[i].copy(), width = self.width[i].copy(), length = self.length[i]);
+    w.speed = self.speed[i];
+    return w;
+  
+  def models(self):
+    """Returns list of WormModels"""
+    return [self.model(i) for i in range(len(self))];
+  
+  def __len__(self):
+    return self.center.shape[0];
+  
+  def __getitem__(self, index):
+    """Returns a batch of the selected worms, slices share memory with this batch"""
+    if isinstance(index, (int, np.integer)):
+      index = slice(index, index + 1);
+    b = WormModelBatch.__new__(WormModelBatch);
+    b.center = self.center[index];
+    b.width = self.width[index];
+    b.length = self.length[index];
+    b.speed = self.speed[index];
+    b.npoints = self.npoints;
+    b.nparameter = self.nparameter;
+    return b;
+  
+  def copy(self):
+    b = self[:];
+    b.center = b.center.copy();
+    b.width = b.width.copy();
+    b.length = b.length.copy();
+    b.speed = b.speed.copy();
+    return b;
+  
+  
+  ############################################################################
+  ### Parameter interface
+  
+  def get_parameter(self):
+    """Parameter of the worm shapes as Bxnparameter array"""
+    return np.reshape(self.center, (len(self), -1));
+  
+  def set_parameter(self, parameter):
+    """Set the parameter from a Bxnparameter array"""
+    self.center = np.reshape(np.array(parameter[:,:2 * self.npoints], dtype = float), (-1, self.npoints, 2));
+  
+  def set_length(self, length = None):
+    if length is None:
+      self.length = np.sum(np.linalg.norm(np.diff(self.center, axis = 1), axis = 2), axis = 1);
+    else:
+      self.length = np.ones(len(self)) * length;
+  
+  
+  ############################################################################
+  ### Shape Properties
+  
+  def normals(self):
+    """Return normals along center lines"""
+    return wormgeo.normals_from_center_discrete_batch(self.center);
+  
+  def theta(self):
+    return wormgeo.theta_from_center_discrete_batch(self.center);
+  
+  def shape(self, with_center = False, with_normals = False, with_width = False):
+    """Returns left and right side and center line of the worms
+    
+    Arguments:
+      with_center (bool): if true also return center points
+      with_normals (bool): if true also return normals along center points
+      with_width (bool): if true also return width profile
+      
+    Returns:
+      array (Bxnx2): points along left sides
+      array (Bxnx2): points along right sides
+      array (Bxnx2): points along center lines
+      array (Bxnx2): normals along center points
+      array (Bxn): width profiles
+    """
+    left, right, normals = wormgeo.shape_from_center_discrete_batch(self.center, self.width, with_normals = True);
+    res = [left, right];
+    if with_center:
+      res.append(self.center);
+    if with_normals:
+      res.append(normals);
+    if with_width:
+      res.append(self.width);
+    return tuple(res);
+  
+  def left(self):
+    return self.shape()[0];
+  
+  def right(self):
+    return self.shape()[1];
+  
+  def polygon(self):
+    """Returns polygons for the worm outlines as Bx2nx2 array"""
+    left, right = self.shape();
+    return np.concatenate([left, right[:,::-1,:]], axis = 1);
+  
+  def head(self):
+    return self.center[:,0];
+  
+  def tail(self):
+    return self.center[:,-1];
+  
+  def mask(self, size = (151, 151)):
+    """Returns binary masks for the worm shapes as Bxhxw array"""
+    return mask_from_polygon(self.polygon(), size);
+  
+  def phi(self, size = (151, 151), band = all):
+    """Returns implicit contour representations of the worm shapes
+    
+    Arguments:
+      size (tuple ro array): size of the contour representations
+      band (int or all): if not all only calculate the representations in a narrow band around the borders
+    
+    Returns:
+      array:  Bxhxw contour representations of the worms
+    """
+    return mask_to_phi_band(self.mask(size = size), band = band);
+  
+  def self_occlusions(self, margin = 0.01):
+    """Returns left and right Bxn arrays of bools indicating occluded points"""
+    left, right = self.shape();
+    return wormgeo.self_occlusions_from_shape_discrete_batch(left, right, margin = margin);
+  
+  
+  ############################################################################
+  ### Costs
+  
+  def cost(self, skeleton, weight_distances = 1.0):
+    """Skeleton cost as in :func:`worm.costs.cost_func` for all worms
+    
+    Arguments:
+      skeleton (mx2 or Bxmx2 array): skeleton points
+      weight_distances (float): weight of the spacing cost
+    
+    Returns:
+      B array: costs
+    """
+    return wormcosts.cost_func_batch(self.center, self.length, skeleton, weight_distances = weight_distances);
+  
+  
+  ############################################################################
+  ### Worm shape deformations, Worm motions
+  
+  def translate(self, xy):
+    """Translate worms by 2 or Bx2 translation vectors"""
+    self.center += np.reshape(xy, (-1,1,2));
+  
+  def rotate(self, angle, center = [75,75]):
+    """Rotate worms by float or B array of angles around a center point"""
+    angle = np.reshape(angle, (-1,1));
+    c = np.cos(angle); s = np.sin(angle);
+    d = self.center - center;
+    self.center = np.stack([c * d[...,0] - s * d[...,1], s * d[...,0] + c * d[...,1]], axis = -1) + center;
+  
+  def move_forward(self, distance):
+    """Move worms peristaltically forward
+    
+    Arguments:
+      distance (number or B array): distance to move forward in units of the worm length
+    
+    Note:
+      Uses linear interpolation along the center lines, 
+      see :func:`worm.geometry.move_forward_center_discrete_batch`.
+    """
+    self.center = wormgeo.move_forward_center_discrete_batch(distance, self.center);
+  
+  def stretch(self, factor):
+    """Change lengths of the worms by float or B array of factors"""
+    n2 = (self.npoints-1)//2;
+    p0 = self.center[:,n2:n2+1,:];
+    self.center = np.reshape(factor, (-1,1,1)) * (self.center - p0) + p0;
+  
+  def widen(self, factor):
+    """Change widths of the worms by float or B array of factors"""
+    self.width = self.width * np.reshape(factor, (-1,1));
+  
+  def bend(self, bend, exponent = 4, head = True):
+    """Change curvature properties of the worms
+    
+    Arguments:
+      bend (number or B array): bending amplitudes
+      exponent (number): expoential modulation of the bending
+      head (bool): if True bend head side otherwise tail side
+    """
+    theta, orientation, xy, length = wormgeo.theta_from_center_discrete_batch(self.center);
+    n2 = theta.shape[1]//2;
+    bend = np.reshape(bend, (-1,1));
+    
+    if head:
+      theta[:,:n2-1] += bend * np.exp(-exponent * np.linspace(0,1,n2-1));
+    else:
+      theta[:,-(n2-1):] += bend * np.exp(-exponent * np.linspace(1,0,n2-1));
+    
+    self.center = wormgeo.center_from_theta_discrete_batch(theta, orientation, xy, length);
+  
+  
+  ############################################################################
+  ### Visualization
+  
+  def plot(self, image = None, color = None, ax = None, cmap = 'nipy_spectral'):
+    if ax is None:
+      ax = plt.gca();
+    if image is not None:
+      ax.imshow(image, cmap = cmap, interpolation = 'none');
+    left, right = self.shape();
+    for l, r, c in zip(left, right, self.center):
+      ax.plot(l[:,0], l[:,1], 'green' if color is None else color);
+      ax.plot(r[:,0], r[:,1], 'red' if color is None else color);
+      ax.plot(c[:,0], c[:,1], 'black' if color is None else color);
+
+
+
 ### Tests
 
 
@@ -629,6 +959,14 @@ def test():
   plt.figure(2); plt.clf();
   w.plot();
   plt.axis('equal')
+  
+  # many worms at once
+  b = wm.WormModelBatch(npoints = 21, nmodels = 10);
+  b.bend(np.linspace(-2,2,10));
+  b.move_forward(0.1);
+  plt.figure(3); plt.clf();
+  b.plot();
+  plt.axis('equal')
 
 
 if __name__ == "__main__":
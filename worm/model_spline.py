@@ -65,7 +65,7 @@ from interpolation.curve import Curve
 from interpolation.resampling import resample as resample_curve
 
 
-from imageprocessing.masking import mask_to_phi #, curvature_from_phi
+from imageprocessing.masking import mask_to_phi, mask_to_phi_band, mask_from_polygon #, curvature_from_phi
 #from utils.utils import isnumber, eps
 
 
@@ -435,21 +435,15 @@ class WormModel(object):
       array: mask of worm shape
     """
     
-    mask = np.zeros(tuple(size));
-    left, right = self.shape();
-    
-    for i in range(self.npoints-1):
-      poly = np.array([left[i,:], right[i,:], right[i+1,:], left[i+1,:]], dtype = np.int32)
-      cv2.fillPoly(mask, [poly], 1);
-    
-    return np.asarray(mask, dtype = bool)
+    return mask_from_polygon(self.polygon(), size);
   
   
-  def phi(self, size = (151, 151)):
+  def phi(self, size = (151, 151), band = all):
     """Returns implicit contour representation of the worm shape
     
     Arguments:
       size (tuple ro array): size of the contour representation
+      band (int or all): if not all only calculate the representation in a narrow band around the border
     
     Returns:
       array:  contour representation of the worm
@@ -458,7 +452,10 @@ class WormModel(object):
       worm border is given by phi==0
     """
     
-    return mask_to_phi(self.mask(size = size));  
+    if band is all:
+      return mask_to_phi(self.mask(size = size));
+    else:
+      return mask_to_phi_band(self.mask(size = size), band = band);  
       
   def head(self):
     center = self.center();
@@ -0,0 +1,613 @@
+# -*- coding: utf-8 -*-
+"""
+Worm Postures
+
+Library of worm postures from successfully fitted frames with a nearest
+neighbour index to initialize shape fits of new images, and banks of
+rendered posture templates for a global search by FFT template matching.
+
+Example:
+
+  >>>import worm.postures as wpos
+  >>>library = wpos.posture_library_from_shapes(shapes, status = shape_info['success'])
+  >>>ids, dist, centers, widths = library.match(image, k = 5)
+  >>>bank = wpos.TemplateBank(library.center, library.width, nangles = 36)
+  >>>posture, angle, xy, score = bank.match(images)
+
+See also:
+  :mod:`worm.shapes`, :meth:`worm.model.WormModel.from_image`
+"""
+
+__license__ = 'MIT License <http://www.opensource.org/licenses/mit-license.php>'
+__author__ = 'Christoph Kirst <ckirst@rockefeller.edu>'
+__docformat__ = 'rest'
+
+
+import numpy as np
+import scipy.ndimage as nd
+import scipy.fft as fft
+import cv2
+from scipy.spatial import cKDTree
+from skimage.filters import threshold_otsu
+
+from imageprocessing.masking import mask_to_phi_band, mask_from_polygon
+
+import worm.geometry as wgeo
+from worm.model import WormModelBatch
+
+
+##############################################################################
+### Canonical frame
+
+def mask_moments(mask):
+  """Centroids and principal axis angles of masks
+
+  Arguments:
+    mask (...xhxw array): masks
+
+  Returns:
+    ...x2 array: centroids as (x,y) coordinates
+    ... array: angles of the principal axes with the x axis
+  """
+  mask = np.asarray(mask, dtype = float);
+  h, w = mask.shape[-2:];
+  x = np.arange(w, dtype = float); y = np.arange(h, dtype = float);
+
+  mx = np.sum(mask, axis = -2); my = np.sum(mask, axis = -1);
+  m00 = np.sum(mx, axis = -1);
+  m00 = np.where(m00 > 0, m00, 1);
+  cx = mx.dot(x) / m00; cy = my.dot(y) / m00;
+  mu20 = mx.dot(x * x) / m00 - cx * cx;
+  mu02 = my.dot(y * y) / m00 - cy * cy;
+  mu11 = np.einsum('...ij,i,j->...', mask, y, x) / m00 - cx * cy;
+
+  return np.stack([cx, cy], axis = -1), 0.5 * np.arctan2(2 * mu11, mu20 - mu02);
+
+
+def _rotation(angle):
+  """Rotation matrices ...x2x2 for the angles"""
+  c = np.cos(angle); s = np.sin(angle);
+  return np.stack([np.stack([c, -s], axis = -1), np.stack([s, c], axis = -1)], axis = -2);
+
+
+def canonical_centers(center, width, chunk_size = 256):
+  """Transforms center lines into the canonical frame of their shapes
+
+  Arguments:
+    center (Bxnx2 array): center lines
+    width (Bxn array): width profiles
+    chunk_size (int): number of shapes rendered at once
+
+  Returns:
+    Bxnx2 array: center lines with the centroid of the rendered shape at the origin and
+                 its principal axis along the x axis
+  """
+  center = np.array(center, dtype = float);
+  width = np.asarray(width, dtype = float);
+
+  # render in a canvas centered on the center lines
+  center -= np.mean(center, axis = 1)[:,np.newaxis,:];
+  extent = np.max(np.abs(center)) + np.max(width) + 2;
+  size = 2 * int(np.ceil(extent)) + 1;
+  offset = (size - 1) / 2.0;
+
+  for c0 in range(0, center.shape[0], chunk_size):
+    c = center[c0:c0+chunk_size];
+    left, right = wgeo.shape_from_center_discrete_batch(c, width[c0:c0+chunk_size]);
+    mask = mask_from_polygon(np.concatenate([left, right[:,::-1]], axis = 1) + offset, (size, size));
+    centroid, angle = mask_moments(mask);
+    c -= centroid[:,np.newaxis,:] - offset;
+    center[c0:c0+chunk_size] = np.einsum('bij,bnj->bni', _rotation(-angle), c);
+
+  return center;
+
+
+##############################################################################
+### Posture library
+
+class PostureLibrary(object):
+  """Library of worm postures indexed by the shapes they render to
+
+  Note:
+    Postures are stored in the canonical frame in which the rendered worm shape
+    has its centroid at the origin and its principal axis along x. Each posture
+    is represented by the clipped contour representation (phi) of its shape
+    rendered on a coarse size x size grid with the given pixel size. The
+    signatures are compressed by PCA and indexed by a KD-tree. Crops are
+    normalized the same way in the two orientations and two mirror images
+    of their principal axis so that a single tree query finds the k most
+    similar postures and their placement in the crop.
+  """
+
+  def __init__(self, center = None, width = None, size = 32, pixel = 4.0, band = 4, ncomponents = 32):
+    """Constructor of PostureLibrary
+
+    Arguments:
+      center (Bxnx2 array or None): center lines of the postures
+      width (Bxn array, n array or None): width profiles of the postures (if None use default profile)
+      size (int): size of the signature grid
+      pixel (float): size of the signature grid pixels in image pixel
+      band (int): clip the contour representations to this band in grid pixels
+      ncomponents (int): number of principal components used in the index
+    """
+    self.size = size;
+    self.pixel = float(pixel);
+    self.band = band;
+    self.ncomponents = ncomponents;
+
+    self.center = None;
+    self.width = None;
+    self.signatures = None;
+    self._tree = None;
+
+    if center is not None:
+      self.add(center, width);
+
+
+  def __len__(self):
+    return 0 if self.center is None else self.center.shape[0];
+
+
+  def add(self, center, width = None):
+    """Adds postures to the library
+
+    Arguments:
+      center (Bxnx2 or nx2 array): center lines
+      width (Bxn, n array or None): width profiles (if None use default profile)
+    """
+    center = np.asarray(center, dtype = float);
+    if center.ndim == 2:
+      center = center[np.newaxis];
+    if width is None:
+      width = wgeo.default_width(center.shape[1]);
+    width = np.asarray(width, dtype = float);
+    if width.ndim == 1:
+      width = np.repeat(width[np.newaxis], center.shape[0], axis = 0);
+
+    if self.center is not None and self.center.shape[1] != center.shape[1]:
+      raise ValueError('Number of sample points %d does not match the library %d' % (center.shape[1], self.center.shape[1]));
+
+    center = canonical_centers(center, width);
+    signatures = self.signature_from_center(center, width);
+
+    if self.center is None:
+      self.center, self.width, self.signatures = center, width, signatures;
+    else:
+      self.center = np.concatenate([self.center, center]);
+      self.width = np.concatenate([self.width, width]);
+      self.signatures = np.concatenate([self.signatures, signatures]);
+    self._tree = None;
+
+
+  def theta(self):
+    """Bending angles of the postures as Bxn-2 array"""
+    return wgeo.theta_from_center_discrete_batch(self.center)[0];
+
+
+  ############################################################################
+  ### Signatures
+
+  def signature_from_center(self, center, width):
+    """Signatures of shapes given in the canonical frame
+
+    Arguments:
+      center (Bxnx2 array): center lines in the canonical frame
+      width (Bxn array): width profiles
+
+    Returns:
+      Bxsize*size array: signatures
+    """
+    left, right = wgeo.shape_from_center_discrete_batch(center, width);
+    polygon = np.concatenate([left, right[:,::-1]], axis = 1) / self.pixel + (self.size - 1) / 2.0;
+    mask = mask_from_polygon(polygon, (self.size, self.size));
+    phi = mask_to_phi_band(mask, band = self.band);
+    return np.asarray(np.reshape(phi, (phi.shape[0], -1)), dtype = 'float32');
+
+
+  def signature_from_image(self, image, sigma = 1, absolute_threshold = None, threshold_factor = 0.95):
+    """Signatures of a thresholded image in the canonical frame
+
+    Arguments:
+      image (array): the image
+      sigma (float or None): width of Gaussian smoothing on image, if None use raw image
+      absolute_threshold (float or None): if set use this as the threshold, if None the threshold is set via Otsu
+      threshold_factor (float): in case the threshold is determined by Otsu multiply by this factor
+
+    Returns:
+      4xsize*size array: signatures for the two orientations and mirror images of the principal axis
+      4x2x2 array: linear transformations from the canonical frame to the image
+      2 array: centroid of the worm in the image
+    """
+    if sigma is not None:
+      imgs = nd.gaussian_filter(np.asarray(image, dtype = float), sigma);
+    else:
+      imgs = np.asarray(image, dtype = float);
+    if absolute_threshold is not None:
+      level = absolute_threshold;
+    else:
+      level = threshold_factor * threshold_otsu(imgs);
+    mask = imgs >= level;
+
+    centroid, angle = mask_moments(mask);
+
+    # transformations from the canonical frame to the image
+    rotation = _rotation(angle);
+    mirror = np.array([[1,0],[0,-1]], dtype = float);
+    transforms = np.array([rotation, -rotation, rotation.dot(mirror), -rotation.dot(mirror)]);
+
+    # resample the anti-aliased mask on the signature grid
+    smooth = cv2.GaussianBlur(np.asarray(mask, dtype = 'float32'), ksize = (0,0), sigmaX = self.pixel / 2);
+    grid = (self.size - 1) / 2.0;
+    signatures = [];
+    for t in transforms:
+      a = t * self.pixel;
+      warp = np.hstack([a, (centroid - a.dot([grid, grid]))[:,np.newaxis]]);
+      m = cv2.warpAffine(smooth, warp, (self.size, self.size), flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP);
+      signatures.append(m >= 0.5);
+    phi = mask_to_phi_band(np.array(signatures), band = self.band);
+
+    return np.asarray(np.reshape(phi, (4, -1)), dtype = 'float32'), transforms, centroid;
+
+
+  ############################################################################
+  ### Index
+
+  def build_index(self):
+    """Builds the PCA compressed KD-tree index of the signatures"""
+    self._mean = np.mean(self.signatures, axis = 0);
+    ncomponents = min(self.ncomponents, len(self), self.signatures.shape[1]);
+    u, s, v = np.linalg.svd(self.signatures - self._mean, full_matrices = False);
+    self._components = v[:ncomponents];
+    self._tree = cKDTree((self.signatures - self._mean).dot(self._components.T));
+
+
+  def query(self, signatures, k = 5):
+    """Nearest postures to signatures
+
+    Arguments:
+      signatures (Bxsize*size array): signatures
+      k (int): number of neighbours
+
+    Returns:
+      Bxk array: distances in the PCA space
+      Bxk array: posture ids
+    """
+    if self._tree is None:
+      self.build_index();
+    k = min(k, len(self));
+    dist, ids = self._tree.query((np.asarray(signatures) - self._mean).dot(self._components.T), k = k);
+    return np.reshape(dist, (-1, k)), np.reshape(ids, (-1, k));
+
+
+  def match(self, image, k = 5, sigma = 1, absolute_threshold = None, threshold_factor = 0.95):
+    """The k best matching postures placed in an image
+
+    Arguments:
+      image (array): the image
+      k (int): number of postures to return
+      sigma, absolute_threshold, threshold_factor: image thresholding, see :meth:`signature_from_image`
+
+    Returns:
+      k array: posture ids
+      k array: distances of the signatures
+      kxnx2 array: center lines of the postures in image coordinates
+      kxn array: width profiles of the postures
+    """
+    signatures, transforms, centroid = self.signature_from_image(image, sigma = sigma,
+                                                                 absolute_threshold = absolute_threshold,
+                                                                 threshold_factor = threshold_factor);
+    dist, ids = self.query(signatures, k = k);
+
+    # best k over all orientations
+    order = np.argsort(dist, axis = None)[:k];
+    variant, nn = np.unravel_index(order, dist.shape);
+    ids = ids[variant, nn];
+
+    center = np.einsum('bij,bnj->bni', transforms[variant], self.center[ids]) + centroid;
+    return ids, dist[variant, nn], center, self.width[ids];
+
+
+  ############################################################################
+  ### IO
+
+  def save(self, filename):
+    """Saves the postures and parameter of the library to a npz file"""
+    np.savez(filename, center = self.center, width = self.width,
+             size = self.size, pixel = self.pixel, band = self.band, ncomponents = self.ncomponents);
+
+
+def load_posture_library(filename):
+  """Loads a posture library saved with :meth:`PostureLibrary.save`"""
+  data = np.load(filename);
+  library = PostureLibrary(size = int(data['size']), pixel = float(data['pixel']),
+                           band = int(data['band']), ncomponents = int(data['ncomponents']));
+  library.center = data['center'];
+  library.width = data['width'];
+  library.signatures = library.signature_from_center(library.center, library.width);
+  return library;
+
+
+def posture_library_from_shapes(shapes, frames = None, status = None, max_postures = 5000, random_state = None, **kwargs):
+  """Builds a posture library from the fitted shapes of a recording
+
+  Arguments:
+    shapes (nframesx3xnpoints array): shapes of a recording as stored by :mod:`scripts.detect_worm_shape`
+    frames (array or None): frames to use, if None all frames
+    status (array or None): status of the frames, only frames with non-negative status are used
+    max_postures (int or all): maximal number of postures randomly selected from the frames
+    random_state (int, RandomState or None): random number generator or seed for the selection
+    kwargs: arguments passed to :class:`PostureLibrary`
+
+  Returns:
+    PostureLibrary: the posture library
+  """
+  if frames is None:
+    frames = np.arange(shapes.shape[0]);
+  frames = np.asarray(frames, dtype = int);
+  if status is not None:
+    frames = frames[np.asarray(status)[frames] >= 0];
+
+  if max_postures is not all and len(frames) > max_postures:
+    if not isinstance(random_state, np.random.RandomState):
+      random_state = np.random.RandomState(random_state);
+    frames = np.sort(random_state.choice(frames, max_postures, replace = False));
+
+  s = np.asarray(shapes[frames], dtype = float);
+  valid = np.all(np.isfinite(s), axis = (1,2));
+  s = s[valid];
+
+  return PostureLibrary(center = np.transpose(s[:,:2], (0,2,1)), width = s[:,2], **kwargs);
+
+
+
+
+##############################################################################
+### Template matching
+
+class TemplateBank(object):
+  """Bank of rendered worm masks for many postures and rotations
+  
+  Note:
+    The postures are rendered in their canonical frame rotated by nangles 
+    equally spaced angles at full resolution and averaged over scale x scale 
+    blocks, giving anti-aliased templates with the covered fraction of each 
+    grid pixel. Frames are thresholded at full resolution, averaged in the 
+    same way and converted to +1 inside and -1 outside the worm. The cross 
+    correlation of a template with this score is the overlap with the 
+    foreground minus the overlap with the background, so its maximum over all
+    templates and translations is the placement minimizing the mismatch area.
+    The fractional coverage resolves sub grid pixel differences that tie 
+    for binary templates. All correlations are calculated by FFTs batched 
+    over frames and chunks of templates.
+  """
+  
+  def __init__(self, center, width = None, nangles = 36, scale = 2, mirror = True):
+    """Constructor of TemplateBank
+    
+    Arguments:
+      center (Bxnx2 array): center lines of the postures
+      width (Bxn, n array or None): width profiles of the postures (if None use default profile)
+      nangles (int): number of rotations of each posture
+      scale (int): downsampling factor of templates and frames
+      mirror (bool): if True also add the mirror images of the postures
+    """
+    center = np.asarray(center, dtype = float);
+    if width is None:
+      width = wgeo.default_width(center.shape[1]);
+    width = np.asarray(width, dtype = float);
+    if width.ndim == 1:
+      width = np.repeat(width[np.newaxis], center.shape[0], axis = 0);
+    
+    center = canonical_centers(center, width);
+    if mirror:
+      center = np.concatenate([center, center * [1,-1]]);
+      width = np.concatenate([width, width]);
+    
+    self.center = center;
+    self.width = width;
+    self.angles = np.linspace(0, 2 * np.pi, nangles, endpoint = False);
+    self.scale = scale;
+    
+    # template grid centered on the centroids
+    extent = (np.max(np.linalg.norm(center, axis = 2)) + np.max(width)) / scale;
+    self.size = 2 * int(np.ceil(extent)) + 3;
+    self.templates = self.render();
+  
+  
+  def __len__(self):
+    return self.center.shape[0] * len(self.angles);
+  
+  
+  def index(self, template):
+    """Posture ids and rotation angles of template ids"""
+    return template // len(self.angles), self.angles[template % len(self.angles)];
+  
+  
+  def centers(self, template, xy):
+    """Center lines and widths of templates placed at positions in full resolution coordinates
+    
+    Arguments:
+      template (array): template ids
+      xy (...x2 array): positions of the template centers
+    
+    Returns:
+      ...xnx2 array: center lines
+      ...xn array: width profiles
+    """
+    posture, angle = self.index(np.asarray(template));
+    rotation = _rotation(angle);
+    center = np.einsum('...ij,...nj->...ni', rotation, self.center[posture]);
+    return center + np.asarray(xy)[...,np.newaxis,:], self.width[posture];
+  
+  
+  def render(self, chunk_size = 1024):
+    """Renders the templates as Bxsizexsize anti-aliased masks via :meth:`worm.model.WormModelBatch.mask`"""
+    rotation = _rotation(self.angles);
+    center = np.einsum('rij,bnj->brni', rotation, self.center);
+    # full resolution coordinates, grid pixel i covers pixels i * scale to (i + 1) * scale - 1
+    center = np.reshape(center, (-1,) + center.shape[2:]) + ((self.size - 1) * self.scale + self.scale - 1) / 2.0;
+    width = np.repeat(self.width, len(self.angles), axis = 0);
+    
+    n = self.size * self.scale;
+    templates = np.zeros((center.shape[0], self.size, self.size), dtype = 'float32');
+    for c in range(0, center.shape[0], chunk_size):
+      masks = WormModelBatch(center = center[c:c+chunk_size], width = width[c:c+chunk_size]).mask(size = (n, n));
+      masks = np.reshape(masks, (-1, self.size, self.scale, self.size, self.scale));
+      templates[c:c+chunk_size] = np.mean(masks, axis = (2,4));
+    return templates;
+  
+  
+  ############################################################################
+  ### Matching
+  
+  def scores(self, images, sigma = 1, absolute_threshold = None, threshold_factor = 0.95):
+    """Downsampled match scores of images, +1 inside and -1 outside the worm
+    
+    Arguments:
+      images (Fxhxw array): full resolution images
+      sigma, absolute_threshold, threshold_factor: image thresholding as in :func:`worm.costs.image_pyramid`
+    
+    Returns:
+      array: Fxh'xw' scores, 2 * fraction of foreground - 1 in each grid pixel
+      2 array: coordinate scale factors (x,y) of the downsampled grid
+    """
+    images = np.asarray(images, dtype = float);
+    if images.ndim == 2:
+      images = images[np.newaxis];
+    h, w = images.shape[-2:];
+    size = (max(int(round(w / float(self.scale))), 1), max(int(round(h / float(self.scale))), 1));
+    factor = np.array([w / float(size[0]), h / float(size[1])]);
+    
+    scores = np.zeros((images.shape[0], size[1], size[0]), dtype = 'float32');
+    for image, score in zip(images, scores):
+      if sigma is not None:
+        image = nd.gaussian_filter(image, sigma);
+      if absolute_threshold is not None:
+        level = absolute_threshold;
+      else:
+        level = threshold_factor * threshold_otsu(image);
+      mask = np.asarray(image >= level, dtype = 'float32');
+      if size != (w, h):
+        mask = cv2.resize(mask, size, interpolation = cv2.INTER_AREA);
+      score[:] = 2 * mask - 1;
+    return scores, factor;
+  
+  
+  def match(self, images, k = 1, margin = 4, chunk_size = 2**24, sigma = 1, absolute_threshold = None, threshold_factor = 0.95, 
+            with_template = False):
+    """Best matching templates for a stack of images
+    
+    Arguments:
+      images (Fxhxw or hxw array): full resolution images
+      k (int): number of best templates to return per image
+      margin (int or all): search template positions within this distance in grid pixel 
+                           from the centroid of the foreground, if all search all positions
+      chunk_size (int): maximal number of correlation values calculated at once
+      sigma, absolute_threshold, threshold_factor: image thresholding as in :func:`worm.costs.image_pyramid`
+      with_template (bool): if True return template ids instead of posture ids and rotation angles
+    
+    Returns:
+      Fxk array: posture ids
+      Fxk array: rotation angles
+      Fxkx2 array: positions of the posture centroids in full resolution coordinates
+      Fxk array: scores, overlap with the foreground minus overlap with the background in grid pixel
+    
+    Note:
+      Use :meth:`centers` on the template ids or :meth:`starts` to obtain the 
+      corresponding worm shapes as seeds for a local fit.
+      
+      As the templates are centered on the centroids of the postures, the best
+      positions are close to the centroid of the foreground and a small margin 
+      reduces the size of the FFTs considerably.
+    """
+    scores, factor = self.scores(images, sigma = sigma, absolute_threshold = absolute_threshold, threshold_factor = threshold_factor);
+    nf, h, w = scores.shape;
+    
+    # search windows padded with background, correlations at shifts up to 2 * margin do not wrap around
+    if margin is all:
+      margin = max(h, w);
+    r = (self.size - 1) // 2;
+    size = fft.next_fast_len(self.size + 2 * margin, real = True);
+    origin = np.round(mask_moments(scores >= 0)[0]).astype(int) - (r + margin);
+    padded = np.pad(scores, ((0,0), (size,size), (size,size)), mode = 'constant', constant_values = -1);
+    windows = np.array([p[o[1]+size:o[1]+2*size, o[0]+size:o[0]+2*size] for p,o in zip(padded, origin)]);
+    fwindows = fft.rfft2(windows, workers = -1);
+    nw = 2 * margin + 1;
+    
+    ntemplates = len(self);
+    best = np.zeros((nf, ntemplates), dtype = 'float32');
+    position = np.zeros((nf, ntemplates), dtype = int);
+    nchunk = max(1, chunk_size // (nf * size * size));
+    for t0 in range(0, ntemplates, nchunk):
+      ftemplates = np.conj(fft.rfft2(self.templates[t0:t0+nchunk], s = (size, size), workers = -1));
+      corr = fft.irfft2(fwindows[:,np.newaxis] * ftemplates[np.newaxis], s = (size, size), workers = -1)[...,:nw,:nw];
+      corr = np.reshape(corr, corr.shape[:2] + (-1,));
+      position[:,t0:t0+nchunk] = np.argmax(corr, axis = 2);
+      best[:,t0:t0+nchunk] = np.take_along_axis(corr, position[:,t0:t0+nchunk,np.newaxis], axis = 2)[...,0];
+    
+    k = min(k, ntemplates);
+    template = np.argsort(-best, axis = 1)[:,:k];
+    score = np.take_along_axis(best, template, axis = 1);
+    y, x = np.unravel_index(np.take_along_axis(position, template, axis = 1), (nw, nw));
+    xy = np.stack([x, y], axis = -1) + (origin + r)[:,np.newaxis,:];
+    xy = (xy + 0.5) * factor - 0.5;
+    
+    if with_template:
+      return template, xy, score;
+    posture, angle = self.index(template);
+    return posture, angle, xy, score;
+  
+  
+  def starts(self, images, k = 1, **kwargs):
+    """Center lines and widths of the k best matching templates for each image
+    
+    Arguments:
+      images (Fxhxw or hxw array): full resolution images
+      k (int): number of best templates per image
+      kwargs: further arguments passed to :meth:`match`
+    
+    Returns:
+      Fxkxnx2 array: center lines in full resolution coordinates
+      Fxkxn array: width profiles
+    """
+    template, xy, score = self.match(images, k = k, with_template = True, **kwargs);
+    return self.centers(template, xy);
+
+
+def test():
+  import numpy as np
+  import matplotlib.pyplot as plt
+  import worm.model as wm
+  import worm.postures as wpos
+
+  # random postures
+  b = wm.WormModelBatch(npoints = 21, nmodels = 500);
+  b.stretch(70);
+  b.bend(np.random.randn(500) * 2);
+  b.bend(np.random.randn(500) * 2, head = False);
+  library = wpos.PostureLibrary(center = b.center, width = b.width);
+
+  # match a rotated posture
+  w = b.model(7);
+  w.rotate(1.0);
+  image = w.mask() * 200.0;
+  ids, dist, centers, widths = library.match(image, k = 3, absolute_threshold = 100);
+  print(ids, dist)
+
+  plt.figure(1); plt.clf();
+  plt.subplot(1,2,1);
+  plt.imshow(image);
+  for c in centers:
+    plt.plot(c[:,0], c[:,1]);
+  
+  # global search by template matching
+  bank = wpos.TemplateBank(b.center[:50], b.width[:50], nangles = 36);
+  centers, widths = bank.starts(image, k = 3, absolute_threshold = 100);
+  plt.subplot(1,2,2);
+  plt.imshow(image);
+  for c in centers[0]:
+    plt.plot(c[:,0], c[:,1]);
+
+
+if __name__ == "__main__":
+  test();
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+Worm Shapes
+
+Routines operating on the shapes of whole recordings stored as arrays or
+memmaps (e.g. the *_shapes.npy files of :mod:`scripts.detect_worm_shape`).
+
+The shapes array has the form (nframes, 3, npoints) with the rows being the
+x and y coordinates of the center line and the width profile. Contours
+are stored as (nframes, 4, ncontour) arrays with rows the x, y coordinates
+of the left and right side lines.
+
+See also:
+  :mod:`worm.geometry`
+"""
+
+__license__ = 'MIT License <http://www.opensource.org/licenses/mit-license.php>'
+__author__ = 'Christoph Kirst <ckirst@rockefeller.edu>'
+__docformat__ = 'rest'
+
+
+import numpy as np
+
+import interpolation.fourier as fourier
+
+import worm.geometry as wgeo
+
+
+##############################################################################
+### Shape conversions
+
+def _output(out, shape, dtype = float):
+  """Output array, a new array if out is None, a memmap if out is a file name"""
+  if out is None:
+    return np.zeros(shape, dtype = dtype);
+  elif isinstance(out, str):
+    return np.lib.format.open_memmap(out, mode = 'w+', shape = shape, dtype = dtype);
+  else:
+    return out;
+
+
+def theta_from_shapes(shapes, frames = None, theta = None, orientation = None, xy = None, length = None, chunk_size = 10000):
+  """Bending angles of the center lines of a recording
+
+  Arguments:
+    shapes (nx3xm array or memmap): center lines and widths
+    frames (array or None): ids of the frames to convert, if None all frames
+    theta, orientation, xy, length (array, memmap, str or None): output arrays or npy files to write to
+    chunk_size (int): number of frames to process at once
+
+  Returns:
+    kxm-2 array: bending angles along the center lines
+    k array: absolute orientations
+    kx2 array: positions
+    k array: lengths
+
+  Note:
+    The shapes are processed in chunks so that memmaps are streamed with
+    bounded memory, see :func:`worm.geometry.theta_from_center_discrete_batch`.
+  """
+  if frames is None:
+    frames = np.arange(shapes.shape[0]);
+  nf = len(frames);
+  npoints = shapes.shape[2];
+
+  theta = _output(theta, (nf, npoints-2));
+  orientation = _output(orientation, (nf,));
+  xy = _output(xy, (nf, 2));
+  length = _output(length, (nf,));
+
+  for c in range(0, nf, chunk_size):
+    fids = frames[c:c+chunk_size];
+    center = np.asarray(shapes[fids,:2], dtype = float).transpose([0,2,1]);
+    res = wgeo.theta_from_center_discrete_batch(center);
+    for o,r in zip([theta, orientation, xy, length], res):
+      o[c:c+chunk_size] = r;
+
+  return theta, orientation, xy, length;
+
+
+def shapes_from_theta(theta, orientation, xy, length, width, shapes = None, chunk_size = 10000):
+  """Center lines and widths of a recording from bending angles
+
+  Arguments:
+    theta (kxm-2 array or memmap): bending angles along the center lines
+    orientation (k array): absolute orientations
+    xy (kx2 array): positions
+    length (k array): lengths
+    width (kxm or m array): width profiles
+    shapes (kx3xm array, memmap, str or None): output array or npy file to write to
+    chunk_size (int): number of frames to process at once
+
+  Returns:
+    kx3xm array: center lines and widths
+  """
+  nf, nt = theta.shape;
+  shapes = _output(shapes, (nf, 3, nt+2), dtype = 'float32');
+  width = np.asarray(width);
+
+  for c in range(0, nf, chunk_size):
+    center = wgeo.center_from_theta_discrete_batch(theta[c:c+chunk_size], orientation = orientation[c:c+chunk_size],
+                                                   xy = xy[c:c+chunk_size], length = length[c:c+chunk_size]);
+    shapes[c:c+chunk_size,:2] = center.transpose([0,2,1]);
+    shapes[c:c+chunk_size,2] = width[c:c+chunk_size] if width.ndim == 2 else width;
+
+  return shapes;
+
+
+def sides_from_shapes(shapes, frames = None, chunk_size = 10000):
+  """Left and right side lines of the shapes of a recording
+
+  Arguments:
+    shapes (nx3xm array or memmap): center lines and widths
+    frames (array or None): ids of the frames to convert, if None all frames
+    chunk_size (int): number of frames to process at once
+
+  Returns:
+    kxmx2 array: left side lines
+    kxmx2 array: right side lines
+  """
+  if frames is None:
+    frames = np.arange(shapes.shape[0]);
+  nf = len(frames);
+  npoints = shapes.shape[2];
+
+  left = np.zeros((nf, npoints, 2));
+  right = np.zeros((nf, npoints, 2));
+  for c in range(0, nf, chunk_size):
+    fids = frames[c:c+chunk_size];
+    shp = np.asarray(shapes[fids], dtype = float);
+    left[c:c+chunk_size], right[c:c+chunk_size] = wgeo.shape_from_center_discrete_batch(shp[:,:2].transpose([0,2,1]), shp[:,2]);
+
+  return left, right;
+
+
+def contours_closed(contours):
+  """Closed contours from the stored side lines
+
+  Arguments:
+    contours (nx4xk array): left and right side lines, both running from head to tail
+
+  Returns:
+    nx2k-2x2 array: closed contours (left side followed by the reversed right side)
+  """
+  contours = np.asarray(contours, dtype = float);
+  left = contours[:,:2].transpose([0,2,1]);
+  right = contours[:,2:].transpose([0,2,1]);
+  return np.concatenate([left, right[:,-2:0:-1]], axis = 1);
+
+
+def curvature_from_contours(contours, frames = None, sigma = None, cutoff = None, chunk_size = 10000):
+  """Curvature along the closed contours of a recording
+
+  Arguments:
+    contours (nx4xk array or memmap): left and right side lines
+    frames (array or None): ids of the frames to process, if None all frames
+    sigma (float or None): Gaussian smoothing width in units of contour points
+    cutoff (int or None): maximal frequency of the Fourier descriptors to keep
+    chunk_size (int): number of frames to process at once
+
+  Returns:
+    kx2k-2 array: curvature along the closed contours
+
+  Note:
+    The curvature is calculated with Fourier descriptors, see :mod:`interpolation.fourier`.
+  """
+  if frames is None:
+    frames = np.arange(contours.shape[0]);
+  nf = len(frames);
+  npoints = 2 * contours.shape[2] - 2;
+
+  k = np.zeros((nf, npoints));
+  for c in range(0, nf, chunk_size):
+    cnt = contours_closed(contours[frames[c:c+chunk_size]]);
+    k[c:c+chunk_size] = fourier.curvature(cnt, sigma = sigma, cutoff = cutoff);
+  return k;
+
+
+def head_tail_candidates_from_contours(contours, frames = None, delta = 0.3, max_curvature = -0.5, nextra = 20, chunk_size = 10000):
+  """Head and tail candidates along the closed contours of a recording
+
+  Arguments:
+    contours (nx4xk array or memmap): left and right side lines
+    frames (array or None): ids of the frames to process, if None all frames
+    delta (float): min height of peak in curvature to detect the head
+    max_curvature (float or None): the peak should have at least a curvature less than this
+    nextra (int): number of points the curvature is extended periodically for the peak detection
+    chunk_size (int): number of frames to process at once
+
+  Returns:
+    kx2k-2 array of bools: candidate positions along the closed contours
+    kx2 array: sorted indices of the two strongest candidates, -1 if missing
+    k array: number of candidates
+
+  Note:
+    Uses the discrete curvature of :func:`worm.geometry.head_tail_from_contour_discrete`
+    and detects the peaks for all frames of a chunk in one pass.
+  """
+  if frames is None:
+    frames = np.arange(contours.shape[0]);
+  nf = len(frames);
+  npoints = 2 * contours.shape[2] - 2;
+
+  candidates = np.zeros((nf, npoints), dtype = bool);
+  ids = np.zeros((nf, 2), dtype = int);
+  ncandidates = np.zeros(nf, dtype = int);
+  for c in range(0, nf, chunk_size):
+    cnt = contours_closed(contours[frames[c:c+chunk_size]]);
+    k = wgeo.curvature_from_contour_discrete(np.concatenate([cnt, cnt[:,:1]], axis = 1))[:,:-1];
+    candidates[c:c+chunk_size] = wgeo.head_tail_candidates_discrete(k, delta = delta, max_curvature = max_curvature, nextra = nextra);
+    ids[c:c+chunk_size], ncandidates[c:c+chunk_size] = wgeo.head_tail_from_candidates(k, candidates[c:c+chunk_size]);
+  return candidates, ids, ncandidates;
+
+
+##############################################################################
+### Head tail orientation
+
+def valid_frames(shapes, status = None, chunk_size = 100000):
+  """Frames with a detected shape
+
+  Arguments:
+    shapes (nx3xm array): center lines and widths
+    status (n array or None): status of the shape detection, if None frames with non-zero shapes are valid
+    chunk_size (int): number of frames to process at once
+
+  Returns:
+    array: ids of valid frames
+  """
+  if status is not None:
+    return np.where(np.asarray(status) >= 0)[0];
+
+  nframes = shapes.shape[0];
+  valid = np.zeros(nframes, dtype = bool);
+  for c in range(0, nframes, chunk_size):
+    valid[c:c+chunk_size] = np.any(shapes[c:c+chunk_size,:2] != 0, axis = (1,2));
+  return np.where(valid)[0];
+
+
+def head_tail_costs(shapes, frames = None, status = None, max_gap = 3, weight_motion = 1.0, chunk_size = 100000):
+  """Costs for keeping or flipping head and tail of center lines in consecutive frames
+
+  Arguments:
+    shapes (nx3xm array): center lines and widths
+    frames (array or None): ids of frames to include, if None use :func:`valid_frames`
+    status (n array or None): status of the shape detection used to determine valid frames
+    max_gap (int): maximal number of frames between two frames to link them
+    weight_motion (float): weight of the prior that worms move towards their head
+    chunk_size (int): number of frames to process at once
+
+  Returns:
+    array: ids of the frames
+    array: costs for the frame to be flipped relative to not being flipped
+    array: transition costs for equal orientation of a frame and its predecessor
+    array: transition costs for opposite orientation of a frame and its predecessor
+
+  Note:
+    The transition costs are the mean distances between the center line and the
+    center line or the reversed center line in the previous frame. The motion prior
+    is the displacement of the center towards the head.
+  """
+  if frames is None:
+    frames = valid_frames(shapes, status = status, chunk_size = chunk_size);
+  frames = np.asarray(frames, dtype = int);
+  nf = len(frames);
+  npoints = shapes.shape[2];
+  n2 = (npoints - 1) // 2;
+
+  unary = np.zeros(nf);
+  same = np.zeros(nf);
+  flip = np.zeros(nf);
+
+  previous = None;
+  for c in range(0, nf, chunk_size):
+    fids = frames[c:c+chunk_size];
+    center = np.asarray(shapes[fids,:2], dtype = float).transpose([0,2,1]);
+
+    if previous is None:
+      prev = np.concatenate([center[:1], center[:-1]]);
+      gap = np.hstack([max_gap + 1, np.diff(fids)]);
+    else:
+      prev = np.concatenate([previous[1][np.newaxis], center[:-1]]);
+      gap = np.diff(np.hstack([previous[0], fids]));
+    previous = (fids[-1], center[-1]);
+
+    linked = gap <= max_gap;
+    same[c:c+chunk_size] = linked * np.mean(np.linalg.norm(center - prev, axis = 2), axis = 1);
+    flip[c:c+chunk_size] = linked * np.mean(np.linalg.norm(center - prev[:,::-1], axis = 2), axis = 1);
+
+    # motion towards head
+    head = center[:,0] - center[:,n2];
+    head /= np.maximum(np.linalg.norm(head, axis = 1), 1e-10)[:,np.newaxis];
+    motion = np.sum((center[:,n2] - prev[:,n2]) * head, axis = 1);
+    unary[c:c+chunk_size] = weight_motion * linked * motion;
+
+  return frames, unary, same, flip;
+
+
+def head_tail_viterbi(unary, same, flip):
+  """Optimal orientation of a sequence of center lines
+
+  Arguments:
+    unary (n array): costs for the frame to be flipped relative to not being flipped
+    same (n array): transition costs for equal orientation of a frame and its predecessor
+    flip (n array): transition costs for opposite orientation of a frame and its predecessor
+
+  Returns:
+    n array of bools: True if the center line of the frame should be flipped
+
+  Note:
+    For two states the Viterbi recursion reduces to the evolution of the cost
+    difference d between the flipped and non-flipped state, which is updated
+    via d <- unary + min(d + same, flip) - min(same, d + flip).
+  """
+  n = len(unary);
+  unary = np.asarray(unary, dtype = float).tolist();
+  same = np.asarray(same, dtype = float).tolist();
+  flip = np.asarray(flip, dtype = float).tolist();
+
+  # back pointers: True if predecessor has same state
+  keep0 = np.zeros(n, dtype = bool);
+  keep1 = np.zeros(n, dtype = bool);
+
+  d = 0.0;
+  for t in range(n):
+    a = same[t]; b = flip[t];
+    keep0[t] = a <= d + b;
+    keep1[t] = d + a <= b;
+    d = unary[t] + min(d + a, b) - min(a, d + b);
+
+  # back tracking
+  flips = np.zeros(n, dtype = bool);
+  s = d < 0;
+  for t in range(n-1, -1, -1):
+    flips[t] = s;
+    if not (keep1[t] if s else keep0[t]):
+      s = not s;
+
+  return flips;
+
+
+def flip_head_tail(shapes, frames, contours = None, shape_info = None, chunk_size = 100000):
+  """Reverses center lines, widths and contours of frames in place
+
+  Arguments:
+    shapes (nx3xm array): center lines and widths
+    frames (array): ids of frames to flip
+    contours (nx4xk array or None): left and right side lines
+    shape_info (structured array or None): shape info with 'center' field to update
+    chunk_size (int): number of frames to process at once
+  """
+  frames = np.asarray(frames, dtype = int);
+  n2 = (shapes.shape[2] - 1) // 2;
+  for c in range(0, len(frames), chunk_size):
+    fids = frames[c:c+chunk_size];
+    shapes[fids] = shapes[fids][:,:,::-1];
+    if contours is not None:
+      cnt = contours[fids];
+      contours[fids] = np.concatenate([cnt[:,2:,::-1], cnt[:,:2,::-1]], axis = 1);
+    if shape_info is not None:
+      shape_info['center'][fids] = shapes[fids][:,:2,n2];
+
+
+def align_head_tail(shapes, contours = None, shape_info = None, status = None, max_gap = 3, weight_motion = 1.0, chunk_size = 100000):
+  """Globally consistent head tail orientation of the shapes of a recording
+
+  Arguments:
+    shapes (nx3xm array or memmap): center lines and widths, reoriented in place
+    contours (nx4xk array, memmap or None): left and right side lines, reoriented in place
+    shape_info (structured array, memmap or None): shape info, the 'center' field is updated
+    status (n array or None): status of the shape detection, if None and shape_info is given its 'success' field is used
+    max_gap (int): maximal number of frames between two frames to link them
+    weight_motion (float): weight of the prior that worms move towards their head
+    chunk_size (int): number of frames to process at once
+
+  Returns:
+    array: ids of the flipped frames
+
+  Note:
+    The orientation minimizes the distances between center lines in consecutive frames
+    plus a prior that the worm moves forward via a Viterbi path over flip / no flip states.
+  """
+  if status is None and shape_info is not None:
+    status = shape_info['success'];
+
+  frames, unary, same, flip = head_tail_costs(shapes, status = status, max_gap = max_gap,
+                                              weight_motion = weight_motion, chunk_size = chunk_size);
+  flips = head_tail_viterbi(unary, same, flip);
+  flipped = frames[flips];
+
+  flip_head_tail(shapes, flipped, contours = contours, shape_info = shape_info, chunk_size = chunk_size);
+  for d in [shapes, contours, shape_info]:
+    if isinstance(d, np.memmap):
+      d.flush();
+
+  return flipped;
+
+
+
+def test():
+  import numpy as np
+  import worm.shapes as wsh
+  reload(wsh);
+
+  # worm moving forward along a sine path with random flips
+  nframes, npoints = 2000, 22;
+  s = np.linspace(0, 1, npoints)[::-1];
+  t = np.arange(nframes) * 0.01;
+  x = (t[:,np.newaxis] + s[np.newaxis,:]) * 50;
+  y = 10 * np.sin(x / 10.0);
+  shapes = np.zeros((nframes, 3, npoints));
+  shapes[:,0] = x; shapes[:,1] = y; shapes[:,2] = 1;
+
+  flipped = np.random.rand(nframes) < 0.3;
+  shapes[flipped] = shapes[flipped][:,:,::-1];
+  status = np.zeros(nframes, dtype = int);
+  status[np.random.rand(nframes) < 0.05] = -1;
+
+  fids = wsh.align_head_tail(shapes, status = status);
+  valid = status >= 0;
+  print('wrongly oriented frames: %d' % np.sum(np.logical_xor(np.isin(np.arange(nframes), fids), flipped)[valid]));
+
+
+if __name__ == "__main__":
+  test();